@@ -1 +1,33 @@
-from .simpleaichat import AIChat, AsyncAIChat, AITool, VandBasicAPITool
+'''
+The public classes are imported on first access, so `import aiapi` does no
+work until AIChat or a tool is actually used.
+'''
+import importlib
+from typing import TYPE_CHECKING
+
+__all__ = ["AIChat", "AsyncAIChat", "AITool", "VandBasicAPITool"]
+
+_LAZY = {
+    "AIChat": ".simpleaichat",
+    "AsyncAIChat": ".simpleaichat",
+    "AITool": ".models",
+    "VandBasicAPITool": ".vand_utils",
+}
+
+if TYPE_CHECKING:
+    from .models import AITool
+    from .simpleaichat import AIChat, AsyncAIChat
+    from .vand_utils import VandBasicAPITool
+
+
+def __getattr__(name: str):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
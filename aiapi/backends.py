@@ -0,0 +1,173 @@
+'''
+Backends: OpenAI-compatible chat completion endpoints, and a router that
+picks one per request.
+
+    from aiapi.backends import Backend, BackendRouter
+
+    Backend.register("local", "http://localhost:8000/v1/chat/completions", models=["llama*", "mistral*"])
+    ai = AIChat(console=False, model="llama3")           # sent to the local server
+
+    Backend.register("azure", "https://.../chat/completions?api-version=...", models=["gpt-4*"], api_key_env="AZURE_KEY")
+    ai = AIChat(console=False, model="gpt-4", router=BackendRouter())
+
+`models` are fnmatch patterns.  Without a router, a session is bound to the
+first registered backend serving its model.  With one, every request goes
+to the serving backend with the best score: an exponentially weighted
+moving average (EWMA) of its latency on successful requests, scaled up by
+its requests in flight and its EWMA error rate.  Backends with no
+measurements yet score best, so each is tried.  A backend whose error rate
+is above `max_error_rate` is only picked when no healthy one is left, so
+one that fails fast never wins on latency.  A failed attempt (transport
+error, 429 or 5xx) is retried on the next backend within the same call.
+Errors are forgiven over `recovery_seconds` so a backend that failed gets
+tried again.
+
+A backend uses its own `key_pool` or key; the session's key pool only
+applies to sessions without a router.
+'''
+import math
+import os
+import threading
+import time
+from fnmatch import fnmatch
+from typing import Any, ClassVar, Dict, List, Optional
+
+from .metrics import registry as metrics
+
+OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
+
+
+class Backend:
+    # registered backends by name, in registration order
+    instances: ClassVar[Dict[str, "Backend"]] = {}
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        models: List[str] = ("*",),
+        api_key: str = None,
+        api_key_env: str = None,
+        key_pool: Any = None,
+        headers: Dict[str, str] = None,
+    ):
+        self.name = name
+        self.url = url
+        self.models = list(models)
+        self.api_key = api_key
+        self.api_key_env = api_key_env
+        self.key_pool = key_pool
+        self.extra_headers = dict(headers or {})
+        # live stats, updated by BackendRouter.record
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.updated_at = 0.0
+        self.inflight = 0
+
+    @classmethod
+    def register(cls, name: str, url: str, **kwargs) -> "Backend":
+        backend = cls.instances[name] = cls(name, url, **kwargs)
+        return backend
+
+    @classmethod
+    def for_model(cls, model: str) -> Optional["Backend"]:
+        return next((b for b in cls.instances.values() if b.supports(model)), None)
+
+    def supports(self, model: str) -> bool:
+        return any(fnmatch(model, pattern) for pattern in self.models)
+
+    def resolve_key(self) -> Optional[str]:
+        return self.api_key or (os.getenv(self.api_key_env) if self.api_key_env else None)
+
+    def headers(self) -> Dict[str, str]:
+        headers = dict(self.extra_headers)
+        key = self.resolve_key()
+        if key:
+            headers["Authorization"] = f"Bearer {key}"
+        return headers
+
+    def __repr__(self) -> str:
+        return f"Backend({self.name}, {self.url})"
+
+
+Backend.register("openai", OPENAI_API_URL, models=["*gpt-*", "o1*", "o3*"], api_key_env="OPENAI_API_KEY")
+
+
+class BackendRouter:
+    def __init__(
+        self,
+        backends: List[str] = None,
+        alpha: float = 0.3,
+        recovery_seconds: float = 30.0,
+        max_error_rate: float = 0.5,
+    ):
+        """`backends` are names of registered backends; all of them by default."""
+        self.names = list(backends) if backends is not None else None
+        self.alpha = alpha
+        self.recovery_seconds = recovery_seconds
+        self.max_error_rate = max_error_rate
+        self._lock = threading.Lock()
+
+    @property
+    def backends(self) -> List[Backend]:
+        if self.names is None:
+            return list(Backend.instances.values())
+        return [Backend.instances[name] for name in self.names]
+
+    def error_rate(self, backend: Backend, now: float) -> float:
+        """The EWMA error rate, decayed over recovery_seconds since the last request."""
+        return backend.error_rate * math.exp(-(now - backend.updated_at) / self.recovery_seconds)
+
+    def score(self, backend: Backend, now: float) -> float:
+        if backend.latency is None:
+            return 0.0
+        error = self.error_rate(backend, now)
+        return backend.latency * (1 + backend.inflight) / max(0.01, 1 - error)
+
+    def candidates(self, model: str, exclude: List[Backend] = ()) -> List[Backend]:
+        """Backends serving `model`, best first; unhealthy ones after all healthy ones."""
+        now = time.monotonic()
+        serving = [b for b in self.backends if b.supports(model) and b not in exclude]
+        return sorted(
+            serving,
+            key=lambda b: (self.error_rate(b, now) > self.max_error_rate, self.score(b, now)),
+        )
+
+    def acquire(self, model: str, exclude: List[Backend] = ()) -> Backend:
+        with self._lock:
+            candidates = self.candidates(model, exclude)
+            if not candidates:
+                raise ValueError(f"No backend serves model {model}.")
+            backend = candidates[0]
+            backend.inflight += 1
+        return backend
+
+    def release(self, backend: Backend) -> None:
+        with self._lock:
+            backend.inflight -= 1
+
+    def record(self, backend: Backend, elapsed: float, ok: bool) -> None:
+        with self._lock:
+            # failures say nothing about how fast the backend serves, and are often quick
+            if ok:
+                backend.latency = elapsed if backend.latency is None else (
+                    self.alpha * elapsed + (1 - self.alpha) * backend.latency
+                )
+            backend.error_rate = self.alpha * (not ok) + (1 - self.alpha) * backend.error_rate
+            backend.updated_at = time.monotonic()
+        metrics.observe("aiapi_backend_latency_seconds", elapsed, backend=backend.name)
+        if not ok:
+            metrics.inc("aiapi_backend_errors_total", backend=backend.name)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [
+            {
+                "backend": b.name,
+                "latency": b.latency,
+                "error_rate": self.error_rate(b, now),
+                "inflight": b.inflight,
+                "score": self.score(b, now),
+            }
+            for b in self.backends
+        ]
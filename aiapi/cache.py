@@ -0,0 +1,134 @@
+'''
+Small caches shared across sessions (in process, optionally persisted to disk).
+'''
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Tuple
+
+import orjson
+
+_MISSING = object()
+
+
+class FailedResult(str):
+    """A tool's error message: sent to the model like any result, but never cached."""
+
+
+def cacheable(result: Any) -> bool:
+    # Vand tools return (message, functions)
+    message = result[0] if isinstance(result, tuple) and result else result
+    return not isinstance(message, FailedResult)
+
+
+def canonical_key(name: str, arguments: dict) -> str:
+    """Stable hash of a function call, independent of argument order."""
+    payload = orjson.dumps([name, arguments], option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(payload).hexdigest()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire `ttl` seconds after being set.
+
+    `max_entries` bounds memory; the least recently used entry is evicted first.
+    """
+
+    def __init__(self, ttl: float = 300, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                expires, value = item
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class PersistentTTLCache(TTLCache):
+    """
+    TTLCache backed by one JSON file per entry in `directory`, so entries
+    survive restarts and are shared by processes on the same machine.
+
+    Values must be serializable by orjson.  Disk errors are ignored: the
+    cache then behaves as memory-only.
+    """
+
+    def __init__(self, directory: str = None, ttl: float = 300, max_entries: int = 256):
+        super().__init__(ttl=ttl, max_entries=max_entries)
+        self.directory = directory
+
+    def _path(self, key: Hashable) -> str:
+        name = hashlib.sha256(orjson.dumps(key)).hexdigest()
+        return os.path.join(self.directory, f"{name}.json")
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = super().get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if self.directory:
+            try:
+                with open(self._path(key), "rb") as f:
+                    entry = orjson.loads(f.read())
+            except (OSError, orjson.JSONDecodeError):
+                entry = None
+            # expiry on disk is wall-clock time, unlike the in-memory entries
+            if entry and entry["expires"] > time.time():
+                with self._lock:
+                    self.misses -= 1
+                    self.hits += 1
+                super().set(key, entry["value"])
+                return entry["value"]
+        return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        super().set(key, value)
+        if not self.directory:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(key)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(orjson.dumps({"expires": time.time() + self.ttl, "value": value}))
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def clear(self) -> None:
+        super().clear()
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
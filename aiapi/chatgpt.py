@@ -1,10 +1,19 @@
-from pydantic import HttpUrl
+import asyncio
+import time
+from contextlib import contextmanager, asynccontextmanager, nullcontext, suppress
+
+from pydantic import Field, HttpUrl
 from httpx import Client, AsyncClient
-from typing import List, Dict, Union, Set, Any
+from typing import Callable, List, Dict, Union, Set, Any, Optional, Tuple
 import orjson
 
 from .models import ChatMessage, ChatSession, AITool
-from .utils import remove_a_key
+from .utils import remove_a_key, estimate_tokens, estimate_usage
+from .partial_json import PartialJSONParser, validate_partial
+from .hooks import HookEvent, TRACE_EVENTS
+from .metrics import registry as metrics
+from .circuit import CircuitOpenError, NO_CALL
+from .keypool import retryable
 
 from .vand_utils import VandBasicAPITool
 
@@ -15,11 +24,41 @@ tool_prompt = """From the list of tools below:
 {tools}"""
 
 
+class _Attempt:
+    __slots__ = ("backend", "key", "pool", "start")
+
+    def __init__(self, backend, key, pool):
+        self.backend = backend
+        self.key = key
+        self.pool = pool
+        self.start = time.perf_counter()
+
+
 class ChatGPTSession(ChatSession):
     api_url: HttpUrl = "https://api.openai.com/v1/chat/completions"
     input_fields: Set[str] = {"role", "content", "name"}
     system: str = "You are a helpful assistant."
     params: Dict[str, Any] = {"temperature": 0.7}
+    # live objects are left out of model_dump (save_session, snapshots, ...)
+    tool_router: Optional[Any] = Field(default=None, exclude=True)
+    function_selector: Optional[Any] = Field(default=None, exclude=True)
+    hooks: Optional[Any] = Field(default=None, exclude=True)
+    # request scheduler (see aiapi.scheduler); priority and tenant default to its defaults and the session id
+    scheduler: Optional[Any] = Field(default=None, exclude=True)
+    priority: Optional[Union[str, int]] = None
+    tenant: Optional[str] = None
+    # spread requests over several API keys (see aiapi.keypool); auth is then only a fallback
+    key_pool: Optional[Any] = Field(default=None, exclude=True)
+    # pick an endpoint per request (see aiapi.backends); api_url and key_pool are then unused,
+    # each backend using its own key_pool or key
+    router: Optional[Any] = Field(default=None, exclude=True)
+    # fail fast when the upstream degrades (see aiapi.circuit), optionally switching models
+    circuit_breaker: Optional[Any] = Field(default=None, exclude=True)
+    fallback_model: Optional[str] = None
+    # seconds to wait on the upstream (connect, each read, ...); None waits forever
+    timeout: Optional[float] = None
+    # ask for a final usage chunk when streaming; turn off for APIs that reject stream_options
+    stream_usage: bool = True
 
     def prepare_request(
         self,
@@ -33,12 +72,17 @@ class ChatGPTSession(ChatSession):
         output_schema: Any = None,
         is_function_calling_required: bool = True,
     ):
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.auth['api_key'].get_secret_value()}",
-        }
+        headers = {"Content-Type": "application/json"}
+        api_key = self.auth["api_key"].get_secret_value()
+        if api_key:  # local backends may not need one
+            headers["Authorization"] = f"Bearer {api_key}"
 
         system_message = ChatMessage(role="system", content=system or self.system)
+        # only send the specs relevant to this turn
+        if functions and self.function_selector and isinstance(prompt, str) and all(
+            isinstance(f, dict) for f in functions
+        ):
+            functions = self.function_selector.select(functions, prompt, self.messages)
         #used for ChatMessage;
         function_list = []
         if functions:
@@ -67,9 +111,15 @@ class ChatGPTSession(ChatSession):
             "stream": stream,
             **gen_params,
         }
+        if stream and self.stream_usage:
+            data["stream_options"] = {"include_usage": True}
 
         if functions:
-            data["functions"] = functions
+            # "x-" keys (e.g. x-cache) are local annotations the API does not accept
+            data["functions"] = [
+                {k: v for k, v in f.items() if not k.startswith("x-")} if isinstance(f, dict) else f
+                for f in functions
+            ]
 
         # Add function calling parameters if a schema is provided
         if input_schema or output_schema:
@@ -102,25 +152,360 @@ class ChatGPTSession(ChatSession):
             "parameters": schema_dict,
         }
 
-    def process_function_call(self, func_call):
+    def _emit(self, name: str, elapsed: float, **data) -> None:
+        self.hooks.on_event(HookEvent(name, self.id, elapsed, data))
+
+    def _trace(self, start: float):
+        # connection-level timings from httpcore, only requested when hooks are set
+        if not self.hooks:
+            return None
+
+        def trace(event_name, info):
+            name = TRACE_EVENTS.get(event_name)
+            if name:
+                self._emit(name, time.perf_counter() - start)
+
+        return {"trace": trace}
+
+    def _trace_async(self, start: float):
+        if not self.hooks:
+            return None
+
+        async def trace(event_name, info):
+            name = TRACE_EVENTS.get(event_name)
+            if name:
+                self._emit(name, time.perf_counter() - start)
+
+        return {"trace": trace}
+
+    def _record_response(self, r: Dict[str, Any], model: str, start: float) -> None:
+        if "error" in r:
+            metrics.inc("aiapi_errors_total", model=model, session=self.id, type="api")
+            return
+        metrics.observe("aiapi_request_duration_seconds", time.perf_counter() - start, model=model)
+        usage = r.get("usage")
+        if usage:
+            metrics.inc("aiapi_prompt_tokens_total", usage.get("prompt_tokens", 0), model=model, session=self.id)
+            metrics.inc("aiapi_completion_tokens_total", usage.get("completion_tokens", 0), model=model, session=self.id)
+
+    def _record_stream(self, model: str, start: float) -> None:
+        metrics.observe("aiapi_stream_duration_seconds", time.perf_counter() - start, model=model)
+
+    def _add_stream_usage(self, usage: Optional[Dict[str, int]], data: Dict[str, Any], completion: str) -> Dict[str, int]:
+        # estimate locally if the API did not send a usage chunk
+        usage = usage or estimate_usage(data, completion)
+        self.total_prompt_length += usage["prompt_tokens"]
+        self.total_completion_length += usage["completion_tokens"]
+        self.total_length += usage["total_tokens"]
+        metrics.inc("aiapi_prompt_tokens_total", usage["prompt_tokens"], model=data["model"], session=self.id)
+        metrics.inc("aiapi_completion_tokens_total", usage["completion_tokens"], model=data["model"], session=self.id)
+        return usage
+
+    def _slot(self):
+        if self.scheduler is None:
+            return nullcontext()
+        return self.scheduler.slot(self.priority, self.tenant or str(self.id))
+
+    def _slot_async(self):
+        if self.scheduler is None:
+            return nullcontext()
+        return self.scheduler.slot_async(self.priority, self.tenant or str(self.id))
+
+    @contextmanager
+    def _circuit(self, data: Dict[str, Any]):
+        """Yields the payload to send and a call to report the status to."""
+        breaker = self.circuit_breaker
+        if breaker is None:
+            yield data, NO_CALL
+            return
+        try:
+            breaker.allow()
+        except CircuitOpenError:
+            if not self.fallback_model or self.fallback_model == data["model"]:
+                raise
+            allowed = False
+        else:
+            allowed = True
+        if not allowed:
+            metrics.inc("aiapi_retries_total", model=data["model"], session=self.id, reason="circuit_open")
+            yield {**data, "model": self.fallback_model}, NO_CALL
+            return
+        with breaker.track() as call:
+            yield data, call
+
+    def _attempt(self, data: Dict[str, Any], headers: Dict[str, str], tried: list):
+        """
+        Pick the backend and API key for the next try; returns the attempt, URL and headers.
+
+        With a router the backend's key_pool is used, never the session's: its keys
+        are for api_url and must not be sent to another endpoint.
+        """
+        backend, pool, url = None, self.key_pool, str(self.api_url)
+        if self.router is not None:
+            backend = self.router.acquire(data["model"], [a.backend for a in tried])
+            url, pool = backend.url, backend.key_pool
+            headers = {**headers, **backend.headers()}
+        key = None
+        if pool is not None:
+            key = pool.acquire([a.key for a in tried if a.key is not None])
+            headers = {**headers, **key.headers()}
+        attempt = _Attempt(backend, key, pool)
+        tried.append(attempt)
+        return attempt, url, headers
+
+    def _release_attempt(self, attempt: "_Attempt") -> None:
+        if attempt.key is not None:
+            attempt.pool.release(attempt.key)
+        if attempt.backend is not None:
+            self.router.release(attempt.backend)
+
+    def _retry(self, attempt: "_Attempt", tried: list, data: Dict[str, Any], r=None, error: Exception = None) -> bool:
+        """Report how an attempt went; True if the request should be tried again elsewhere."""
+        failed = error is not None or retryable(r.status_code)
+        if attempt.backend is not None:
+            self.router.record(attempt.backend, time.perf_counter() - attempt.start, not failed)
+        if attempt.key is not None and r is not None:
+            attempt.pool.report(attempt.key, r.status_code, r.headers)
+        if not failed:
+            return False
+        if attempt.backend is not None:
+            again = bool(self.router.candidates(data["model"], [a.backend for a in tried]))
+        elif attempt.key is not None and error is None:
+            again = len(tried) <= attempt.pool.retries and len(tried) < len(attempt.pool.keys)
+        else:
+            again = False
+        if again:
+            reason = type(error).__name__ if error is not None else str(r.status_code)
+            metrics.inc("aiapi_retries_total", model=data["model"], session=self.id, reason=reason)
+        return again
+
+    def _post(self, client: Client, data: Dict[str, Any], headers: Dict[str, str], start: float) -> Dict[str, Any]:
+        metrics.inc("aiapi_requests_total", model=data["model"], session=self.id)
+        try:
+            with self._slot():
+                with self._circuit(data) as (data, call):
+                    tried = []
+                    while True:
+                        attempt, url, attempt_headers = self._attempt(data, headers, tried)
+                        try:
+                            r = client.post(
+                                url,
+                                json=data,
+                                headers=attempt_headers,
+                                timeout=self.timeout,
+                                extensions=self._trace(start),
+                            )
+                        except Exception as e:
+                            if self._retry(attempt, tried, data, error=e):
+                                continue
+                            raise
+                        finally:
+                            self._release_attempt(attempt)
+                        if not self._retry(attempt, tried, data, r):
+                            break
+                    call.status(r.status_code)
+                    r = r.json()
+        except Exception as e:
+            metrics.inc("aiapi_errors_total", model=data["model"], session=self.id, type=type(e).__name__)
+            raise
+        self._record_response(r, data["model"], start)
+        return r
+
+    async def _post_async(self, client: AsyncClient, data: Dict[str, Any], headers: Dict[str, str], start: float) -> Dict[str, Any]:
+        metrics.inc("aiapi_requests_total", model=data["model"], session=self.id)
+        try:
+            async with self._slot_async():
+                with self._circuit(data) as (data, call):
+                    tried = []
+                    while True:
+                        attempt, url, attempt_headers = self._attempt(data, headers, tried)
+                        try:
+                            r = await client.post(
+                                url,
+                                json=data,
+                                headers=attempt_headers,
+                                timeout=self.timeout,
+                                extensions=self._trace_async(start),
+                            )
+                        except Exception as e:
+                            if self._retry(attempt, tried, data, error=e):
+                                continue
+                            raise
+                        finally:
+                            self._release_attempt(attempt)
+                        if not self._retry(attempt, tried, data, r):
+                            break
+                    call.status(r.status_code)
+                    r = r.json()
+        except Exception as e:
+            metrics.inc("aiapi_errors_total", model=data["model"], session=self.id, type=type(e).__name__)
+            raise
+        self._record_response(r, data["model"], start)
+        return r
+
+    @contextmanager
+    def _stream_request(self, client: Client, data: Dict[str, Any], headers: Dict[str, str], start: float):
+        metrics.inc("aiapi_requests_total", model=data["model"], session=self.id)
+        try:
+            with self._slot():
+                with self._circuit(data) as (data, call):
+                    tried = []
+                    streaming = False
+                    while True:
+                        attempt, url, attempt_headers = self._attempt(data, headers, tried)
+                        try:
+                            with client.stream(
+                                "POST",
+                                url,
+                                json=data,
+                                headers=attempt_headers,
+                                timeout=self.timeout,
+                                extensions=self._trace(start),
+                            ) as r:
+                                if self._retry(attempt, tried, data, r):
+                                    continue
+                                call.status(r.status_code)
+                                streaming = True
+                                yield r
+                        except Exception as e:
+                            # only fail over before any chunk was handed out
+                            if not streaming and self._retry(attempt, tried, data, error=e):
+                                continue
+                            raise
+                        finally:
+                            self._release_attempt(attempt)
+                        break
+        except Exception as e:
+            metrics.inc("aiapi_errors_total", model=data["model"], session=self.id, type=type(e).__name__)
+            raise
+
+    @asynccontextmanager
+    async def _stream_request_async(self, client: AsyncClient, data: Dict[str, Any], headers: Dict[str, str], start: float):
+        metrics.inc("aiapi_requests_total", model=data["model"], session=self.id)
+        try:
+            async with self._slot_async():
+                with self._circuit(data) as (data, call):
+                    tried = []
+                    streaming = False
+                    while True:
+                        attempt, url, attempt_headers = self._attempt(data, headers, tried)
+                        try:
+                            async with client.stream(
+                                "POST",
+                                url,
+                                json=data,
+                                headers=attempt_headers,
+                                timeout=self.timeout,
+                                extensions=self._trace_async(start),
+                            ) as r:
+                                if self._retry(attempt, tried, data, r):
+                                    continue
+                                call.status(r.status_code)
+                                streaming = True
+                                yield r
+                        except Exception as e:
+                            # only fail over before any chunk was handed out
+                            if not streaming and self._retry(attempt, tried, data, error=e):
+                                continue
+                            raise
+                        finally:
+                            self._release_attempt(attempt)
+                        break
+        except Exception as e:
+            metrics.inc("aiapi_errors_total", model=data["model"], session=self.id, type=type(e).__name__)
+            raise
+
+    def _emit_response(self, r: Dict[str, Any], start: float) -> None:
+        elapsed = time.perf_counter() - start
+        usage = r.get("usage") or {}
+        completion_tokens = usage.get("completion_tokens") or 0
+        self._emit(
+            "response.received",
+            elapsed,
+            usage=usage,
+            tokens_per_sec=completion_tokens / elapsed if elapsed else 0.0,
+        )
+
+    @staticmethod
+    def _candidates(r: Dict[str, Any], output_schema: Any = None, scorer: Callable = None) -> List[Tuple[Any, Dict[str, Any]]]:
+        """(content, choice) for every choice in a response, best first.
+
+        `scorer(content, choice)` returns higher for better; without one the
+        API's order is kept.  content is None for a choice calling a function;
+        such choices are not scored and come after the others.  With
+        `output_schema`, choices whose arguments don't parse (e.g. truncated)
+        are dropped; if none parse, the first error is raised.
+        """
+        candidates, error = [], None
+        for choice in r["choices"]:
+            message = choice["message"]
+            if output_schema:
+                try:
+                    content = orjson.loads(message["function_call"]["arguments"])
+                except (KeyError, TypeError, orjson.JSONDecodeError) as e:
+                    error = error or e
+                    continue
+            else:
+                content = message["content"]
+            candidates.append((content, choice))
+        if not candidates and error is not None:
+            raise error
+        if scorer and len(candidates) > 1:
+            scored = [c for c in candidates if c[0] is not None]
+            scored.sort(key=lambda c: scorer(*c), reverse=True)
+            candidates = scored + [c for c in candidates if c[0] is None]
+        return candidates
+
+    @staticmethod
+    def _completion_length(r: Dict[str, Any], choice: Dict[str, Any], content: Any) -> int:
+        """Completion tokens of one choice; usage sums every choice when n > 1."""
+        if len(r["choices"]) == 1:
+            return r["usage"]["completion_tokens"]
+        tokens = (choice.get("logprobs") or {}).get("content")
+        if tokens:
+            return len(tokens)
+        return estimate_tokens(content if isinstance(content, str) else str(content))
+
+    def _emit_stream_completed(self, usage: Dict[str, int], chunks: int, elapsed: float) -> None:
+        # usage is the API's final chunk, or a local estimate without one
+        completion_tokens = usage.get("completion_tokens") or 0
+        self._emit(
+            "stream.completed",
+            elapsed,
+            chunks=chunks,
+            usage=usage,
+            tokens_per_sec=completion_tokens / elapsed if elapsed else 0.0,
+        )
+
+    def process_function_call(self, func_call, start: float = None):
         function_name = func_call['function_call']["name"]
         tools = []
-        print(f"function call: {func_call}")
+        if self.hooks:
+            elapsed = time.perf_counter() - start if start is not None else 0.0
+            self._emit("function_call", elapsed, function=function_name, arguments=func_call['function_call'].get("arguments"))
         if AITool.find_function_spec(function_name):
+            start = time.perf_counter()
             toolMessage = AITool.execute_function(func_call)
+            elapsed = time.perf_counter() - start
+            metrics.inc("aiapi_tool_calls_total", tool=function_name)
+            metrics.observe("aiapi_tool_duration_seconds", elapsed, tool=function_name)
+            if self.hooks:
+                self._emit("tool.executed", elapsed, function=function_name)
             # here we check to see if the tool call resulted in new tools being added
             if isinstance(toolMessage, tuple):
                 toolMessage, toolPack = toolMessage
                 if toolPack:
                     for tool in toolPack:
                         tools.append(tool['name'])
-                    print(f"Message {toolMessage} and we got a toolpack! {toolPack}")
                     # get the name of the first tool and use that to find the correct instance of VandBasicAPITool
                     vand_tool = VandBasicAPITool._find_function(tools[0])
-                    AITool.define_function(spec=vand_tool.functions, func=vand_tool.execute_tool_call)
+                    if vand_tool is None:
+                        # evicted since it was loaded (see VandBasicAPITool.max_instances); the model can load it again
+                        tools = []
+                    else:
+                        AITool.define_function(spec=vand_tool.functions, func=vand_tool.execute_tool_call)
         else:
             raise ValueError(f"No function exists with name {function_name}.")
-        print (toolMessage)
         return function_name, toolMessage, tools
 
     def gen(
@@ -134,38 +519,45 @@ class ChatGPTSession(ChatSession):
         functions: List[Any] = None,
         input_schema: Any = None,
         output_schema: Any = None,
+        n: int = None,
+        scorer: Callable = None,
     ):
+        """With `n`, sample n choices in one request and return them all, best
+        first (see `_candidates`); only the best is saved to the session."""
+        start = time.perf_counter()
         headers, data, user_message = self.prepare_request(
             prompt, function_name, system, params, False, functions, input_schema, output_schema
         )
+        if n is not None:
+            data["n"] = n
+        if self.hooks:
+            self._emit("request.built", time.perf_counter() - start)
 
-        r = client.post(
-            str(self.api_url),
-            json=data,
-            headers=headers,
-            timeout=None,
-        )
-        r = r.json()
+        r = self._post(client, data, headers, start)
+        if self.hooks:
+            self._emit_response(r, start)
 
         try:
+            candidates = self._candidates(r, output_schema, scorer)
+            content, choice = candidates[0]
             if not output_schema:
-                if r["choices"][0]["message"]["content"]:
-                    content = r["choices"][0]["message"]["content"]
+                if choice["message"]["content"]:
 
+                    completion_length = self._completion_length(r, choice, content)
                     assistant_message = ChatMessage(
-                        role=r["choices"][0]["message"]["role"],
+                        role=choice["message"]["role"],
                         content=str(content),
-                        finish_reason=r["choices"][0]["finish_reason"],
+                        finish_reason=choice["finish_reason"],
                         prompt_length=r["usage"]["prompt_tokens"],
-                        completion_length=r["usage"]["completion_tokens"],
-                        total_length=r["usage"]["total_tokens"],
+                        completion_length=completion_length,
+                        total_length=r["usage"]["prompt_tokens"] + completion_length,
                     )
                     self.add_messages(user_message, assistant_message, save_messages)
                 else:
                     self.add_message(user_message, save_messages)
 
-                if r["choices"][0]["message"].get("function_call"):
-                    func_call = {'function_call': r["choices"][0]["message"]["function_call"]}
+                if choice["message"].get("function_call"):
+                    func_call = {'function_call': choice["message"]["function_call"]}
                     #function_name=func_call["function_call"]["name"]
                     # check for local function
                     # if AITool.find_function_spec(function_name):
@@ -176,20 +568,21 @@ class ChatGPTSession(ChatSession):
                     #         toolMessage = toolMessage
                     #         toolPack = None
 
-                    function_name, toolMessage, tools = self.process_function_call(func_call)
+                    function_name, toolMessage, tools = self.process_function_call(func_call, start)
 
                     
                     # else:
                     #     toolMessage, toolPack = VandBasicAPITool.execute_function_call(func_call)
                     
                     # this is the function call message
+                    completion_length = self._completion_length(r, choice, func_call)
                     assistant_message = ChatMessage(
-                        role=r["choices"][0]["message"]["role"],
+                        role=choice["message"]["role"],
                         content=str(func_call),
-                        finish_reason=r["choices"][0]["finish_reason"],
+                        finish_reason=choice["finish_reason"],
                         prompt_length=r["usage"]["prompt_tokens"],
-                        completion_length=r["usage"]["completion_tokens"],
-                        total_length=r["usage"]["total_tokens"],
+                        completion_length=completion_length,
+                        total_length=r["usage"]["prompt_tokens"] + completion_length,
                     )
                     self.add_message(assistant_message, save_messages)
 
@@ -205,7 +598,8 @@ class ChatGPTSession(ChatSession):
                     # end debugging
 
                     prompt = toolMessage
-                    functions = tools
+                    # tools are names of newly loaded functions; send their specs (and let the selector prune them)
+                    functions = [spec for spec in map(AITool.find_function_spec, tools) if spec]
                     # prepare message and return results of function call to model
                     return self.gen(
                         prompt,
@@ -217,10 +611,9 @@ class ChatGPTSession(ChatSession):
                         functions=functions,
                         input_schema=input_schema,
                         output_schema=output_schema,
+                        n=n,
+                        scorer=scorer,
                     ) 
-            else:
-                content = r["choices"][0]["message"]["function_call"]["arguments"]
-                content = orjson.loads(content)
 
             self.total_prompt_length += r["usage"]["prompt_tokens"]
             self.total_completion_length += r["usage"]["completion_tokens"]
@@ -228,7 +621,7 @@ class ChatGPTSession(ChatSession):
         except KeyError:
             raise KeyError(f"No AI generation: {r}")
 
-        return content
+        return [c for c, _ in candidates] if n is not None else content
 
 
     def stream(
@@ -241,6 +634,7 @@ class ChatGPTSession(ChatSession):
         params: Dict[str, Any] = None,
         functions: List[Any] = None,
         input_schema: Any = None,
+        output_schema: Any = None,
     ):
         # if functions:
         #     if functions[0] == "default":
@@ -255,29 +649,29 @@ class ChatGPTSession(ChatSession):
                 if function.startswith("vand-") or function=="default":
                     vand_tool = VandBasicAPITool.get_toolpack(function)
                     AITool.define_function(spec=vand_tool.functions, func=vand_tool.execute_tool_call)
-                    print(f"functions: {AITool.get_function_names()}")
                     function_specs += vand_tool.functions
                 else:
                     # check for locally defined functions
                     if AITool.find_function_spec(function):
                         function_specs.append(AITool.find_function_spec(function))
-            print(f"functions passed: {functions}")
             functions = function_specs
 
-
+        start = time.perf_counter()
         headers, data, user_message = self.prepare_request(
-            prompt, function_name, system, params, True, functions, input_schema
+            prompt, function_name, system, params, True, functions, input_schema, output_schema
         )
+        if self.hooks:
+            self._emit("request.built", time.perf_counter() - start)
+        first_token = True
+        chunks = 0
 
         function_called = False
+        # with an output_schema, the arguments are parsed as they arrive
+        parser = PartialJSONParser() if output_schema else None
+        partial = None
+        usage = None
 
-        with client.stream(
-            "POST",
-            str(self.api_url),
-            json=data,
-            headers=headers,
-            timeout=None,
-        ) as r:
+        with self._stream_request(client, data, headers, start) as r:
             content = []
             func_call = {'function_call': 
                             {
@@ -297,26 +691,56 @@ class ChatGPTSession(ChatSession):
                         #chunk = chunk[6:]  # SSE JSON chunks are prepended with "data: "
                         if chunk != "[DONE]":                  
                             chunk_dict = orjson.loads(chunk)
+                            if chunk_dict.get("usage"):
+                                usage = chunk_dict["usage"]
+                            # the usage chunk sent with stream_options has no choices
+                            if not chunk_dict["choices"]:
+                                continue
+                            chunks += 1
+                            if first_token and self.hooks and any(chunk_dict["choices"][0]["delta"].get(k) for k in ("content", "function_call")):
+                                first_token = False
+                                self._emit("stream.first_token", time.perf_counter() - start)
                             funct = chunk_dict["choices"][0]["delta"].get("function_call")
                             if funct:
                                 if "name" in funct:
                                     func_call['function_call']["name"] = funct["name"]
                                 if "arguments" in funct:
                                     func_call['function_call']["arguments"] += funct["arguments"]
+                                    if parser:
+                                        validated = validate_partial(output_schema, parser.feed(funct["arguments"]))
+                                        if validated is not None and validated != partial:
+                                            partial = validated
+                                            yield {"delta": funct["arguments"], "response": partial}
+                            if parser:
+                                continue
                             if chunk_dict["choices"][0]["finish_reason"] == "function_call":
-                                print(f"Function call detected: {func_call}")
                                 function_called = True
                             
                             delta = chunk_dict["choices"][0]["delta"].get("content")
                             if delta:
                                 content.append(delta)                                
                                 yield {"delta": delta, "response": "".join(content)}
-                                  
-        # streaming does not currently return token counts
+
+        self._record_stream(data["model"], start)
+        elapsed = time.perf_counter() - start
+        usage = self._add_stream_usage(usage, data, "".join(content) + func_call['function_call']["arguments"])
+        if self.hooks:
+            self._emit_stream_completed(usage, chunks, elapsed)
+
+        if parser:
+            # as with gen(), structured output is returned but not saved to the session
+            content = orjson.loads(func_call['function_call']["arguments"])
+            if content != partial:
+                yield {"delta": "", "response": content}
+            return content
+
         if content:
             assistant_message = ChatMessage(
                 role="assistant",
                 content="".join(content),
+                prompt_length=usage["prompt_tokens"],
+                completion_length=usage["completion_tokens"],
+                total_length=usage["total_tokens"],
             )
             self.add_messages(user_message, assistant_message, save_messages)
         else:
@@ -325,7 +749,7 @@ class ChatGPTSession(ChatSession):
 
         if function_called:
             # function_name = func_call['function_call']["name"]
-            function_name, toolMessage, tools = self.process_function_call(func_call)
+            function_name, toolMessage, tools = self.process_function_call(func_call, start)
             # tools = []
             # if AITool.find_function_spec(function_name):
             #     toolMessage = AITool.execute_function(func_call)
@@ -355,6 +779,19 @@ class ChatGPTSession(ChatSession):
 
         return assistant_message
 
+    def tool_selection_system(self, tools: List[Any]) -> str:
+        tools_list = "\n".join(f"{i+1}: {f.__doc__}" for i, f in enumerate(tools))
+        return tool_prompt.format(tools=tools_list)
+
+    def tool_selection_params(self, tools: List[Any]) -> Dict[str, Any]:
+        logit_bias_weight = 100
+        logit_bias = {str(k): logit_bias_weight for k in range(15, 15 + len(tools) + 1)}
+        return {
+            "temperature": 0.0,
+            "max_tokens": 1,
+            "logit_bias": logit_bias,
+        }
+
     def gen_with_tools(
         self,
         prompt: str,
@@ -363,28 +800,25 @@ class ChatGPTSession(ChatSession):
         system: str = None,
         save_messages: bool = None,
         params: Dict[str, Any] = None,
+        router: Any = None,
     ) -> Dict[str, Any]:
 
         # call 1: select tool and populate context
-        tools_list = "\n".join(f"{i+1}: {f.__doc__}" for i, f in enumerate(tools))
-        tool_prompt_format = tool_prompt.format(tools=tools_list)
-
-        logit_bias_weight = 100
-        logit_bias = {str(k): logit_bias_weight for k in range(15, 15 + len(tools) + 1)}
-
-        tool_idx = int(
-            self.gen(
-                prompt,
-                client=client,
-                system=tool_prompt_format,
-                save_messages=False,
-                params={
-                    "temperature": 0.0,
-                    "max_tokens": 1,
-                    "logit_bias": logit_bias,
-                },
+        router = router or self.tool_router
+        tool_idx = router.route(prompt, tools) if router else None
+        if tool_idx is None or router.shadow:
+            llm_idx = int(
+                self.gen(
+                    prompt,
+                    client=client,
+                    system=self.tool_selection_system(tools),
+                    save_messages=False,
+                    params=self.tool_selection_params(tools),
+                )
             )
-        )
+            if router:
+                router.record_llm_choice(tool_idx, llm_idx)
+            tool_idx = llm_idx
 
         # if no tool is selected, do a standard generation instead.
         if tool_idx == 0:
@@ -435,34 +869,67 @@ class ChatGPTSession(ChatSession):
         params: Dict[str, Any] = None,
         input_schema: Any = None,
         output_schema: Any = None,
+        n: int = None,
+        scorer: Callable = None,
     ):
-        headers, data, user_message = self.prepare_request(
-            prompt, system, params, False, input_schema, output_schema
+        user_message, r = await self._request_async(
+            prompt, client, system, params, input_schema, output_schema, n
         )
+        return self._save_response(user_message, r, save_messages, output_schema, n, scorer)
 
-        r = await client.post(
-            str(self.api_url),
-            json=data,
-            headers=headers,
-            timeout=None,
+    async def _request_async(
+        self,
+        prompt: str,
+        client: Union[Client, AsyncClient],
+        system: str = None,
+        params: Dict[str, Any] = None,
+        input_schema: Any = None,
+        output_schema: Any = None,
+        n: int = None,
+    ) -> Tuple[ChatMessage, Dict[str, Any]]:
+        """The first half of gen_async: send the request; nothing is saved to the session."""
+        start = time.perf_counter()
+        headers, data, user_message = self.prepare_request(
+            prompt,
+            system=system,
+            params=params,
+            input_schema=input_schema,
+            output_schema=output_schema,
         )
-        r = r.json()
+        if n is not None:
+            data["n"] = n
+        if self.hooks:
+            self._emit("request.built", time.perf_counter() - start)
 
+        r = await self._post_async(client, data, headers, start)
+        if self.hooks:
+            self._emit_response(r, start)
+        return user_message, r
+
+    def _save_response(
+        self,
+        user_message: ChatMessage,
+        r: Dict[str, Any],
+        save_messages: bool = None,
+        output_schema: Any = None,
+        n: int = None,
+        scorer: Callable = None,
+    ):
+        """The second half of gen_async: save the turn and its usage, and return the answer."""
         try:
+            candidates = self._candidates(r, output_schema, scorer)
+            content, choice = candidates[0]
             if not output_schema:
-                content = r["choices"][0]["message"]["content"]
+                completion_length = self._completion_length(r, choice, content)
                 assistant_message = ChatMessage(
-                    role=r["choices"][0]["message"]["role"],
+                    role=choice["message"]["role"],
                     content=content,
-                    finish_reason=r["choices"][0]["finish_reason"],
+                    finish_reason=choice["finish_reason"],
                     prompt_length=r["usage"]["prompt_tokens"],
-                    completion_length=r["usage"]["completion_tokens"],
-                    total_length=r["usage"]["total_tokens"],
+                    completion_length=completion_length,
+                    total_length=r["usage"]["prompt_tokens"] + completion_length,
                 )
                 self.add_messages(user_message, assistant_message, save_messages)
-            else:
-                content = r["choices"][0]["message"]["function_call"]["arguments"]
-                content = orjson.loads(content)
 
             self.total_prompt_length += r["usage"]["prompt_tokens"]
             self.total_completion_length += r["usage"]["completion_tokens"]
@@ -470,7 +937,7 @@ class ChatGPTSession(ChatSession):
         except KeyError:
             raise KeyError(f"No AI generation: {r}")
 
-        return content
+        return [c for c, _ in candidates] if n is not None else content
 
     async def stream_async(
         self,
@@ -480,37 +947,83 @@ class ChatGPTSession(ChatSession):
         save_messages: bool = None,
         params: Dict[str, Any] = None,
         input_schema: Any = None,
+        output_schema: Any = None,
     ):
+        start = time.perf_counter()
         headers, data, user_message = self.prepare_request(
-            prompt, system, params, True, input_schema
+            prompt,
+            system=system,
+            params=params,
+            stream=True,
+            input_schema=input_schema,
+            output_schema=output_schema,
         )
-
-        async with client.stream(
-            "POST",
-            str(self.api_url),
-            json=data,
-            headers=headers,
-            timeout=None,
-        ) as r:
+        if self.hooks:
+            self._emit("request.built", time.perf_counter() - start)
+        parser = PartialJSONParser() if output_schema else None
+        partial = None
+        usage = None
+        first_token = True
+        chunks = 0
+
+        async with self._stream_request_async(client, data, headers, start) as r:
             content = []
             async for chunk in r.aiter_lines():
                 if len(chunk) > 0:
                     chunk = chunk[6:]  # SSE JSON chunks are prepended with "data: "
                     if chunk != "[DONE]":
                         chunk_dict = orjson.loads(chunk)
+                        if chunk_dict.get("usage"):
+                            usage = chunk_dict["usage"]
+                        if not chunk_dict["choices"]:
+                            continue
+                        chunks += 1
+                        if first_token and self.hooks and any(chunk_dict["choices"][0]["delta"].get(k) for k in ("content", "function_call")):
+                            first_token = False
+                            self._emit("stream.first_token", time.perf_counter() - start)
+                        if parser:
+                            funct = chunk_dict["choices"][0]["delta"].get("function_call")
+                            if funct and funct.get("arguments"):
+                                content.append(funct["arguments"])
+                                validated = validate_partial(output_schema, parser.feed(funct["arguments"]))
+                                if validated is not None and validated != partial:
+                                    partial = validated
+                                    yield {"delta": funct["arguments"], "response": partial}
+                            continue
                         delta = chunk_dict["choices"][0]["delta"].get("content")
                         if delta:
                             content.append(delta)
                             yield {"delta": delta, "response": "".join(content)}
 
-        # streaming does not currently return token counts
+        self._record_stream(data["model"], start)
+        elapsed = time.perf_counter() - start
+        usage = self._add_stream_usage(usage, data, "".join(content))
+        if self.hooks:
+            self._emit_stream_completed(usage, chunks, elapsed)
+
+        if parser:
+            content = orjson.loads("".join(content))
+            if content != partial:
+                yield {"delta": "", "response": content}
+            return
+
         assistant_message = ChatMessage(
             role="assistant",
             content="".join(content),
+            prompt_length=usage["prompt_tokens"],
+            completion_length=usage["completion_tokens"],
+            total_length=usage["total_tokens"],
         )
 
         self.add_messages(user_message, assistant_message, save_messages)
 
+    @staticmethod
+    async def _discard(task: asyncio.Task) -> None:
+        """Cancel a speculative request and wait for it, so its failure is never left unretrieved."""
+        task.cancel()
+        with suppress(asyncio.CancelledError, Exception):
+            await task
+
     async def gen_with_tools_async(
         self,
         prompt: str,
@@ -519,31 +1032,45 @@ class ChatGPTSession(ChatSession):
         system: str = None,
         save_messages: bool = None,
         params: Dict[str, Any] = None,
+        router: Any = None,
+        speculative: bool = False,
     ) -> Dict[str, Any]:
 
         # call 1: select tool and populate context
-        tools_list = "\n".join(f"{i+1}: {f.__doc__}" for i, f in enumerate(tools))
-        tool_prompt_format = tool_prompt.format(tools=tools_list)
-
-        logit_bias_weight = 100
-        logit_bias = {str(k): logit_bias_weight for k in range(15, 15 + len(tools) + 1)}
-
-        tool_idx = int(
-            await self.gen_async(
-                prompt,
-                client=client,
-                system=tool_prompt_format,
-                save_messages=False,
-                params={
-                    "temperature": 0.0,
-                    "max_tokens": 1,
-                    "logit_bias": logit_bias,
-                },
-            )
-        )
+        router = router or self.tool_router
+        tool_idx = router.route(prompt, tools) if router else None
+        plain_task = None
+        if tool_idx is None or router.shadow:
+            # speculatively run the no-tool generation alongside the selection;
+            # it is kept if no tool is selected and cancelled otherwise
+            # (its usage is only counted if it is kept)
+            if speculative:
+                plain_task = asyncio.create_task(
+                    self._request_async(prompt, client, system=system, params=params)
+                )
+            try:
+                llm_idx = int(
+                    await self.gen_async(
+                        prompt,
+                        client=client,
+                        system=self.tool_selection_system(tools),
+                        save_messages=False,
+                        params=self.tool_selection_params(tools),
+                    )
+                )
+            except BaseException:
+                if plain_task:
+                    await self._discard(plain_task)
+                raise
+            if router:
+                router.record_llm_choice(tool_idx, llm_idx)
+            tool_idx = llm_idx
 
         # if no tool is selected, do a standard generation instead.
         if tool_idx == 0:
+            if plain_task:
+                user_message, r = await plain_task
+                return {"response": self._save_response(user_message, r, save_messages), "tool": None}
             return {
                 "response": await self.gen_async(
                     prompt,
@@ -554,6 +1081,8 @@ class ChatGPTSession(ChatSession):
                 ),
                 "tool": None,
             }
+        if plain_task:
+            await self._discard(plain_task)
         selected_tool = tools[tool_idx - 1]
         context_dict = await selected_tool(prompt)
         if isinstance(context_dict, str):
@@ -0,0 +1,198 @@
+'''
+Circuit breakers and load shedding, so a degraded upstream fails fast
+instead of piling up requests, connections and memory.
+
+    from aiapi.circuit import CircuitBreaker, LoadShedder
+
+    ai = AIChat(
+        console=False,
+        circuit_breaker=CircuitBreaker("openai", failure_rate=0.5, slow_call_seconds=20),
+        fallback_model="gpt-3.5-turbo",
+        timeout=60,
+        load_shedder=LoadShedder(max_pending=256),
+    )
+
+A breaker looks at its last `window` calls.  Once at least `min_calls` have
+finished and the share of failures (exceptions, 5xx) or of calls slower
+than `slow_call_seconds` reaches its threshold, it opens: calls raise
+CircuitOpenError without touching the network for `open_seconds`.  Then it
+lets `half_open_calls` probes through; if they succeed it closes again, if
+not it reopens.  A session with a `fallback_model` sends its requests to
+that model while the breaker is open.
+
+Vand tool servers each get a breaker (`CircuitBreaker.get(server_url)`);
+while it is open the tool returns a message saying it is unavailable.
+
+A LoadShedder caps the turns an AIChat has in progress, including those
+still waiting for their session or a scheduler slot; beyond that, new turns
+raise OverloadedError at once.
+'''
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import ClassVar, Dict
+
+from .metrics import registry as metrics
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit {name} is open; retry in {retry_after:.1f}s.")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class OverloadedError(Exception):
+    pass
+
+
+class _Call:
+    __slots__ = ("start", "elapsed", "ok")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.elapsed = None
+        self.ok = True
+
+    def status(self, code: int) -> None:
+        """Report the response status; latency is measured up to this point."""
+        self.elapsed = time.perf_counter() - self.start
+        self.ok = code < 500
+
+
+class _NoCall:
+    def status(self, code: int) -> None:
+        pass
+
+
+NO_CALL = _NoCall()
+
+
+class CircuitBreaker:
+    # breakers by name, e.g. one per tool server
+    instances: ClassVar[Dict[str, "CircuitBreaker"]] = {}
+    # settings for breakers created by `get`
+    defaults: ClassVar[Dict[str, float]] = {}
+
+    def __init__(
+        self,
+        name: str = "default",
+        failure_rate: float = 0.5,
+        slow_call_seconds: float = None,
+        slow_call_rate: float = 0.5,
+        window: int = 20,
+        min_calls: int = 10,
+        open_seconds: float = 30.0,
+        half_open_calls: int = 1,
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.state = "closed"
+        self.opened_at = 0.0
+        self._calls = deque(maxlen=window)  # (failed, slow)
+        self._probes = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls, name: str) -> "CircuitBreaker":
+        breaker = cls.instances.get(name)
+        if breaker is None:
+            breaker = cls.instances.setdefault(name, cls(name, **cls.defaults))
+        return breaker
+
+    def allow(self) -> None:
+        """Raise CircuitOpenError unless a call may go through now."""
+        with self._lock:
+            if self.state == "open":
+                remaining = self.opened_at + self.open_seconds - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError(self.name, remaining)
+                self.state = "half_open"
+                self._probes = self._probe_successes = 0
+            if self.state == "half_open":
+                if self._probes >= self.half_open_calls:
+                    raise CircuitOpenError(self.name, self.open_seconds)
+                self._probes += 1
+
+    def _open(self) -> None:
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self._calls.clear()
+        metrics.inc("aiapi_circuit_opened_total", circuit=self.name)
+
+    def record(self, ok: bool, elapsed: float) -> None:
+        slow = self.slow_call_seconds is not None and elapsed >= self.slow_call_seconds
+        with self._lock:
+            if self.state == "half_open":
+                if not ok or slow:
+                    self._open()
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_calls:
+                    self.state = "closed"
+                return
+            if self.state == "open":
+                return
+            self._calls.append((not ok, slow))
+            n = len(self._calls)
+            if n < self.min_calls:
+                return
+            failures = sum(f for f, _ in self._calls)
+            slow_calls = sum(s for _, s in self._calls)
+            if failures / n >= self.failure_rate or (
+                self.slow_call_seconds is not None and slow_calls / n >= self.slow_call_rate
+            ):
+                self._open()
+
+    def cancel(self) -> None:
+        """A call was abandoned before it could be judged (e.g. task cancelled)."""
+        with self._lock:
+            if self.state == "half_open" and self._probes:
+                self._probes -= 1
+
+    def guard(self):
+        """Fail fast when open; exceptions, 5xx statuses and slow calls count against the circuit."""
+        self.allow()
+        return self.track()
+
+    @contextmanager
+    def track(self):
+        """Record the outcome of a call that `allow()` let through."""
+        call = _Call()
+        try:
+            yield call
+        except Exception:
+            self.record(False, time.perf_counter() - call.start)
+            raise
+        except BaseException:
+            self.cancel()
+            raise
+        self.record(call.ok, call.elapsed if call.elapsed is not None else time.perf_counter() - call.start)
+
+
+class LoadShedder:
+    def __init__(self, max_pending: int = 256):
+        assert max_pending > 0, "max_pending must be positive."
+        self.max_pending = max_pending
+        self.pending = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def admit(self):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                metrics.inc("aiapi_shed_total")
+                raise OverloadedError(f"{self.pending} turns already in progress.")
+            self.pending += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.pending -= 1
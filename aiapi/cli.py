@@ -1,25 +1,40 @@
-import fire
+import argparse
 import os
+import sys
 from getpass import getpass
-from .simpleaichat import AIChat
-from dotenv import load_dotenv
-import argparse
+from typing import List
+
+from .utils import load_env
+
 
-load_dotenv()
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(epilog="Run `aiapi serve --help` for the HTTP gateway.")
+    parser.add_argument("character", help="Specify the character", default=None, nargs='?')
+    parser.add_argument("character_command", help="Specify the character command", default=None, nargs='?')
+    parser.add_argument("--prime", action="store_true", help="Enable priming")
+    return parser.parse_args(argv)
 
-parser = argparse.ArgumentParser()
-parser.add_argument("character", help="Specify the character", default=None, nargs='?')
-parser.add_argument("character_command", help="Specify the character command", default=None, nargs='?')
-parser.add_argument("--prime", action="store_true", help="Enable priming")
 
-ARGS = parser.parse_args()
+def interactive_chat(args: argparse.Namespace) -> None:
+    from .simpleaichat import AIChat
 
-def interactive_chat():
     gpt_api_key = os.getenv("OPENAI_API_KEY")
     if not gpt_api_key:
         gpt_api_key = getpass("Input your OpenAI key here: ")
     assert gpt_api_key, "An API key was not defined."
-    _ = AIChat(ARGS.character, ARGS.character_command, ARGS.prime)
+    _ = AIChat(args.character, args.character_command, prime=args.prime, api_key=gpt_api_key)
+
+
+def main(argv: List[str] = None) -> None:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["serve"]:
+        from .gateway import main as serve
+
+        return serve(argv[1:])
+    args = parse_args(argv)
+    load_env()
+    interactive_chat(args)
+
 
 if __name__ == "__main__":
-    fire.Fire(interactive_chat)
+    main()
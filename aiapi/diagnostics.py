@@ -0,0 +1,187 @@
+'''
+Opt-in allocation profiling built on tracemalloc.
+
+    from aiapi.diagnostics import AllocationProfiler
+
+    ai = AIChat(console=False, profiler=AllocationProfiler())
+    ai("Hello!")
+    print(ai.profiler.report())
+
+Every AIChat call or stream is wrapped in a pair of tracemalloc snapshots.
+The net growth is attributed to the session that made the call, and the
+report adds the retained size of each tracked session's messages, of the
+cached Vand toolpacks and the growth since profiling started, grouped by
+source line and by package (aiapi, httpx, pydantic, ...).
+
+tracemalloc slows allocations down considerably, and snapshots are process
+wide: with concurrent calls (threads or AsyncAIChat) growth from one call can
+be attributed to another.  Use it to find a leak, not in normal operation.
+'''
+import sys
+import time
+import tracemalloc
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+from .vand_utils import VandBasicAPITool
+
+
+@dataclass
+class AllocationRecord:
+    session_id: Any
+    label: str
+    size_diff: int
+    elapsed: float
+    top: List[Dict[str, Any]] = field(default_factory=list)
+    timestamp: float = field(default_factory=time.time)
+
+
+def deep_sizeof(obj: Any, seen: set = None) -> int:
+    """Approximate bytes retained by `obj` and everything it references."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool, type(None))):
+        return size
+    if isinstance(obj, dict):
+        return size + sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset, deque)):
+        return size + sum(deep_sizeof(v, seen) for v in obj)
+    if hasattr(obj, "__dict__"):
+        size += deep_sizeof(obj.__dict__, seen)
+    for slot in getattr(type(obj), "__slots__", ()):
+        size += deep_sizeof(getattr(obj, slot, None), seen)
+    return size
+
+
+def package_of(filename: str) -> str:
+    """Top-level package a traced source file belongs to."""
+    path = filename.replace("\\", "/")
+    if "/site-packages/" in path:
+        return path.split("/site-packages/", 1)[1].split("/", 1)[0].removesuffix(".py")
+    if "/aiapi/" in path:
+        return "aiapi"
+    return "stdlib" if "/lib/python" in path else "other"
+
+
+def _site(stat: tracemalloc.StatisticDiff) -> Dict[str, Any]:
+    frame = stat.traceback[0]
+    return {
+        "file": frame.filename,
+        "line": frame.lineno,
+        "size_diff": stat.size_diff,
+        "count_diff": stat.count_diff,
+    }
+
+
+class AllocationProfiler:
+    def __init__(self, frames: int = 1, top: int = 10, history: int = 1000):
+        self.frames = frames
+        self.top = top
+        self.records = deque(maxlen=history)
+        # net bytes allocated during each session's calls
+        self.session_bytes: Dict[Any, int] = {}
+        self.session_calls: Dict[Any, int] = {}
+        self._sessions = weakref.WeakValueDictionary()
+        self._baseline = None
+        self._started_tracing = False
+
+    @property
+    def running(self) -> bool:
+        return self._baseline is not None
+
+    def _filters(self) -> List[tracemalloc.Filter]:
+        return [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ]
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(self._filters())
+
+    def start(self) -> "AllocationProfiler":
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+        self._baseline = self._snapshot()
+        return self
+
+    def stop(self) -> None:
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        self._baseline = None
+
+    @contextmanager
+    def track(self, session: Any = None, label: str = "gen"):
+        if not self.running:
+            self.start()
+        session_id = getattr(session, "id", None)
+        if session is not None:
+            self._sessions[session_id] = session
+        before = self._snapshot()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stats = self._snapshot().compare_to(before, "lineno")
+            size_diff = sum(s.size_diff for s in stats)
+            self.records.append(
+                AllocationRecord(session_id, label, size_diff, elapsed, [_site(s) for s in stats[:3]])
+            )
+            self.session_bytes[session_id] = self.session_bytes.get(session_id, 0) + size_diff
+            self.session_calls[session_id] = self.session_calls.get(session_id, 0) + 1
+
+    def track_iter(self, iterator, session: Any = None, label: str = "stream"):
+        with self.track(session, label):
+            return (yield from iterator)
+
+    async def track_aiter(self, aiterator, session: Any = None, label: str = "stream"):
+        with self.track(session, label):
+            async for chunk in aiterator:
+                yield chunk
+
+    def toolpacks(self) -> Dict[str, Any]:
+        instances = list(VandBasicAPITool.instances.values())
+        return {
+            "instances": len(instances),
+            "ids": len(VandBasicAPITool.toolpack_ids),
+            "bytes": deep_sizeof(instances),
+        }
+
+    def report(self, top: int = None) -> Dict[str, Any]:
+        """Allocation summary; call `start()` (or make a tracked call) first."""
+        assert self.running, "The profiler has not been started."
+        top = top or self.top
+        stats = self._snapshot().compare_to(self._baseline, "lineno")
+        by_package: Dict[str, int] = {}
+        for stat in stats:
+            package = package_of(stat.traceback[0].filename)
+            by_package[package] = by_package.get(package, 0) + stat.size_diff
+        current, peak = tracemalloc.get_traced_memory()
+
+        sessions = {}
+        for session_id in set(self.session_bytes) | set(self._sessions.keys()):
+            sess = self._sessions.get(session_id)
+            sessions[str(session_id)] = {
+                "calls": self.session_calls.get(session_id, 0),
+                "net_bytes": self.session_bytes.get(session_id, 0),
+                "messages": len(sess.messages) if sess is not None else None,
+                "message_bytes": deep_sizeof(sess.messages) if sess is not None else None,
+            }
+
+        return {
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "growth_bytes": sum(s.size_diff for s in stats),
+            "by_package": dict(sorted(by_package.items(), key=lambda kv: -kv[1])),
+            "top_growth": [_site(s) for s in stats[:top]],
+            "sessions": sessions,
+            "toolpacks": self.toolpacks(),
+        }
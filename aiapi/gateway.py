@@ -0,0 +1,310 @@
+'''
+HTTP gateway: AsyncAIChat sessions served over HTTP, so many services can
+share one tuned process and one upstream connection pool.
+
+    aiapi serve --port 8080 --max-concurrency 64
+
+Endpoints (JSON unless noted):
+
+    GET    /health                      status, sessions, in-flight and queued turns
+    GET    /metrics                     Prometheus text (see aiapi.metrics)
+    POST   /sessions                    create: {"id", "system", "model", "params", ...}
+    GET    /sessions/{id}               session metadata
+    DELETE /sessions/{id}               delete
+    POST   /sessions/{id}/messages      {"prompt", "system", "params", "save_messages", "stream"}
+
+With "stream": true (or `Accept: text/event-stream`) the reply is sent as
+server-sent events: `data: {"delta": ...}` per chunk, then `data: [DONE]`.
+
+Turns on the same session run in order; different sessions run in
+parallel, up to `max_concurrency` upstream requests at once.  When
+`max_queue` turns are already waiting, new ones get 429 with Retry-After.
+On SIGINT/SIGTERM the gateway stops accepting connections and lets
+in-flight turns finish before exiting.
+'''
+import asyncio
+import os
+import signal
+from contextlib import aclosing
+from typing import Any, Dict, List, Optional
+
+import httpx
+import orjson
+
+from .circuit import CircuitOpenError, OverloadedError
+from .httpserver import HTTPServer, Request, Response
+from .metrics import registry
+from .simpleaichat import AsyncAIChat
+from .utils import AsyncRLock, load_env
+
+# session settings a client may choose; credentials and upstream URL are the gateway's
+SESSION_FIELDS = {"id", "system", "model", "params", "save_messages", "recent_messages", "title"}
+
+
+def error(status: int, message: str, type: str = "invalid_request_error", headers: Dict[str, str] = None) -> Response:
+    response = Response.json({"error": {"message": message, "type": type}}, status)
+    response.headers.update(headers or {})
+    return response
+
+
+class Gateway:
+    def __init__(
+        self,
+        ai: AsyncAIChat = None,
+        session_defaults: Dict[str, Any] = None,
+        max_concurrency: int = 64,
+        max_queue: int = 1024,
+        max_connections: int = 100,
+    ):
+        self.session_defaults = session_defaults or {}
+        self.ai = ai or AsyncAIChat(console=False, default_session=False)
+        # one upstream pool shared by every client of the gateway, unless `ai` brought its own
+        if not isinstance(self.ai.client, httpx.AsyncClient):
+            if isinstance(self.ai.client, httpx.Client):
+                self.ai.client.close()
+            limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+            self.ai.client = httpx.AsyncClient(limits=limits, proxies=os.getenv("https_proxy"))
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queued = 0
+        self.inflight = 0
+        self.closing = False
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    # --- admission ---
+
+    async def _acquire(self, session_id: str) -> AsyncRLock:
+        """Wait for the session's previous turns and a free upstream slot.
+
+        The session lock is AsyncAIChat's own, which the turn re-enters; taking
+        it first keeps a session's queued turns from holding upstream slots.
+        """
+        if self.queued >= self.max_queue:
+            raise OverloadedError()
+        lock = self.ai.session_lock(session_id)
+        self.queued += 1
+        try:
+            await lock.acquire()
+            try:
+                await self._slots.acquire()
+            except BaseException:
+                lock.release()
+                raise
+        finally:
+            self.queued -= 1
+        self.inflight += 1
+        return lock
+
+    def _release(self, lock: AsyncRLock) -> None:
+        self.inflight -= 1
+        self._slots.release()
+        lock.release()
+
+    # --- routes ---
+
+    async def __call__(self, request: Request) -> Response:
+        parts = [p for p in request.path.split("/") if p]
+        if parts == ["health"] and request.method == "GET":
+            return self.health()
+        if parts == ["metrics"] and request.method == "GET":
+            return Response(body=registry.to_prometheus().encode(), content_type="text/plain; version=0.0.4")
+        if not parts or parts[0] != "sessions":
+            return error(404, f"Unknown route {request.method} {request.path}")
+        if self.closing:
+            return error(503, "The gateway is shutting down.", "unavailable")
+
+        if len(parts) == 1 and request.method == "POST":
+            body = self._body(request)
+            if body is None:
+                return error(400, "The request body must be a JSON object.")
+            return self.create_session(body)
+        if len(parts) == 2 and request.method == "GET":
+            return self.get_session(parts[1])
+        if len(parts) == 2 and request.method == "DELETE":
+            return self.delete_session(parts[1])
+        if len(parts) == 3 and parts[2] == "messages" and request.method == "POST":
+            body = self._body(request)
+            if body is None:
+                return error(400, "The request body must be a JSON object.")
+            stream = body.pop("stream", False) or "text/event-stream" in request.headers.get("accept", "")
+            return await (self.stream_message if stream else self.send_message)(parts[1], body)
+        return error(405 if len(parts) <= 3 else 404, f"Unsupported {request.method} {request.path}")
+
+    @staticmethod
+    def _body(request: Request) -> Optional[Dict[str, Any]]:
+        """The request's JSON object ({} when empty), or None if it is malformed or not an object."""
+        try:
+            body = request.json()
+        except orjson.JSONDecodeError:
+            return None
+        if body is None:
+            return {}
+        return body if isinstance(body, dict) else None
+
+    def health(self) -> Response:
+        return Response.json({
+            "status": "shutting_down" if self.closing else "ok",
+            "sessions": len(self.ai.sessions),
+            "inflight": self.inflight,
+            "queued": self.queued,
+        })
+
+    def _find(self, session_id: str):
+        return self.ai.sessions.get(session_id)
+
+    def create_session(self, body: Dict[str, Any]) -> Response:
+        unknown = set(body) - SESSION_FIELDS
+        if unknown:
+            return error(400, f"Unknown session fields: {', '.join(sorted(unknown))}")
+        if "id" in body:
+            body["id"] = str(body["id"])
+            if body["id"] in self.ai.sessions:
+                return error(409, f"Session {body['id']} already exists.")
+        try:
+            sess = self.ai.new_session(return_session=True, **{**self.session_defaults, **body})
+        except (AssertionError, ValueError) as e:
+            return error(400, str(e))
+        sess.id = str(sess.id)
+        self.ai.sessions[sess.id] = sess
+        return Response.json(self._describe(sess), 201)
+
+    def _describe(self, sess) -> Dict[str, Any]:
+        return {
+            "id": sess.id,
+            "model": sess.model,
+            "system": sess.system,
+            "title": sess.title,
+            "created_at": sess.created_at,
+            "messages": len(sess.messages),
+            "total_prompt_length": sess.total_prompt_length,
+            "total_completion_length": sess.total_completion_length,
+            "total_length": sess.total_length,
+        }
+
+    def get_session(self, session_id: str) -> Response:
+        sess = self._find(session_id)
+        if sess is None:
+            return error(404, f"No session {session_id}.")
+        return Response.json(self._describe(sess))
+
+    def delete_session(self, session_id: str) -> Response:
+        if self._find(session_id) is None:
+            return error(404, f"No session {session_id}.")
+        self.ai.delete_session(session_id)
+        return Response(204)
+
+    def _turn_args(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        if not isinstance(body.get("prompt"), str):
+            raise ValueError("`prompt` must be a string.")
+        return {k: body[k] for k in ("prompt", "system", "params", "save_messages") if body.get(k) is not None}
+
+    def _overloaded(self) -> Response:
+        return error(429, "Too many queued requests.", "overloaded", {"Retry-After": "1"})
+
+    async def send_message(self, session_id: str, body: Dict[str, Any]) -> Response:
+        sess = self._find(session_id)
+        if sess is None:
+            return error(404, f"No session {session_id}.")
+        try:
+            args = self._turn_args(body)
+            lock = await self._acquire(session_id)
+        except ValueError as e:
+            return error(400, str(e))
+        except OverloadedError:
+            return self._overloaded()
+        try:
+            total = sess.total_length
+            response = await self.ai(id=session_id, **args)
+        except KeyError as e:
+            return error(502, str(e), "upstream_error")
+        except httpx.TimeoutException as e:
+            return error(504, f"Upstream timed out: {str(e) or type(e).__name__}", "upstream_timeout")
+        except httpx.HTTPError as e:
+            return error(502, f"Upstream request failed: {str(e) or type(e).__name__}", "upstream_error")
+        except CircuitOpenError as e:
+            return error(503, str(e), "unavailable", {"Retry-After": str(max(1, round(e.retry_after)))})
+        except OverloadedError:
+            return self._overloaded()
+        finally:
+            self._release(lock)
+        return Response.json({"id": session_id, "response": response, "tokens": sess.total_length - total})
+
+    async def stream_message(self, session_id: str, body: Dict[str, Any]) -> Response:
+        if self._find(session_id) is None:
+            return error(404, f"No session {session_id}.")
+        try:
+            args = self._turn_args(body)
+            lock = await self._acquire(session_id)
+        except ValueError as e:
+            return error(400, str(e))
+        except OverloadedError:
+            return self._overloaded()
+
+        async def events():
+            try:
+                async with aclosing(await self.ai.stream(id=session_id, **args)) as chunks:
+                    async for chunk in chunks:
+                        yield b"data: " + orjson.dumps({"delta": chunk["delta"]}) + b"\n\n"
+                yield b"data: [DONE]\n\n"
+            except Exception as e:
+                yield b"event: error\ndata: " + orjson.dumps({"message": str(e), "type": type(e).__name__}) + b"\n\n"
+            finally:
+                self._release(lock)
+
+        return Response.sse(events())
+
+    async def close(self) -> None:
+        self.closing = True
+        await self.ai.client.aclose()
+
+
+def parse_args(argv: List[str] = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="aiapi serve", description="Run the aiapi HTTP gateway.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--model", default="gpt-3.5-turbo", help="Default model for new sessions.")
+    parser.add_argument("--api-url", help="Upstream chat completions URL.")
+    parser.add_argument("--api-key", help="Upstream API key; defaults to $OPENAI_API_KEY.")
+    parser.add_argument("--max-concurrency", type=int, default=64, help="Upstream requests in flight at once.")
+    parser.add_argument("--max-queue", type=int, default=1024, help="Waiting turns before answering 429.")
+    parser.add_argument("--max-connections", type=int, default=100, help="Upstream connection pool size.")
+    parser.add_argument("--shutdown-timeout", type=float, default=30.0, help="Seconds to let in-flight turns finish.")
+    return parser.parse_args(argv)
+
+
+async def serve(args) -> None:
+    defaults = {"model": args.model}
+    api_key = args.api_key or os.getenv("OPENAI_API_KEY")
+    assert api_key, "An API key was not defined."
+    defaults["api_key"] = api_key
+    if args.api_url:
+        defaults["api_url"] = args.api_url
+
+    gateway = Gateway(
+        session_defaults=defaults,
+        max_concurrency=args.max_concurrency,
+        max_queue=args.max_queue,
+        max_connections=args.max_connections,
+    )
+    server = await HTTPServer(gateway, args.host, args.port).start()
+    print(f"aiapi gateway listening on {server.url}", flush=True)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    await stop.wait()
+
+    gateway.closing = True
+    await server.shutdown(args.shutdown_timeout)
+    await gateway.close()
+
+
+def main(argv: List[str] = None) -> None:
+    load_env()
+    asyncio.run(serve(parse_args(argv)))
@@ -0,0 +1,64 @@
+'''
+Instrumentation hooks for chat sessions.
+
+A session with `hooks` set calls `hooks.on_event(event)` at each step of a
+request.  Event names and the meaning of `elapsed` (seconds):
+
+    request.built        building the request payload took `elapsed`
+    http.connected       a new connection was opened, `elapsed` after the request started
+    http.first_byte      response headers received
+    response.received    non-streamed response parsed (data: usage, tokens_per_sec)
+    stream.first_token   first content or function_call delta
+    stream.completed     stream finished (data: chunks, usage, tokens_per_sec of completion tokens)
+    function_call        the model's function call was parsed (data: function, arguments)
+    tool.executed        the function returned after `elapsed` (data: function)
+
+Sessions without hooks skip all of this, so the default costs nothing.
+'''
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict
+
+# httpcore trace events reported through the httpx "trace" extension
+TRACE_EVENTS = {
+    "connection.connect_tcp.complete": "http.connected",
+    "http11.receive_response_headers.complete": "http.first_byte",
+    "http2.receive_response_headers.complete": "http.first_byte",
+}
+
+
+@dataclass
+class HookEvent:
+    name: str
+    session_id: Any
+    elapsed: float
+    data: Dict[str, Any] = field(default_factory=dict)
+    timestamp: float = field(default_factory=time.time)
+
+
+class ChatHooks:
+    """Base class for hooks; override `on_event`."""
+
+    def on_event(self, event: HookEvent) -> None:
+        pass
+
+
+class TimingRecorder(ChatHooks):
+    """Keeps the most recent `maxlen` events, e.g. for tests or a debug endpoint."""
+
+    def __init__(self, maxlen: int = 1000):
+        self.events = deque(maxlen=maxlen)
+
+    def on_event(self, event: HookEvent) -> None:
+        self.events.append(event)
+
+    def timings(self, name: str) -> list:
+        return [e.elapsed for e in self.events if e.name == name]
+
+
+class PrintHooks(ChatHooks):
+    """Prints every event; useful when debugging function calls."""
+
+    def on_event(self, event: HookEvent) -> None:
+        print(f"[{event.name}] {event.elapsed * 1000:.1f} ms {event.data or ''}")
@@ -0,0 +1,241 @@
+'''
+Minimal asyncio HTTP/1.1 server used by the mock upstream and the gateway.
+
+It supports keep-alive, Content-Length and chunked bodies, and streamed
+(chunked) responses such as server-sent events, without any dependency
+outside the standard library.
+'''
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+import orjson
+
+REASONS = {
+    200: "OK",
+    201: "Created",
+    204: "No Content",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    502: "Bad Gateway",
+    503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    query: Dict[str, str]
+    headers: Dict[str, str]
+    body: bytes = b""
+
+    def json(self) -> Any:
+        return orjson.loads(self.body) if self.body else None
+
+
+@dataclass
+class Response:
+    status: int = 200
+    body: bytes = b""
+    content_type: str = "application/json"
+    headers: Dict[str, str] = field(default_factory=dict)
+    # when set, the body is sent chunk by chunk as the iterator produces it
+    stream: Optional[AsyncIterator[bytes]] = None
+
+    @classmethod
+    def json(cls, value: Any, status: int = 200) -> "Response":
+        return cls(status=status, body=orjson.dumps(value))
+
+    @classmethod
+    def sse(cls, events: AsyncIterator[bytes]) -> "Response":
+        return cls(
+            content_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+            stream=events,
+        )
+
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+class HTTPServer:
+    """Serve `handler` over HTTP/1.1; one coroutine per connection."""
+
+    def __init__(self, handler: Handler, host: str = "127.0.0.1", port: int = 0, max_body: int = 16 * 1024 * 1024):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.max_body = max_body
+        self.connections = 0
+        # requests being handled or responded to; shutdown() waits for them
+        self.active = 0
+        self._idle = asyncio.Event()
+        self._server = None
+        self._writers = set()
+        self._tasks = set()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> "HTTPServer":
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self) -> None:
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            # let connection handlers see EOF and return before the loop goes away
+            if self._tasks:
+                await asyncio.wait(list(self._tasks), timeout=1.0)
+            await self._server.wait_closed()
+
+    async def shutdown(self, timeout: float = 30.0) -> None:
+        """Stop accepting connections, let in-flight requests finish (up to `timeout`), then close."""
+        if self._server is None:
+            return
+        self._server.close()
+        if self.active:
+            self._idle.clear()
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        await self.close()
+
+    def start_in_thread(self) -> "HTTPServer":
+        """Run the server on its own event loop in a daemon thread (for use from sync code)."""
+        started = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            started.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        started.wait()
+        return self
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Request]:
+        line = await reader.readline()
+        if not line:
+            return None
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = bytearray()
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                body += await reader.readexactly(size)
+                await reader.readline()
+                if len(body) > self.max_body:
+                    raise ValueError("request body too large")
+            body = bytes(body)
+        else:
+            length = int(headers.get("content-length", 0))
+            if length > self.max_body:
+                raise ValueError("request body too large")
+            body = await reader.readexactly(length) if length else b""
+
+        url = urlsplit(target)
+        return Request(method.upper(), url.path, dict(parse_qsl(url.query)), headers, body)
+
+    async def _write_response(self, writer: asyncio.StreamWriter, response: Response, keep_alive: bool) -> None:
+        head = [f"HTTP/1.1 {response.status} {REASONS.get(response.status, 'Unknown')}"]
+        headers = {"Content-Type": response.content_type, **response.headers}
+        if response.stream is not None:
+            headers["Transfer-Encoding"] = "chunked"
+        else:
+            headers["Content-Length"] = str(len(response.body))
+        headers["Connection"] = "keep-alive" if keep_alive else "close"
+        head += [f"{k}: {v}" for k, v in headers.items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+
+        if response.stream is None:
+            writer.write(response.body)
+            await writer.drain()
+            return
+        try:
+            async for chunk in response.stream:
+                if chunk:
+                    writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                    # drain per chunk: a slow client applies backpressure to the producer
+                    await writer.drain()
+        finally:
+            # release whatever the producer holds as soon as the client goes away
+            aclose = getattr(response.stream, "aclose", None)
+            if aclose:
+                await aclose()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        self._writers.add(writer)
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except ValueError:
+                    await self._write_response(writer, Response.json({"error": "bad request"}, 400), False)
+                    break
+                if request is None:
+                    break
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                self.active += 1
+                try:
+                    try:
+                        response = await self.handler(request)
+                    except Exception as e:
+                        response = Response.json({"error": {"message": str(e), "type": type(e).__name__}}, 500)
+                    # once shutting down, finish this response and close the connection
+                    keep_alive = keep_alive and self._server.is_serving()
+                    await self._write_response(writer, response, keep_alive)
+                finally:
+                    self.active -= 1
+                    if not self.active:
+                        self._idle.set()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            # the response was already started (e.g. a stream failed part way); just drop the connection
+            pass
+        finally:
+            self.connections -= 1
+            self._writers.discard(writer)
+            self._tasks.discard(task)
+            writer.close()
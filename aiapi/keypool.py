@@ -0,0 +1,162 @@
+'''
+API key pools: spread requests over several keys (or organizations) so one
+key's rate limit doesn't cap throughput.
+
+    from aiapi.keypool import KeyPool
+
+    pool = KeyPool(["sk-one", {"api_key": "sk-two", "organization": "org-b", "rpm": 500}])
+    ai = AIChat(console=False, key_pool=pool)
+    # or OPENAI_API_KEYS="sk-one,sk-two" and KeyPool.from_env()
+
+Each request goes to the healthy key with the fewest requests in flight
+(ties go round robin).  Keys with an `rpm` limit get a token bucket, and a
+key that reports `x-ratelimit-remaining-requests: 0` is skipped until its
+reset.  A 429 or 5xx ejects the key for `Retry-After` seconds, or for
+`cooldown` doubling with each consecutive failure, and the request is
+retried on another key (up to `retries` times).  When every key is ejected,
+the one that comes back soonest is used.
+'''
+import itertools
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Union
+
+from .metrics import registry as metrics
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds in a rate limit header: "20", "1s", "6m0s", "250ms"."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    return sum(float(n) * _UNITS[unit] for n, unit in parts) if parts else None
+
+
+def retryable(status: int) -> bool:
+    return status == 429 or status >= 500
+
+
+class APIKey:
+    def __init__(self, api_key: str, organization: str = None, name: str = None, rpm: float = None):
+        self.api_key = api_key
+        self.organization = organization
+        # never the key itself: this is used as a metric label
+        self.name = name or f"...{api_key[-4:]}"
+        self.rpm = rpm
+        self.tokens = rpm or 0.0
+        self.refilled_at = time.monotonic()
+        self.inflight = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.limited_until = 0.0
+
+    def headers(self) -> Dict[str, str]:
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        if self.organization:
+            headers["OpenAI-Organization"] = self.organization
+        return headers
+
+    def _refill(self, now: float) -> None:
+        if self.rpm:
+            self.tokens = min(self.rpm, self.tokens + (now - self.refilled_at) * self.rpm / 60)
+            self.refilled_at = now
+
+    def available(self, now: float) -> bool:
+        self._refill(now)
+        return self.ejected_until <= now and self.limited_until <= now and (not self.rpm or self.tokens >= 1)
+
+    def ready_at(self, now: float) -> float:
+        ready = max(self.ejected_until, self.limited_until)
+        if self.rpm and self.tokens < 1:
+            ready = max(ready, now + (1 - self.tokens) * 60 / self.rpm)
+        return ready
+
+    def __repr__(self) -> str:
+        return f"APIKey({self.name})"
+
+
+class KeyPool:
+    def __init__(
+        self,
+        keys: List[Union[str, Dict[str, Any], APIKey]],
+        cooldown: float = 5.0,
+        max_cooldown: float = 300.0,
+        retries: int = 1,
+    ):
+        assert keys, "A key pool needs at least one key."
+        self.keys = [k if isinstance(k, APIKey) else APIKey(k) if isinstance(k, str) else APIKey(**k) for k in keys]
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.retries = retries
+        self._lock = threading.Lock()
+        self._turn = itertools.count()
+
+    @classmethod
+    def from_env(cls, var: str = "OPENAI_API_KEYS", **kwargs) -> "KeyPool":
+        return cls([k.strip() for k in os.getenv(var, "").split(",") if k.strip()], **kwargs)
+
+    def acquire(self, exclude: List[APIKey] = ()) -> APIKey:
+        """The least loaded available key, counted as in flight until `release`."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [k for k in self.keys if k not in exclude] or self.keys
+            ready = [k for k in candidates if k.available(now)]
+            if ready:
+                # rotate the starting point so equally loaded keys take turns
+                offset = next(self._turn) % len(ready)
+                ready = ready[offset:] + ready[:offset]
+                key = min(ready, key=lambda k: k.inflight)
+            else:
+                key = min(candidates, key=lambda k: k.ready_at(now))
+            if key.rpm:
+                key.tokens = max(0.0, key.tokens - 1)
+            key.inflight += 1
+        metrics.inc("aiapi_key_requests_total", key=key.name)
+        return key
+
+    def release(self, key: APIKey) -> None:
+        with self._lock:
+            key.inflight -= 1
+
+    def report(self, key: APIKey, status: int, headers: Any = None) -> bool:
+        """Record a response's status; True if the key was ejected."""
+        headers = headers or {}
+        now = time.monotonic()
+        with self._lock:
+            if headers.get("x-ratelimit-remaining-requests") == "0":
+                reset = parse_duration(headers.get("x-ratelimit-reset-requests"))
+                key.limited_until = now + (reset if reset is not None else self.cooldown)
+            if not retryable(status):
+                key.failures = 0
+                return False
+            key.failures += 1
+            wait = parse_duration(headers.get("retry-after"))
+            if wait is None:
+                wait = min(self.max_cooldown, self.cooldown * 2 ** (key.failures - 1))
+            key.ejected_until = now + wait
+        metrics.inc("aiapi_key_errors_total", key=key.name, status=status)
+        metrics.inc("aiapi_key_ejections_total", key=key.name)
+        return True
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "key": k.name,
+                    "inflight": k.inflight,
+                    "failures": k.failures,
+                    "available": k.available(now),
+                    "ejected_for": max(0.0, k.ejected_until - now),
+                }
+                for k in self.keys
+            ]
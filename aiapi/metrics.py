@@ -0,0 +1,200 @@
+'''
+Process-wide metrics: counters and latency histograms labeled by model,
+session and tool, exported as a dict or in the Prometheus text format.
+
+    from aiapi.metrics import registry
+    print(registry.to_prometheus())
+
+Each thread updates its own shard of plain dicts, so recording a metric on
+the hot path takes no lock; shards are merged only when exporting.  The
+shards of threads that have exited are folded into one, so thread-per-request
+servers don't leak a shard per thread.
+
+Series aren't labeled by session unless `session_labels` is set; sessions
+deleted through AIChat.delete_session then have their series dropped.
+'''
+import threading
+from bisect import bisect_left
+from typing import Any, Dict, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_HELP = {
+    "aiapi_requests_total": ("counter", "Chat completion requests sent."),
+    "aiapi_errors_total": ("counter", "Chat completion requests that failed."),
+    "aiapi_retries_total": ("counter", "Chat completion requests retried or failed over."),
+    "aiapi_prompt_tokens_total": ("counter", "Prompt tokens used."),
+    "aiapi_completion_tokens_total": ("counter", "Completion tokens used."),
+    "aiapi_tool_calls_total": ("counter", "Function calls executed."),
+    "aiapi_cache_hits_total": ("counter", "Tool results served from the cache."),
+    "aiapi_cache_misses_total": ("counter", "Tool results not found in the cache."),
+    "aiapi_request_duration_seconds": ("histogram", "Time to receive a complete, non-streamed response."),
+    "aiapi_stream_duration_seconds": ("histogram", "Time from sending a streamed request to its last chunk."),
+    "aiapi_tool_duration_seconds": ("histogram", "Time to execute a function call."),
+    "aiapi_key_requests_total": ("counter", "Requests sent with each pooled API key."),
+    "aiapi_key_errors_total": ("counter", "429 and 5xx responses for each pooled API key."),
+    "aiapi_key_ejections_total": ("counter", "Times a pooled API key was taken out of rotation."),
+    "aiapi_circuit_opened_total": ("counter", "Times a circuit breaker opened."),
+    "aiapi_shed_total": ("counter", "Turns rejected because too many were in progress."),
+    "aiapi_backend_errors_total": ("counter", "Failed attempts on each routed backend."),
+    "aiapi_backend_latency_seconds": ("histogram", "Time to a response from each routed backend."),
+    "aiapi_scheduler_wait_seconds": ("histogram", "Time a request waited for a scheduler slot."),
+}
+
+LabelKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class MetricsRegistry:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, session_labels: bool = False):
+        self.buckets = tuple(buckets)
+        # label metrics by session id; each session adds series until it is deleted
+        self.session_labels = session_labels
+        self.enabled = True
+        self._local = threading.local()
+        self._shards = []  # (owning thread, counters, histograms)
+        # shards of exited threads, merged; only changed with self._lock held
+        self._retired = ({}, {})
+        self._lock = threading.Lock()
+
+    def _shard(self) -> Tuple[Dict[LabelKey, float], Dict[LabelKey, list]]:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = ({}, {})
+            with self._lock:
+                self._retire_dead()
+                self._shards.append((threading.current_thread(), *shard))
+            self._local.shard = shard
+            return shard
+
+    def _retire_dead(self) -> None:
+        # called with self._lock held; a dead thread no longer writes to its shard
+        alive = []
+        for thread, counters, histograms in self._shards:
+            if thread.is_alive():
+                alive.append((thread, counters, histograms))
+            else:
+                _merge_into(self._retired, counters, histograms)
+        self._shards = alive
+
+    def _key(self, name: str, labels: Dict[str, Any]) -> LabelKey:
+        if not self.session_labels:
+            labels.pop("session", None)
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        counters = self._shard()[0]
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        histograms = self._shard()[1]
+        hist = histograms.get(key)
+        if hist is None:
+            # bucket counts (last is +Inf), then sum and count
+            hist = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        hist[bisect_left(self.buckets, value)] += 1
+        hist[-2] += value
+        hist[-1] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            for _, counters, histograms in self._shards:
+                counters.clear()
+                histograms.clear()
+            for part in self._retired:
+                part.clear()
+
+    def drop_session(self, session_id: Any) -> None:
+        """Forget every series labeled with `session_id`."""
+        label = ("session", str(session_id))
+        with self._lock:
+            shards = [shard for _, *shard in self._shards] + [self._retired]
+        for shard in shards:
+            for part in shard:
+                for key in [k for k in part.copy() if label in k[1]]:
+                    part.pop(key, None)
+
+    def _merged(self) -> Tuple[Dict[LabelKey, float], Dict[LabelKey, list]]:
+        merged = ({}, {})
+        with self._lock:
+            self._retire_dead()
+            shards = [shard for _, *shard in self._shards]
+            # the retired shard can change once the lock is released
+            _merge_into(merged, *self._retired)
+        for shard_counters, shard_histograms in shards:
+            # dict.copy() is atomic under the GIL, so the owning thread can keep writing
+            _merge_into(merged, shard_counters.copy(), shard_histograms.copy())
+        return merged
+
+    def get(self, name: str, **labels) -> float:
+        """Sum of a counter over every label set that includes `labels`."""
+        wanted = set(self._key(name, labels)[1])
+        counters, _ = self._merged()
+        return sum(v for (n, key), v in counters.items() if n == name and wanted <= set(key))
+
+    def to_dict(self) -> Dict[str, list]:
+        counters, histograms = self._merged()
+        result: Dict[str, list] = {}
+        for (name, labels), value in sorted(counters.items()):
+            result.setdefault(name, []).append({"labels": dict(labels), "value": value})
+        for (name, labels), hist in sorted(histograms.items()):
+            cumulative, buckets = 0, {}
+            for bound, count in zip(self.buckets + (float("inf"),), hist):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            result.setdefault(name, []).append(
+                {"labels": dict(labels), "buckets": buckets, "sum": hist[-2], "count": hist[-1]}
+            )
+        return result
+
+    def to_prometheus(self) -> str:
+        lines = []
+        for name, samples in self.to_dict().items():
+            kind, help_text = METRIC_HELP.get(name, ("untyped", name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample in samples:
+                labels = sample["labels"]
+                if "buckets" not in sample:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(sample['value'])}")
+                    continue
+                for bound, count in sample["buckets"].items():
+                    le = "+Inf" if bound == "inf" else bound
+                    lines.append(f"{name}_bucket{_format_labels({**labels, 'le': le})} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(sample['sum'])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {sample['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def _merge_into(target: Tuple[Dict[LabelKey, float], Dict[LabelKey, list]], counters, histograms) -> None:
+    target_counters, target_histograms = target
+    for key, value in counters.items():
+        target_counters[key] = target_counters.get(key, 0) + value
+    for key, hist in histograms.items():
+        merged = target_histograms.setdefault(key, [0] * len(hist))
+        for i, v in enumerate(list(hist)):
+            merged[i] += v
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        k + '="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for k, v in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# the process-wide registry used by sessions and tools
+registry = MetricsRegistry()
@@ -0,0 +1,271 @@
+'''
+Offline stand-in for the OpenAI chat completions API and Vand toolpack endpoints.
+
+Used to benchmark and load test aiapi without network access or API costs:
+
+    python -m aiapi.mock_server --port 8000 --latency 0.05 --tokens-per-second 500
+
+Chat completions support JSON and SSE streaming responses, function_call
+(including forced calls for output_schema), tool selection for
+gen_with_tools, several choices (`n`) with logprobs (JSON responses only)
+and usage (also as a final stream chunk when requested with
+stream_options.include_usage).  Vand toolpacks are served from
+/api/v1/getToolPack/{id} with tools whose endpoints live on the same server.
+'''
+import argparse
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List
+from uuid import uuid4
+
+import orjson
+
+from .httpserver import HTTPServer, Request, Response
+from .utils import estimate_tokens
+
+LOREM = (
+    "Sure, here is a short answer that the mock server generates so clients "
+    "have realistic chunks to parse and count while measuring their own overhead"
+).split()
+
+
+@dataclass
+class MockConfig:
+    # seconds before the first byte of every chat response
+    latency: float = 0.0
+    # completion tokens streamed per second; 0 sends them all at once
+    tokens_per_second: float = 0.0
+    completion_tokens: int = 24
+    # reply for tool selection requests (max_tokens=1), i.e. gen_with_tools
+    selected_tool: str = "1"
+    # answer a user message with a call to the first function provided
+    call_functions: bool = True
+    # size in bytes of each Vand tool response
+    tool_payload_bytes: int = 512
+    tool_latency: float = 0.0
+    # fraction of chat requests answered with a 500, to exercise failover
+    error_rate: float = 0.0
+
+
+def sample_arguments(parameters: Dict[str, Any]) -> Dict[str, Any]:
+    """Arguments that satisfy a JSON schema's top-level properties."""
+    samples = {"string": "Detroit", "integer": 1, "number": 1.5, "boolean": True, "array": [], "object": {}}
+    args = {}
+    for name, prop in (parameters or {}).get("properties", {}).items():
+        if isinstance(prop, dict) and prop.get("type") in samples:
+            args[name] = samples[prop["type"]]
+    return args
+
+
+class MockUpstream:
+    def __init__(self, config: MockConfig = None):
+        self.config = config or MockConfig()
+        self.base_url = ""
+        self.requests = 0
+
+    # --- chat completions ---
+
+    def _reply(self, body: Dict[str, Any], index: int = 0) -> Dict[str, Any]:
+        """The assistant message (content or function_call) for a request's `index`th choice."""
+        messages = body.get("messages", [])
+        functions = body.get("functions") or []
+        forced = body.get("function_call")
+        if isinstance(forced, dict):
+            spec = next((f for f in functions if f["name"] == forced["name"]), {})
+            return {"function_call": {"name": forced["name"], "arguments": orjson.dumps(sample_arguments(spec.get("parameters"))).decode()}}
+        if body.get("max_tokens") == 1:
+            return {"content": self.config.selected_tool}
+        if functions and self.config.call_functions and messages and messages[-1]["role"] == "user":
+            spec = functions[0]
+            return {"function_call": {"name": spec["name"], "arguments": orjson.dumps(sample_arguments(spec.get("parameters"))).decode()}}
+        # choices differ in where they start in the text
+        words = [LOREM[(i + index) % len(LOREM)] for i in range(self.config.completion_tokens)]
+        return {"content": " ".join(words)}
+
+    @staticmethod
+    def _usage(body: Dict[str, Any], completion: str) -> Dict[str, int]:
+        prompt = "".join(str(m.get("content") or "") for m in body.get("messages", []))
+        if body.get("functions"):
+            prompt += orjson.dumps(body["functions"]).decode()
+        prompt_tokens = estimate_tokens(prompt)
+        completion_tokens = max(1, estimate_tokens(completion))
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+    async def chat_completions(self, request: Request) -> Response:
+        body = request.json()
+        replies = [self._reply(body, i) for i in range(body.get("n") or 1)]
+        reply = replies[0]
+        finish_reason = "function_call" if "function_call" in reply and not isinstance(body.get("function_call"), dict) else "stop"
+        completion = "".join(r.get("content") or r["function_call"]["arguments"] for r in replies)
+        usage = self._usage(body, completion)
+        if self.config.latency:
+            await asyncio.sleep(self.config.latency)
+        if self.config.error_rate and random.random() < self.config.error_rate:
+            return Response.json({"error": {"message": "Mock upstream error.", "type": "server_error"}}, 500)
+
+        if not body.get("stream"):
+            if self.config.tokens_per_second:
+                await asyncio.sleep(usage["completion_tokens"] / self.config.tokens_per_second)
+            choices = []
+            for i, r in enumerate(replies):
+                message = {"role": "assistant", "content": r.get("content")}
+                if "function_call" in r:
+                    message["function_call"] = r["function_call"]
+                choice = {"index": i, "message": message, "finish_reason": finish_reason}
+                if body.get("logprobs") and r.get("content"):
+                    choice["logprobs"] = {"content": [
+                        {"token": word, "logprob": -random.random()} for word in r["content"].split()
+                    ]}
+                choices.append(choice)
+            return Response.json({
+                "id": f"chatcmpl-{uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": choices,
+                "usage": usage,
+            })
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+        return Response.sse(self._stream_chunks(body, reply, finish_reason, usage if include_usage else None))
+
+    async def _stream_chunks(self, body, reply, finish_reason, usage):
+        base = {"id": f"chatcmpl-{uuid4().hex}", "object": "chat.completion.chunk", "created": int(time.time()), "model": body.get("model")}
+        delay = 1 / self.config.tokens_per_second if self.config.tokens_per_second else 0
+
+        def event(delta, finish=None, **extra):
+            chunk = {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": finish}], **extra}
+            return b"data: " + orjson.dumps(chunk) + b"\n\n"
+
+        if "function_call" in reply:
+            call = reply["function_call"]
+            yield event({"role": "assistant", "content": None, "function_call": {"name": call["name"], "arguments": ""}})
+            args = call["arguments"]
+            for i in range(0, len(args), 4):
+                if delay:
+                    await asyncio.sleep(delay)
+                yield event({"function_call": {"arguments": args[i : i + 4]}})
+        else:
+            yield event({"role": "assistant", "content": ""})
+            for i, word in enumerate(reply["content"].split(" ")):
+                if delay:
+                    await asyncio.sleep(delay)
+                yield event({"content": word if i == 0 else " " + word})
+        yield event({}, finish_reason)
+        if usage:
+            yield b"data: " + orjson.dumps({**base, "choices": [], "usage": usage}) + b"\n\n"
+        yield b"data: [DONE]\n\n"
+
+    # --- Vand toolpacks ---
+
+    def toolpack(self, toolpack_id: str) -> Dict[str, Any]:
+        spec = {
+            "name": "getMockWeather",
+            "description": "Get the current weather for a city.",
+            "parameters": {
+                "type": "object",
+                "properties": {"city": {"type": "string", "description": "The city name."}},
+                "required": ["city"],
+            },
+        }
+        return {
+            "description": f"Mock toolpack {toolpack_id}",
+            "servers": [{"url": self.base_url}],
+            "endpoints": [["GET /tools/weather", "getMockWeather", spec["description"], {"parameters": [{"name": "city", "in": "query"}]}]],
+            "functions": [spec],
+        }
+
+    async def tool_weather(self, request: Request) -> Response:
+        if self.config.tool_latency:
+            await asyncio.sleep(self.config.tool_latency)
+        padding = "x" * max(0, self.config.tool_payload_bytes - 80)
+        return Response.json({"city": request.query.get("city"), "temperature": 13.5, "conditions": "clear", "padding": padding})
+
+    async def __call__(self, request: Request) -> Response:
+        self.requests += 1
+        path = request.path
+        if request.method == "POST" and path.endswith("/chat/completions"):
+            return await self.chat_completions(request)
+        if request.method == "GET" and path.startswith("/api/v1/getToolPack/"):
+            return Response.json(self.toolpack(path.rsplit("/", 1)[-1]))
+        if request.method == "GET" and path == "/tools/weather":
+            return await self.tool_weather(request)
+        return Response.json({"error": {"message": f"Unknown route {request.method} {path}"}}, 404)
+
+
+class MockServer:
+    """
+    Mock OpenAI/Vand server.
+
+    `chat_url` is the api_url to give a session and `vand_url` the base URL
+    for VandBasicAPITool.base_url.
+    """
+
+    def __init__(self, config: MockConfig = None, host: str = "127.0.0.1", port: int = 0):
+        self.upstream = MockUpstream(config)
+        self.server = HTTPServer(self.upstream, host, port)
+
+    @property
+    def url(self) -> str:
+        return self.server.url
+
+    @property
+    def chat_url(self) -> str:
+        return f"{self.url}/v1/chat/completions"
+
+    @property
+    def vand_url(self) -> str:
+        return f"{self.url}/api/v1"
+
+    async def start(self) -> "MockServer":
+        await self.server.start()
+        self.upstream.base_url = self.url
+        return self
+
+    def start_in_thread(self) -> "MockServer":
+        self.server.start_in_thread()
+        self.upstream.base_url = self.url
+        return self
+
+    async def close(self) -> None:
+        await self.server.close()
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the mock OpenAI/Vand server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before the first byte of each chat response.")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Completion token rate; 0 for no delay.")
+    parser.add_argument("--completion-tokens", type=int, default=24)
+    parser.add_argument("--selected-tool", default="1", help="Reply to gen_with_tools selection requests.")
+    parser.add_argument("--no-function-calls", action="store_true", help="Never answer with a function_call.")
+    parser.add_argument("--tool-payload-bytes", type=int, default=512)
+    parser.add_argument("--tool-latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of chat requests that get a 500.")
+    return parser.parse_args(argv)
+
+
+async def serve(args: argparse.Namespace) -> None:
+    config = MockConfig(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        selected_tool=args.selected_tool,
+        call_functions=not args.no_function_calls,
+        tool_payload_bytes=args.tool_payload_bytes,
+        tool_latency=args.tool_latency,
+        error_rate=args.error_rate,
+    )
+    mock = await MockServer(config, args.host, args.port).start()
+    # the first line is read by the benchmarks to find the port when --port 0 is used
+    print(f"Mock server listening on {mock.url}", flush=True)
+    await mock.server.serve_forever()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve(parse_args()))
+    except KeyboardInterrupt:
+        pass
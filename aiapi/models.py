@@ -1,10 +1,17 @@
 import datetime
+import sys
+from collections.abc import Sequence
+from itertools import islice
 from uuid import uuid4, UUID
 
-from pydantic import BaseModel, SecretStr, HttpUrl, Field
-from typing import List, Dict, Union, Optional, Set, Any
+from pydantic import BaseModel, SecretStr, HttpUrl, Field, field_validator
+from pydantic_core import core_schema
+from typing import Dict, Union, Optional, Set, Any, Tuple
 import orjson
 
+from .cache import TTLCache, cacheable, canonical_key
+from .metrics import registry as metrics
+
 
 def orjson_dumps(v, *, default, **kwargs):
     # orjson.dumps returns bytes, to match standard json.dumps we need to decode
@@ -17,21 +24,129 @@ def now_tz():
     return datetime.datetime.now(datetime.timezone.utc)
 
 
+# one shared tuple per distinct set of function names offered to the model
+_interned_names: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+MAX_INTERNED_NAMES = 4096
+
+
+def intern_names(names) -> Optional[Tuple[str, ...]]:
+    if not names:
+        return None
+    names = tuple(sys.intern(n) for n in names)
+    interned = _interned_names.get(names)
+    if interned is not None:
+        return interned
+    if len(_interned_names) < MAX_INTERNED_NAMES:
+        _interned_names[names] = names
+    return names
+
+
 class ChatMessage(BaseModel):
     role: str
     content: str
     name: Optional[str] = None
-    functions: Optional[list] = None #function_call handled by role & content; functions are what user presents to AI
+    functions: Optional[tuple] = None #function_call handled by role & content; functions are what user presents to AI
     received_at: datetime.datetime = Field(default_factory=now_tz)
     finish_reason: Optional[str] = None
     prompt_length: Optional[int] = None
     completion_length: Optional[int] = None
     total_length: Optional[int] = None
 
+    @field_validator("functions")
+    @classmethod
+    def _intern_functions(cls, v):
+        return intern_names(v)
+
     def __str__(self) -> str:
         return str(self.model_dump(exclude_none=True))
 
 
+class MessageHistory(Sequence):
+    """
+    Append-only message list that forks share up to the point they were made.
+
+    `fork()` is O(1): the fork keeps a reference to this history and its
+    length at that moment, and its own turns go to a new tail.  Indexing
+    walks at most `max_depth` forks before a fork flattens its base (copying
+    references, never messages).
+    """
+
+    __slots__ = ("_base", "_base_len", "_tail", "_depth")
+    max_depth = 32
+
+    def __init__(self, messages=()):
+        self._base = None
+        self._base_len = 0
+        self._tail = list(messages)
+        self._depth = 0
+
+    def fork(self) -> "MessageHistory":
+        child = MessageHistory()
+        if not self._tail:
+            # nothing of our own yet: share our base directly
+            child._base, child._base_len, child._depth = self._base, self._base_len, self._depth
+        elif self._depth >= self.max_depth:
+            child._base, child._base_len, child._depth = MessageHistory(self), len(self), 1
+        else:
+            child._base, child._base_len, child._depth = self, len(self), self._depth + 1
+        return child
+
+    def append(self, message: "ChatMessage") -> None:
+        self._tail.append(message)
+
+    def extend(self, messages) -> None:
+        self._tail.extend(messages)
+
+    def __len__(self) -> int:
+        return self._base_len + len(self._tail)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step == 1:
+                return list(islice(self, start, stop))
+            return [self[j] for j in range(start, stop, step)]
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("message index out of range")
+        node = self
+        while i < node._base_len:
+            node = node._base
+        return node._tail[i - node._base_len]
+
+    def __iter__(self):
+        segments = []
+        node, end = self, len(self)
+        while node is not None:
+            segments.append((node._tail, end - node._base_len))
+            node, end = node._base, node._base_len
+        for tail, count in reversed(segments):
+            yield from islice(tail, count)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (MessageHistory, list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"MessageHistory({list(self)!r})"
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source, handler):
+        items = core_schema.list_schema(handler.generate_schema(ChatMessage))
+        return core_schema.union_schema(
+            [
+                core_schema.is_instance_schema(cls),
+                core_schema.no_info_after_validator_function(cls, items),
+            ],
+            serialization=core_schema.wrap_serializer_function_ser_schema(
+                lambda v, serialize: serialize(list(v)), schema=items
+            ),
+        )
+
+
 class ChatSession(BaseModel):
     id: Union[str, UUID] = Field(default_factory=uuid4)
     created_at: datetime.datetime = Field(default_factory=now_tz)
@@ -40,7 +155,7 @@ class ChatSession(BaseModel):
     model: str
     system: str
     params: Dict[str, Any] = {}
-    messages: List[ChatMessage] = []
+    messages: MessageHistory = Field(default_factory=MessageHistory)
     input_fields: Set[str] = {}
     recent_messages: Optional[int] = None
     save_messages: Optional[bool] = True
@@ -73,6 +188,17 @@ class ChatSession(BaseModel):
             + [user_message.model_dump(include=self.input_fields, exclude_none=True)]
         )
 
+    def fork(self, **update) -> "ChatSession":
+        """A new session that shares this one's history up to now; later turns diverge."""
+        if not isinstance(self.messages, MessageHistory):
+            self.messages = MessageHistory(self.messages)
+        # validated like a new session, so overrides such as model or params are checked;
+        # live objects and the forked history pass through as they are
+        data = {name: getattr(self, name) for name in type(self).model_fields}
+        data.update(id=uuid4(), created_at=now_tz(), messages=self.messages.fork(), params=dict(self.params))
+        data.update(update)
+        return type(self).model_validate(data)
+
     def add_messages(
         self,
         user_message: ChatMessage,
@@ -109,51 +235,88 @@ class ChatSession(BaseModel):
         elif self.save_messages:
             self.messages.append(message)
 
+# cached results may legitimately be None
+_MISSING = object()
+
+
 class AITool:
-    instances = set() 
+    # registered functions by name; defining a name again replaces it
+    instances: Dict[str, "AITool"] = {}
+    # result caches by function name; shared by every session and kept when a tool is redefined
+    caches: Dict[str, TTLCache] = {}
+    # Vand's discovery functions register new tools as a side effect and are never cached
+    uncacheable = {"getToolPack", "getLucky", "findToolPacks"}
+
     def __init__(self, spec, func):
-        # if any(instance.name == name for instance in self.__class__.instances):
-        #    raise ValueError(f"An instance with the name '{name}' already exists")
-        # Remove any existing instance with the same name; this will overwrite in the case of duplicate names
-        self.__class__.instances = {instance for instance in self.__class__.instances if instance.name != spec['name']}
+        # this will overwrite in the case of duplicate names
         self.name = spec['name']
         self.func = func
         self.spec = spec
-        self.__class__.instances.add(self) 
+        self.__class__.instances[self.name] = self
+
+    @classmethod
+    def _register(cls, spec: dict, func: callable) -> "AITool":
+        # toolpacks are re-registered on every request; keep the existing tool if nothing changed
+        existing = cls.instances.get(spec['name'])
+        if existing is not None and existing.func == func and existing.spec == spec:
+            return existing
+        return cls(spec, func)
 
     @classmethod
     def define_function(
         cls,
         spec: dict,
         func: callable,
+        cache_ttl: float = None,
+        cache_max_entries: int = 256,
     ):
+        """
+        Register a function (or a list of specs sharing one func) for function calling.
+
+        Results are cached when `cache_ttl` is given, or when a spec is marked
+        with "x-cache": True or "x-cache": {"ttl": ..., "max_entries": ...}.
+        """
         if isinstance(spec, dict):
-            return cls(spec, func)
+            cls.configure_cache(spec, cache_ttl, cache_max_entries)
+            return cls._register(spec, func)
         elif isinstance(spec, list):
             instances = []
             for spec_item in spec:
                 # Process each spec dictionary in the list
-                instance = cls(spec_item, func)
+                cls.configure_cache(spec_item, cache_ttl, cache_max_entries)
+                instance = cls._register(spec_item, func)
                 instances.append(instance)
             return instances
         else:
             raise ValueError("Invalid spec argument")
 
-        return cls(spec, func)
+    @classmethod
+    def configure_cache(cls, spec: dict, ttl: float = None, max_entries: int = 256):
+        name = spec['name']
+        marker = spec.get("x-cache")
+        if ttl is None and marker:
+            if isinstance(marker, dict):
+                ttl = marker.get("ttl", 300)
+                max_entries = marker.get("max_entries", max_entries)
+            else:
+                ttl = 300
+        if ttl is None or name in cls.uncacheable:
+            return
+        cache = cls.caches.get(name)
+        if cache is None:
+            cls.caches[name] = TTLCache(ttl=ttl, max_entries=max_entries)
+        else:
+            cache.ttl = ttl
+            cache.max_entries = max_entries
 
     @classmethod
     def get_function_names(cls):
-        functions = []
-        for instance in cls.instances:
-            functions.append(instance.name)
-        return functions
+        return list(cls.instances)
 
     @classmethod
     def find_function_spec(cls, function_name):
-       for instance in cls.instances:
-           if instance.name == function_name:
-               return instance.spec
-               break # Stop after finding the first match
+        instance = cls.instances.get(function_name)
+        return instance.spec if instance else None
 
     @classmethod
     def execute_function(cls, function_call):
@@ -163,12 +326,22 @@ class AITool:
             arguments = orjson.loads(arguments)
         else:
             arguments = {}
-        for instance in cls.instances:
-           if instance.name == function_name:
-                # catch instances from Vand's VandBasicAPITool
-                if hasattr(instance.func, '__self__') and instance.func.__self__.__class__.__name__ == "VandBasicAPITool":
-                    return instance.func(function_name, **arguments)
-                else:
-                    return instance.func(**arguments)
-                    break # Stop after finding the first match
-
+        cache = cls.caches.get(function_name)
+        if cache is not None:
+            key = canonical_key(function_name, arguments)
+            result = cache.get(key, _MISSING)
+            if result is not _MISSING:
+                metrics.inc("aiapi_cache_hits_total", tool=function_name)
+                return result
+            metrics.inc("aiapi_cache_misses_total", tool=function_name)
+        instance = cls.instances.get(function_name)
+        if instance:
+            # catch instances from Vand's VandBasicAPITool
+            if hasattr(instance.func, '__self__') and instance.func.__self__.__class__.__name__ == "VandBasicAPITool":
+                result = instance.func(function_name, **arguments)
+            else:
+                result = instance.func(**arguments)
+            # failures (e.g. a tool server's 5xx) are retried on the next call
+            if cache is not None and cacheable(result):
+                cache.set(key, result)
+            return result
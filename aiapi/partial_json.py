@@ -0,0 +1,243 @@
+'''
+Incremental parsing of streamed JSON (e.g. function_call arguments) so partial
+results can be used before the model has finished generating.
+'''
+import re
+import types
+from typing import Any, Dict, Optional, Set, Union, get_args, get_origin
+
+import orjson
+from pydantic import BaseModel, ValidationError, create_model
+
+
+# the only characters that matter inside a string, outside an escape
+_STRING_SPECIAL = re.compile(r'["\\]')
+# a high surrogate escape, which needs the low one that follows before it can be decoded
+_HIGH_SURROGATE = re.compile(r"\\u[dD][89abAB][0-9a-fA-F]{2}$")
+_NOTHING = object()
+
+
+class PartialJSONParser:
+    """
+    Incremental JSON parser for streamed text.
+
+    Deltas are fed as they arrive and each character is scanned once.  Values
+    are built as they complete: a finished string, number or literal is parsed
+    on its own and a closed object or array is the one built from its members,
+    so nothing is parsed twice.  `current()` returns the best-effort value
+    parsed so far: unfinished string values are included, while unfinished
+    keys, numbers and literals are held back until they are complete.  It
+    copies only the open objects and arrays (shallowly) and decodes only the
+    new part of an open string; completed values are shared between results.
+    """
+
+    def __init__(self):
+        self._frames = []  # [container, key for its next member] of each open object or array
+        self._root = _NOTHING
+        self._expect_key = False
+        self._in_string = False
+        self._string_is_key = False
+        self._escape = False
+        self._escape_at = 0
+        self._unicode_left = 0
+        self._in_scalar = False
+        self._pending = ""  # raw text of the open token not decoded yet
+        self._raw_len = 0  # raw length of the open string so far
+        self._decoded = ""  # the open string decoded up to _decoded_to
+        self._decoded_to = 0
+        self._invalid = False
+
+    def feed(self, delta: str) -> Any:
+        self._scan(delta)
+        return self.current()
+
+    def _add(self, value: Any) -> None:
+        if not self._frames:
+            self._root = value
+            return
+        container, key = self._frames[-1]
+        if isinstance(container, dict):
+            container[key] = value
+        else:
+            container.append(value)
+
+    def _end_scalar(self, raw: str) -> None:
+        self._in_scalar = False
+        self._pending = ""
+        try:
+            self._add(orjson.loads(raw))
+        except orjson.JSONDecodeError:
+            self._invalid = True
+
+    def _end_string(self, raw: str) -> None:
+        self._in_string = False
+        self._pending = ""
+        try:
+            # raw starts where the decoded part ends
+            value = self._decoded + orjson.loads('"' + raw + '"')
+        except orjson.JSONDecodeError:
+            self._invalid = True
+            return
+        if self._string_is_key:
+            self._frames[-1][1] = value
+        else:
+            self._add(value)
+
+    def _scan(self, text: str) -> None:
+        i, n = 0, len(text)
+        start = 0  # where the open string or scalar starts in this delta
+        while i < n and not self._invalid:
+            if self._in_string:
+                if self._escape:
+                    if self._unicode_left:
+                        self._unicode_left -= 1
+                        if not self._unicode_left:
+                            self._escape = False
+                    elif text[i] == "u":
+                        self._unicode_left = 4
+                    else:
+                        self._escape = False
+                    i += 1
+                    continue
+                match = _STRING_SPECIAL.search(text, i)
+                if match is None:
+                    break
+                i = match.start()
+                if text[i] == "\\":
+                    self._escape = True
+                    self._escape_at = self._raw_len + i - start
+                else:
+                    self._raw_len += i - start
+                    self._end_string(self._pending + text[start:i])
+                i += 1
+                continue
+
+            c = text[i]
+            if self._in_scalar:
+                if c in "}], \t\r\n":
+                    self._end_scalar(self._pending + text[start:i])
+                elif c in '"{[:':
+                    self._invalid = True
+                    break
+                else:
+                    i += 1
+                    continue
+            if c == '"':
+                self._in_string = True
+                self._string_is_key = bool(self._frames) and isinstance(self._frames[-1][0], dict) and self._expect_key
+                self._raw_len = self._decoded_to = 0
+                self._decoded = ""
+                start = i + 1
+            elif c == "{" or c == "[":
+                self._frames.append([{} if c == "{" else [], None])
+                self._expect_key = c == "{"
+            elif c == "}" or c == "]":
+                if not self._frames:
+                    self._invalid = True
+                    break
+                container, _ = self._frames.pop()
+                self._add(container)
+                self._expect_key = False
+            elif c == ",":
+                self._expect_key = bool(self._frames) and isinstance(self._frames[-1][0], dict)
+            elif c == ":":
+                self._expect_key = False
+            elif c not in " \t\r\n":
+                self._in_scalar = True
+                start = i
+            i += 1
+
+        if self._in_string:
+            self._pending += text[start:]
+            self._raw_len += n - start
+        elif self._in_scalar:
+            self._pending += text[start:]
+
+    def _open_string(self) -> Optional[str]:
+        """The open string value decoded so far, up to any unfinished escape."""
+        end = self._escape_at if self._escape else self._raw_len
+        segment = self._pending[: end - self._decoded_to]
+        surrogate = _HIGH_SURROGATE.search(segment)
+        if surrogate:
+            segment = segment[: surrogate.start()]
+        if segment:
+            try:
+                self._decoded += orjson.loads('"' + segment + '"')
+            except orjson.JSONDecodeError:
+                return None
+            self._decoded_to += len(segment)
+            self._pending = self._pending[len(segment) :]
+        return self._decoded
+
+    def current(self) -> Any:
+        if self._invalid:
+            return None
+        value = _NOTHING
+        if self._in_string and not self._string_is_key:
+            value = self._open_string()
+            if value is None:
+                return None
+        for container, key in reversed(self._frames):
+            container = container.copy()
+            if value is not _NOTHING:
+                if isinstance(container, dict):
+                    container[key] = value
+                else:
+                    container.append(value)
+            value = container
+        if value is _NOTHING:
+            value = self._root
+        return None if value is _NOTHING else value
+
+
+_partial_models: Dict[type, type] = {}
+_building: Set[type] = set()
+
+
+def _partial_annotation(annotation: Any) -> Any:
+    """`annotation` with every model in it (nested, in lists, unions, ...) made partial."""
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        # a model that contains itself keeps its full schema below the first level
+        return annotation if annotation in _building else partial_model(annotation)
+    origin, args = get_origin(annotation), get_args(annotation)
+    if not args:
+        return annotation
+    partial_args = tuple(_partial_annotation(a) for a in args)
+    if partial_args == args:
+        return annotation
+    if origin is Union or origin is types.UnionType:
+        return Union[partial_args]
+    if origin in (list, set, frozenset, tuple, dict):
+        return origin[partial_args]
+    return annotation
+
+
+def partial_model(schema: type) -> type:
+    """Variant of a pydantic schema where every field is optional, for validating partial output.
+
+    Nested models, including those inside lists, dicts and unions, are made
+    partial too, so they validate while they are still streaming.
+    """
+    model = _partial_models.get(schema)
+    if model is None:
+        _building.add(schema)
+        try:
+            fields = {
+                name: (Optional[_partial_annotation(field.annotation)], None)
+                for name, field in schema.model_fields.items()
+            }
+        finally:
+            _building.discard(schema)
+        model = _partial_models.setdefault(schema, create_model(f"Partial{schema.__name__}", **fields))
+    return model
+
+
+def validate_partial(schema: type, value: Any) -> Optional[dict]:
+    """Validate a partially parsed object against `schema`, returning only the fields received so far."""
+    if not isinstance(value, dict):
+        return None
+    try:
+        partial = partial_model(schema).model_validate(value)
+    except ValidationError:
+        return None
+    return partial.model_dump(exclude_unset=True)
@@ -0,0 +1,272 @@
+'''
+Local relevance ranking of tools: routing gen_with_tools without the LLM
+selection call, and pruning the function specs sent with each request.
+'''
+import math
+import re
+import time
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+
+from .utils import estimate_tokens
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "for", "from",
+    "how", "i", "in", "is", "it", "me", "my", "of", "on", "or", "please", "the",
+    "this", "to", "what", "when", "where", "which", "who", "with", "you", "your",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in re.findall(r"[a-z0-9]+", (text or "").lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 over a small, fixed set of documents."""
+
+    def __init__(self, documents: List[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_terms = [Counter(tokenize(d)) for d in documents]
+        self.doc_lengths = [sum(c.values()) for c in self.doc_terms]
+        self.avg_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if documents else 0.0
+        df = Counter(term for terms in self.doc_terms for term in terms)
+        n = len(documents)
+        self.idf = {term: math.log(1 + (n - f + 0.5) / (f + 0.5)) for term, f in df.items()}
+
+    def scores(self, query: str) -> List[float]:
+        query_terms = [t for t in tokenize(query) if t in self.idf]
+        results = []
+        for terms, length in zip(self.doc_terms, self.doc_lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / (self.avg_length or 1))
+            score = 0.0
+            for term in query_terms:
+                tf = terms.get(term)
+                if tf:
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            results.append(score)
+        return results
+
+
+@dataclass
+class RouterStats:
+    routed: int = 0
+    fallbacks: int = 0
+    route_seconds: float = 0.0
+    # only populated in shadow mode, where the LLM selection still runs
+    compared: int = 0
+    agreed: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.routed + self.fallbacks
+        return self.routed / total if total else 0.0
+
+    @property
+    def accuracy(self) -> Optional[float]:
+        return self.agreed / self.compared if self.compared else None
+
+    @property
+    def mean_latency(self) -> float:
+        total = self.routed + self.fallbacks
+        return self.route_seconds / total if total else 0.0
+
+
+class ToolRouter:
+    """
+    Base class for local tool routers used by gen_with_tools.
+
+    `route` returns the 1-based index of the selected tool, or None when the
+    router is not confident and the LLM selection call should be made instead.
+    In shadow mode the LLM selection always runs and is only compared against
+    the router's choice, which is how a router's accuracy is measured before
+    trusting it.
+    """
+
+    def __init__(self, shadow: bool = False):
+        self.shadow = shadow
+        self.stats = RouterStats()
+
+    def choose(self, prompt: str, tools: List[Any]) -> Optional[int]:
+        return None
+
+    def route(self, prompt: str, tools: List[Any]) -> Optional[int]:
+        start = time.perf_counter()
+        choice = self.choose(prompt, tools)
+        self.stats.route_seconds += time.perf_counter() - start
+        if choice is None:
+            self.stats.fallbacks += 1
+        else:
+            self.stats.routed += 1
+        return choice
+
+    def record_llm_choice(self, router_choice: Optional[int], llm_choice: int) -> None:
+        if router_choice is not None:
+            self.stats.compared += 1
+            self.stats.agreed += router_choice == llm_choice
+
+
+class BM25ToolRouter(ToolRouter):
+    """
+    Routes with BM25 over the tool docstrings.
+
+    A tool is chosen only if its score is at least `min_score` and beats the
+    runner-up by a factor of `margin`; anything less falls back to the LLM.
+    """
+
+    def __init__(self, min_score: float = 0.5, margin: float = 2.0, shadow: bool = False):
+        super().__init__(shadow=shadow)
+        self.min_score = min_score
+        self.margin = margin
+        self._indexes: Dict[Tuple[str, ...], BM25Index] = {}
+
+    def _index(self, tools: List[Any]) -> BM25Index:
+        docs = tuple(f"{getattr(t, '__name__', '')} {t.__doc__ or ''}" for t in tools)
+        index = self._indexes.get(docs)
+        if index is None:
+            # toolsets change between requests; don't keep an index for each forever
+            if len(self._indexes) > 256:
+                self._indexes.clear()
+            index = self._indexes[docs] = BM25Index(list(docs))
+        return index
+
+    def choose(self, prompt: str, tools: List[Any]) -> Optional[int]:
+        if not tools:
+            return None
+        scores = self._index(tools).scores(prompt)
+        ranked = sorted(range(len(scores)), key=scores.__getitem__, reverse=True)
+        best = scores[ranked[0]]
+        runner_up = scores[ranked[1]] if len(ranked) > 1 else 0.0
+        if best < self.min_score or best < runner_up * self.margin:
+            return None
+        return ranked[0] + 1
+
+
+def evaluate_router(router: ToolRouter, tools: List[Any], examples: List[Tuple[str, int]]) -> Dict[str, Any]:
+    """
+    Measure a router against labeled (prompt, expected 1-based tool index) pairs.
+
+    Returns coverage (share of prompts routed locally), accuracy on the routed
+    prompts, and the mean routing latency in seconds.
+    """
+    routed = correct = 0
+    elapsed = 0.0
+    for prompt, expected in examples:
+        start = time.perf_counter()
+        choice = router.choose(prompt, tools)
+        elapsed += time.perf_counter() - start
+        if choice is not None:
+            routed += 1
+            correct += choice == expected
+    total = len(examples)
+    return {
+        "examples": total,
+        "coverage": routed / total if total else 0.0,
+        "accuracy": correct / routed if routed else None,
+        "mean_latency": elapsed / total if total else 0.0,
+    }
+
+
+def function_spec_text(spec: dict) -> str:
+    """Searchable text for an OpenAI function spec: name, description and parameters."""
+    # split camelCase / snake_case names so "getWeatherNow" matches "weather"
+    name = re.sub(r"([a-z])([A-Z])", r"\1 \2", spec.get("name", "")).replace("_", " ")
+    parts = [name, spec.get("description", "")]
+    properties = spec.get("parameters", {}).get("properties", {})
+    for param, details in properties.items():
+        parts.append(param)
+        if isinstance(details, dict):
+            parts.append(details.get("description", ""))
+    return " ".join(parts)
+
+
+@dataclass
+class PruneDecision:
+    query: str
+    kept: List[str]
+    dropped: List[str]
+    scores: Dict[str, float]
+    tokens: int
+
+
+class FunctionSelector:
+    """
+    Sends only the function specs most relevant to the conversation.
+
+    Specs are ranked with BM25 against the prompt plus the last
+    `context_messages` messages, and kept in rank order until either
+    `top_k` specs or `max_tokens` (estimated) is reached.  Names in
+    `always_include` are never pruned; by default these are Vand's
+    toolpack discovery functions so the model can still load new tools.
+
+    Every decision is stored in `history` (most recent last) and passed to
+    `on_decision` if given.
+    """
+
+    def __init__(
+        self,
+        top_k: int = 8,
+        max_tokens: int = None,
+        always_include: Tuple[str, ...] = ("getToolPack", "getLucky", "findToolPacks"),
+        context_messages: int = 4,
+        history_size: int = 100,
+        on_decision: Any = None,
+    ):
+        self.top_k = top_k
+        self.max_tokens = max_tokens
+        self.always_include = set(always_include)
+        self.context_messages = context_messages
+        self.history = deque(maxlen=history_size)
+        self.on_decision = on_decision
+        self._indexes: Dict[Tuple[str, ...], BM25Index] = {}
+
+    @property
+    def last_decision(self) -> Optional[PruneDecision]:
+        return self.history[-1] if self.history else None
+
+    def _index(self, functions: List[dict]) -> BM25Index:
+        # keyed by content, so a spec whose description changes gets a new index
+        texts = tuple(function_spec_text(f) for f in functions)
+        index = self._indexes.get(texts)
+        if index is None:
+            if len(self._indexes) > 256:
+                self._indexes.clear()
+            index = self._indexes[texts] = BM25Index(list(texts))
+        return index
+
+    def select(self, functions: List[dict], prompt: str, messages: List[Any] = ()) -> List[dict]:
+        recent = [m.content for m in messages[-self.context_messages:]] if self.context_messages else []
+        query = " ".join(recent + [prompt])
+        scores = self._index(functions).scores(query)
+        ranked = sorted(range(len(functions)), key=scores.__getitem__, reverse=True)
+
+        kept_idx = [i for i in ranked if functions[i].get("name") in self.always_include]
+        tokens = sum(estimate_tokens(orjson.dumps(functions[i]).decode()) for i in kept_idx)
+        for i in ranked:
+            if i in kept_idx:
+                continue
+            if len(kept_idx) >= self.top_k:
+                break
+            cost = estimate_tokens(orjson.dumps(functions[i]).decode())
+            if self.max_tokens is not None and tokens + cost > self.max_tokens:
+                continue
+            kept_idx.append(i)
+            tokens += cost
+
+        kept_idx.sort()  # keep the caller's ordering
+        selected = [functions[i] for i in kept_idx]
+        kept_names = {f.get("name") for f in selected}
+        decision = PruneDecision(
+            query=query,
+            kept=[f.get("name") for f in selected],
+            dropped=[f.get("name") for f in functions if f.get("name") not in kept_names],
+            scores={f.get("name"): score for f, score in zip(functions, scores)},
+            tokens=tokens,
+        )
+        self.history.append(decision)
+        if self.on_decision:
+            self.on_decision(decision)
+        return selected
@@ -0,0 +1,196 @@
+'''
+Request scheduling: priority classes, fair queuing across tenants and a
+limit on concurrent upstream requests, shared by every session of an AIChat.
+
+    from aiapi.scheduler import Scheduler, scheduling
+
+    ai = AIChat(console=False, scheduler=Scheduler(max_concurrency=8))
+    ai("Hi!")                                   # "interactive" by default
+
+    with scheduling(priority="batch", tenant="nightly-report"):
+        for doc in docs:
+            ai(f"Summarize: {doc}")
+
+A request waits for a free slot before it is sent and holds it until the
+response (or the last chunk of a stream) is read.  Free slots go to the
+highest priority class with requests waiting; within a class, tenants
+share slots in proportion to their weight (start-time fair queuing), so one
+tenant's backlog can't starve the others.  The tenant defaults to the
+session's `tenant` field, then its id.
+
+`scheduling()` sets the priority and tenant for the current thread or task
+(contextvars): code run in a thread pool needs its own `with` block.
+'''
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple, Union
+
+from .metrics import registry as metrics
+
+# lower runs first
+PRIORITIES = {"interactive": 0, "default": 1, "batch": 2}
+
+_priority: ContextVar[Optional[Union[str, int]]] = ContextVar("aiapi_priority", default=None)
+_tenant: ContextVar[Optional[str]] = ContextVar("aiapi_tenant", default=None)
+
+
+@contextmanager
+def scheduling(priority: Union[str, int] = None, tenant: str = None):
+    """Priority and tenant for requests made inside the block."""
+    tokens = []
+    if priority is not None:
+        tokens.append((_priority, _priority.set(priority)))
+    if tenant is not None:
+        tokens.append((_tenant, _tenant.set(tenant)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def rank(priority: Union[str, int]) -> int:
+    if isinstance(priority, int):
+        return priority
+    try:
+        return PRIORITIES[priority]
+    except KeyError:
+        raise ValueError(f"Unknown priority {priority!r}; expected one of {', '.join(PRIORITIES)}.")
+
+
+class _Waiter:
+    __slots__ = ("priority", "event", "loop", "future", "granted", "cancelled")
+
+    def __init__(self, priority: Union[str, int], loop: asyncio.AbstractEventLoop = None):
+        self.priority = priority
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+        self.granted = False
+        self.cancelled = False
+
+    def wake(self) -> None:
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class Scheduler:
+    def __init__(
+        self,
+        max_concurrency: int = 16,
+        weights: Dict[str, float] = None,
+        default_priority: Union[str, int] = "interactive",
+    ):
+        assert max_concurrency > 0, "max_concurrency must be positive."
+        rank(default_priority)
+        self.max_concurrency = max_concurrency
+        self.weights = dict(weights or {})
+        self.default_priority = default_priority
+        self.active = 0
+        self._lock = threading.Lock()
+        self._queue = []  # (rank, start tag, seq, waiter)
+        self._seq = itertools.count()
+        # per priority class: virtual time, and the finish tag of each tenant's last request
+        self._vtime: Dict[int, float] = {}
+        self._finish: Dict[int, Dict[str, float]] = {}
+
+    @property
+    def queued(self) -> int:
+        with self._lock:
+            return sum(1 for *_, w in self._queue if not w.cancelled)
+
+    def resolve(self, priority: Union[str, int] = None, tenant: str = None) -> Tuple[Union[str, int], str]:
+        """Context settings win over the session's, which win over the defaults."""
+        # priority 0 is a valid rank, so test for None rather than truthiness
+        for value in (_priority.get(), priority, self.default_priority):
+            if value is not None:
+                priority = value
+                break
+        for value in (_tenant.get(), tenant, "default"):
+            if value is not None:
+                tenant = value
+                break
+        return priority, tenant
+
+    def _enqueue(self, priority: Union[str, int], tenant: str, cost: float, waiter: _Waiter) -> None:
+        level = rank(priority)
+        with self._lock:
+            vtime = self._vtime.get(level, 0.0)
+            finish = self._finish.setdefault(level, {})
+            start = max(vtime, finish.get(tenant, 0.0))
+            finish[tenant] = start + cost / self.weights.get(tenant, 1.0)
+            if len(finish) > 4096:
+                # tenants whose requests have all started can't be behind anyone
+                for name in [t for t, f in finish.items() if f <= vtime]:
+                    del finish[name]
+            heapq.heappush(self._queue, (level, start, next(self._seq), waiter))
+            self._dispatch()
+
+    def _dispatch(self) -> None:
+        # called with self._lock held
+        while self.active < self.max_concurrency and self._queue:
+            level, start, _, waiter = heapq.heappop(self._queue)
+            if waiter.cancelled:
+                continue
+            self._vtime[level] = max(self._vtime.get(level, 0.0), start)
+            self.active += 1
+            waiter.granted = True
+            waiter.wake()
+
+    def release(self) -> None:
+        with self._lock:
+            self.active -= 1
+            self._dispatch()
+
+    def acquire(self, priority: Union[str, int] = None, tenant: str = None, cost: float = 1.0) -> None:
+        """Block until a slot is free; pair with `release()`."""
+        priority, tenant = self.resolve(priority, tenant)
+        waiter = _Waiter(priority)
+        start = time.perf_counter()
+        self._enqueue(priority, tenant, cost, waiter)
+        waiter.event.wait()
+        metrics.observe("aiapi_scheduler_wait_seconds", time.perf_counter() - start, priority=priority)
+
+    async def acquire_async(self, priority: Union[str, int] = None, tenant: str = None, cost: float = 1.0) -> None:
+        priority, tenant = self.resolve(priority, tenant)
+        waiter = _Waiter(priority, asyncio.get_running_loop())
+        start = time.perf_counter()
+        self._enqueue(priority, tenant, cost, waiter)
+        try:
+            await waiter.future
+        except BaseException:
+            with self._lock:
+                waiter.cancelled = True
+                granted = waiter.granted
+            if granted:
+                self.release()
+            raise
+        metrics.observe("aiapi_scheduler_wait_seconds", time.perf_counter() - start, priority=priority)
+
+    @contextmanager
+    def slot(self, priority: Union[str, int] = None, tenant: str = None, cost: float = 1.0):
+        self.acquire(priority, tenant, cost)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def slot_async(self, priority: Union[str, int] = None, tenant: str = None, cost: float = 1.0):
+        await self.acquire_async(priority, tenant, cost)
+        try:
+            yield
+        finally:
+            self.release()
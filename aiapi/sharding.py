@@ -0,0 +1,251 @@
+'''
+Session sharding across worker processes, for CPU-bound workloads that one
+GIL can't keep up with (pydantic validation, JSON and SSE parsing, tool
+argument binding).
+
+    from aiapi.sharding import ShardedAIChat
+
+    with ShardedAIChat(workers=8, api_key=..., initializer=register_tools) as ai:
+        sid = ai.new_session(system="Be brief.")
+        print(ai("Hello!", id=sid))
+        for chunk in ai.stream("Tell me a story.", id=sid):
+            print(chunk["delta"], end="")
+
+Session ids are hashed (crc32) onto the workers.  Each worker owns its
+sessions, its AIChat and its HTTP connection pool, and runs turns for
+different sessions on a thread pool; turns on one session run in order.
+Arguments and results cross the process boundary by pickling, so tools,
+schemas and the initializer must be importable (defined at module level).
+AITool registrations are per process: define them in `initializer`.
+'''
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Tuple, Union
+from uuid import UUID, uuid4
+
+
+class WorkerError(RuntimeError):
+    pass
+
+
+def _portable_error(e: BaseException) -> BaseException:
+    import pickle
+
+    try:
+        pickle.dumps(e)
+        return e
+    except Exception:
+        return WorkerError(f"{type(e).__name__}: {e}")
+
+
+def _worker_main(conn, chat_kwargs: Dict[str, Any], initializer: Callable, initargs: Tuple, threads: int) -> None:
+    from .simpleaichat import AIChat
+    from .snapshot import SESSION_EXCLUDE
+
+    if initializer:
+        initializer(*initargs)
+    ai = AIChat(console=False, default_session=False, **chat_kwargs)
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    def run(req_id, method, args, kwargs):
+        try:
+            # turns take the session's lock themselves (see AIChat.session_lock)
+            if method == "stream":
+                for chunk in ai.stream(*args, **kwargs):
+                    send((req_id, "chunk", chunk))
+                result = None
+            elif method == "new_session":
+                result = ai.new_session(**kwargs)
+            else:
+                with ai.session_lock(kwargs["id"]):
+                    if method == "get_session":
+                        # live objects are excluded by their fields; this drops the credentials
+                        result = ai.get_session(kwargs["id"]).model_dump(exclude=SESSION_EXCLUDE)
+                    else:
+                        result = getattr(ai, method)(*args, **kwargs)
+            send((req_id, "result", result))
+        except BaseException as e:
+            send((req_id, "error", _portable_error(e)))
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+            if message is None:
+                break
+            pool.submit(run, *message)
+    conn.close()
+
+
+class _Shard:
+    def __init__(self, ctx, chat_kwargs, initializer, initargs, threads):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child, chat_kwargs, initializer, initargs, threads),
+            daemon=True,
+        )
+        self.process.start()
+        child.close()
+        self.send_lock = threading.Lock()
+        # req_id -> Future for calls, or queue.Queue for streams
+        self.pending: Dict[int, Union[Future, queue.Queue]] = {}
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+
+    def send(self, message) -> None:
+        with self.send_lock:
+            self.conn.send(message)
+
+    def _read(self) -> None:
+        while True:
+            try:
+                req_id, kind, value = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            waiter = self.pending.get(req_id)
+            if isinstance(waiter, queue.Queue):
+                if kind != "chunk":
+                    self.pending.pop(req_id, None)
+                waiter.put((kind, value))
+            elif waiter is not None:
+                self.pending.pop(req_id, None)
+                if kind == "error":
+                    waiter.set_exception(value)
+                else:
+                    waiter.set_result(value)
+        # the worker is gone: fail everything still waiting on it
+        error = WorkerError(f"Worker process {self.process.pid} exited.")
+        for req_id, waiter in list(self.pending.items()):
+            self.pending.pop(req_id, None)
+            if isinstance(waiter, queue.Queue):
+                waiter.put(("error", error))
+            else:
+                waiter.set_exception(error)
+
+
+class ShardedAIChat:
+    def __init__(
+        self,
+        system: str = None,
+        id: Union[str, UUID] = None,
+        workers: int = None,
+        threads_per_worker: int = 16,
+        initializer: Callable = None,
+        initargs: Tuple = (),
+        default_session: bool = True,
+        mp_context: str = "spawn",
+        **kwargs,
+    ):
+        """`kwargs` (api_key, api_url, model, params, ...) apply to every new session."""
+        ctx = multiprocessing.get_context(mp_context)
+        chat_kwargs = {k: kwargs.pop(k) for k in ("hooks",) if k in kwargs}
+        self.session_defaults = kwargs
+        self._ids = itertools.count()
+        self.shards: List[_Shard] = [
+            _Shard(ctx, chat_kwargs, initializer, initargs, threads_per_worker)
+            for _ in range(workers or os.cpu_count() or 1)
+        ]
+        self.default_session = None
+        if default_session:
+            self.default_session = self.new_session(id=id, system=system)
+
+    def shard_for(self, id: Union[str, UUID]) -> _Shard:
+        return self.shards[zlib.crc32(str(id).encode()) % len(self.shards)]
+
+    def _submit(self, shard: _Shard, method: str, args: tuple, kwargs: dict, waiter) -> Any:
+        req_id = next(self._ids)
+        shard.pending[req_id] = waiter
+        try:
+            shard.send((req_id, method, args, kwargs))
+        except BaseException:
+            shard.pending.pop(req_id, None)
+            raise
+        return waiter
+
+    def _id(self, id: Union[str, UUID] = None) -> str:
+        id = id or self.default_session
+        if id is None:
+            raise ValueError("No default session exists.")
+        return str(id)
+
+    def submit(self, prompt: Union[str, Any], id: Union[str, UUID] = None, **kwargs) -> Future:
+        """Send a turn without waiting; returns a Future for the response."""
+        id = self._id(id)
+        return self._submit(self.shard_for(id), "__call__", (prompt,), {"id": id, **kwargs}, Future())
+
+    def __call__(self, prompt: Union[str, Any], id: Union[str, UUID] = None, **kwargs) -> Any:
+        return self.submit(prompt, id, **kwargs).result()
+
+    def stream(self, prompt: str, id: Union[str, UUID] = None, **kwargs) -> Iterator[Dict[str, Any]]:
+        id = self._id(id)
+        chunks = self._submit(self.shard_for(id), "stream", (prompt,), {"id": id, **kwargs}, queue.Queue())
+        while True:
+            kind, value = chunks.get()
+            if kind == "chunk":
+                yield value
+            elif kind == "error":
+                raise value
+            else:
+                return
+
+    def _call(self, method: str, id: str, **kwargs) -> Any:
+        return self._submit(self.shard_for(id), method, (), {"id": id, **kwargs}, Future()).result()
+
+    def new_session(self, **kwargs) -> str:
+        """Create a session on its shard and return its id."""
+        id = str(kwargs.pop("id", None) or uuid4())
+        kwargs = {k: v for k, v in {**self.session_defaults, **kwargs}.items() if v is not None}
+        self._call("new_session", id, **kwargs)
+        return id
+
+    def get_session(self, id: Union[str, UUID] = None) -> Dict[str, Any]:
+        """A copy of the session's fields (the session itself lives in its worker)."""
+        return self._call("get_session", self._id(id))
+
+    def reset_session(self, id: Union[str, UUID] = None) -> None:
+        self._call("reset_session", self._id(id))
+
+    def delete_session(self, id: Union[str, UUID] = None) -> None:
+        id = self._id(id)
+        self._call("delete_session", id)
+        if id == self.default_session:
+            self.default_session = None
+
+    @contextmanager
+    def session(self, **kwargs):
+        id = self.new_session(**kwargs)
+        try:
+            yield id
+        finally:
+            self.delete_session(id)
+
+    def close(self, timeout: float = 10.0) -> None:
+        for shard in self.shards:
+            try:
+                shard.send(None)
+            except (OSError, ValueError):
+                pass
+        for shard in self.shards:
+            shard.process.join(timeout)
+            if shard.process.is_alive():
+                shard.process.terminate()
+            shard.conn.close()
+
+    def __enter__(self) -> "ShardedAIChat":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
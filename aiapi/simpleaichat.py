@@ -1,30 +1,52 @@
 import os
 import datetime
-import dateutil
+import threading
 from uuid import uuid4, UUID
-from contextlib import contextmanager, asynccontextmanager
+from contextlib import contextmanager, asynccontextmanager, nullcontext
 import csv
-from termcolor import colored
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 from httpx import Client, AsyncClient
-from typing import List, Dict, Union, Optional, Any
+from typing import Callable, List, Dict, Union, Optional, Any, ClassVar, Tuple
 import orjson
-from dotenv import load_dotenv
-from rich.console import Console
 
-from .models import ChatMessage, ChatSession, AITool
+from .models import ChatMessage, ChatSession, AITool, MessageHistory
 from .chatgpt import ChatGPTSession
 
 from .vand_utils import VandBasicAPITool
+from .backends import Backend
+from .metrics import registry as metrics
+from .utils import load_env, character_lookup, character_lookup_async, shared_client, shared_async_client, AsyncRLock, mean_logprob
 
-load_dotenv()
+# rich, termcolor and dateutil are only imported by the methods that use them
 
 
 class AIChat(BaseModel):
     client: Any
     default_session: Optional[ChatSession]
     sessions: Dict[Union[str, UUID], ChatSession] = {}
+    # instrumentation hooks (see aiapi.hooks) given to every session created
+    hooks: Optional[Any] = None
+    # request scheduler (see aiapi.scheduler) shared by every session created
+    scheduler: Optional[Any] = None
+    # API key pool (see aiapi.keypool) shared by every session created
+    key_pool: Optional[Any] = None
+    # backend router (see aiapi.backends) shared by every session created
+    router: Optional[Any] = None
+    # circuit breaker (see aiapi.circuit) shared by every session created
+    circuit_breaker: Optional[Any] = None
+    # caps the turns in progress (see aiapi.circuit.LoadShedder)
+    load_shedder: Optional[Any] = None
+    # allocation profiler (see aiapi.diagnostics) wrapped around every call
+    profiler: Optional[Any] = None
+    # character system prompts by (character, character_command); saved in snapshots
+    system_prompts: ClassVar[Dict[Tuple[str, Optional[str]], str]] = {}
+    # fields passed on to every session created
+    session_shared: ClassVar[Tuple[str, ...]] = ("hooks", "scheduler", "key_pool", "circuit_breaker", "router")
+    # per-session locks: turns on a session run one at a time, sessions run in parallel
+    lock_type: ClassVar[Any] = threading.RLock
+    _session_locks: Dict[Any, Any] = PrivateAttr(default_factory=dict)
+    _locks_guard: Any = PrivateAttr(default_factory=threading.Lock)
 
     def __init__(
         self,
@@ -37,7 +59,10 @@ class AIChat(BaseModel):
         console: bool = True,
         **kwargs,
     ):
-        client = Client(proxies=os.getenv("https_proxy"))
+        load_env()
+        client = self._default_client()
+        profiler = kwargs.pop("profiler", None)
+        load_shedder = kwargs.pop("load_shedder", None)
         system_format = self.build_system(character, character_command, system)
 
         sessions = {}
@@ -51,7 +76,12 @@ class AIChat(BaseModel):
             sessions = {new_session.id: new_session}
 
         super().__init__(
-            client=client, default_session=new_default_session, sessions=sessions
+            client=client,
+            default_session=new_default_session,
+            sessions=sessions,
+            profiler=profiler,
+            load_shedder=load_shedder,
+            **{name: kwargs.get(name) for name in self.session_shared},
         )
 
         if not system and console:
@@ -59,6 +89,10 @@ class AIChat(BaseModel):
             new_default_session.title = character
             self.interactive_console(character=character, prime=prime)
 
+    @classmethod
+    def _default_client(cls) -> Optional[Client]:
+        return Client(proxies=os.getenv("https_proxy"))
+
     def new_session(
         self,
         return_session: bool = False,
@@ -67,22 +101,73 @@ class AIChat(BaseModel):
 
         if "model" not in kwargs:  # set default
             kwargs["model"] = "gpt-3.5-turbo"
-        # TODO: Add support for more models (PaLM, Claude)
-        if "gpt-" in kwargs["model"]:
-            gpt_api_key = kwargs.get("api_key") or os.getenv("OPENAI_API_KEY")
-            assert gpt_api_key, f"An API key for {kwargs['model'] } was not defined."
-            sess = ChatGPTSession(
-                auth={
-                    "api_key": gpt_api_key,
-                },
-                **kwargs,
-            )
+        for name in self.session_shared:
+            if name not in kwargs and getattr(self, name, None):
+                kwargs[name] = getattr(self, name)
+        # every backend speaks the OpenAI chat completions API (see aiapi.backends)
+        model = kwargs["model"]
+        router = kwargs.get("router")
+        if router is not None:
+            backend = None
+            if not router.candidates(model):
+                raise ValueError(f"No backend serves model {model}.")
+        else:
+            backend = Backend.for_model(model)
+            if backend is None and "api_url" not in kwargs:
+                raise ValueError(f"No backend serves model {model}; add one with Backend.register.")
+            if backend is not None and "api_url" not in kwargs:
+                kwargs["api_url"] = backend.url
+        api_key = kwargs.get("api_key") or (backend.resolve_key() if backend else None)
+        if not api_key and kwargs.get("key_pool"):
+            api_key = kwargs["key_pool"].keys[0].api_key
+        if backend is not None and backend.api_key_env == "OPENAI_API_KEY":
+            assert api_key, f"An API key for {model} was not defined."
+        sess = ChatGPTSession(
+            auth={
+                "api_key": api_key or "",
+            },
+            **kwargs,
+        )
 
         if return_session:
             return sess
         else:
             self.sessions[sess.id] = sess
 
+    def _lock_for(self, sess: ChatSession):
+        with self._locks_guard:
+            lock = self._session_locks.get(sess.id)
+            if lock is None:
+                lock = self._session_locks[sess.id] = self.lock_type()
+            return lock
+
+    def session_lock(self, id: Union[str, UUID] = None):
+        """The lock every turn on session `id` holds; hold it to run several turns as one."""
+        return self._lock_for(self.get_session(id))
+
+    def _admit(self):
+        return self.load_shedder.admit() if self.load_shedder else nullcontext()
+
+    @contextmanager
+    def _turn(self, sess: ChatSession, label: str):
+        with self._admit(), self._lock_for(sess), self._profile(sess, label):
+            yield
+
+    def _locked_stream(self, sess: ChatSession, stream):
+        # taken on the first chunk and held until the stream is exhausted or closed
+        with self._admit(), self._lock_for(sess):
+            yield from stream
+
+    def _profile(self, sess: ChatSession, label: str):
+        return self.profiler.track(sess, label) if self.profiler else nullcontext()
+
+    def _profile_stream(self, sess: ChatSession, stream):
+        if not self.profiler:
+            return stream
+        if hasattr(stream, "__aiter__"):
+            return self.profiler.track_aiter(stream, sess)
+        return self.profiler.track_iter(stream, sess)
+
     def get_session(self, id: Union[str, UUID] = None) -> ChatSession:
         try:
             sess = self.sessions[id] if id else self.default_session
@@ -94,7 +179,7 @@ class AIChat(BaseModel):
 
     def reset_session(self, id: Union[str, UUID] = None) -> None:
         sess = self.get_session(id)
-        sess.messages = []
+        sess.messages = MessageHistory()
 
     def delete_session(self, id: Union[str, UUID] = None) -> None:
         sess = self.get_session(id)
@@ -102,8 +187,21 @@ class AIChat(BaseModel):
             if sess.id == self.default_session.id:
                 self.default_session = None
         del self.sessions[sess.id]
+        with self._locks_guard:
+            self._session_locks.pop(sess.id, None)
+        if metrics.session_labels:
+            metrics.drop_session(sess.id)
         del sess
 
+    def fork_session(self, id: Union[str, UUID] = None, **kwargs) -> ChatSession:
+        """
+        A new session continuing from session `id`'s history without copying it.
+        `kwargs` override fields of the fork (e.g. id, system, params, model).
+        """
+        sess = self.get_session(id).fork(**kwargs)
+        self.sessions[sess.id] = sess
+        return sess
+
     @contextmanager
     def session(self, **kwargs):
         sess = self.new_session(return_session=True, **kwargs)
@@ -124,56 +222,94 @@ class AIChat(BaseModel):
         tools: List[Any] = None,
         input_schema: Any = None,
         output_schema: Any = None,
+        n: int = None,
+        scorer: Callable = None,
     ) -> str:
+        """With `n`, returns n sampled answers, best first (see best_of)."""
         sess = self.get_session(id)
-        if tools:
-            for tool in tools:
-                assert tool.__doc__, f"Tool {tool} does not have a docstring."
-            assert len(tools) <= 9, "You can only have a maximum of 9 tools."
-            return sess.gen_with_tools(
-                prompt,
-                tools,
-                client=self.client,
-                system=system,
-                save_messages=save_messages,
-                params=params,
-            )
-        elif functions:
-            function_specs= []
-            for function in functions:
-                if function.startswith("vand-") or function=="default":
-                    vand_tool = VandBasicAPITool.get_toolpack(function)
-                    AITool.define_function(spec=vand_tool.functions, func=vand_tool.execute_tool_call)
-                    print(f"functions: {AITool.get_function_names()}")
-                    function_specs += vand_tool.functions
-                else:
-                    # check for locally defined functions
-                    if AITool.find_function_spec(function):
-                        function_specs.append(AITool.find_function_spec(function))
-
-            return sess.gen(
-                prompt,
-                client=self.client,
-                function_name=None,
-                system=system,
-                save_messages=save_messages,
-                params=params,
-                functions=function_specs,
-                input_schema=input_schema,
-                output_schema=output_schema,
-            )        
-        else:
-            return sess.gen(
-                prompt,
-                client=self.client,
-                function_name=None,
-                system=system,
-                save_messages=save_messages,
-                params=params,
-                functions=functions,
-                input_schema=input_schema,
-                output_schema=output_schema,
-            )
+        with self._turn(sess, "call"):
+            if tools:
+                for tool in tools:
+                    assert tool.__doc__, f"Tool {tool} does not have a docstring."
+                assert len(tools) <= 9, "You can only have a maximum of 9 tools."
+                assert n is None, "n is not supported with tools."
+                return sess.gen_with_tools(
+                    prompt,
+                    tools,
+                    client=self.client,
+                    system=system,
+                    save_messages=save_messages,
+                    params=params,
+                )
+            elif functions:
+                function_specs= []
+                for function in functions:
+                    if function.startswith("vand-") or function=="default":
+                        vand_tool = VandBasicAPITool.get_toolpack(function)
+                        AITool.define_function(spec=vand_tool.functions, func=vand_tool.execute_tool_call)
+                        function_specs += vand_tool.functions
+                    else:
+                        # check for locally defined functions
+                        if AITool.find_function_spec(function):
+                            function_specs.append(AITool.find_function_spec(function))
+
+                return sess.gen(
+                    prompt,
+                    client=self.client,
+                    function_name=None,
+                    system=system,
+                    save_messages=save_messages,
+                    params=params,
+                    functions=function_specs,
+                    input_schema=input_schema,
+                    output_schema=output_schema,
+                    n=n,
+                    scorer=scorer,
+                )        
+            else:
+                return sess.gen(
+                    prompt,
+                    client=self.client,
+                    function_name=None,
+                    system=system,
+                    save_messages=save_messages,
+                    params=params,
+                    functions=functions,
+                    input_schema=input_schema,
+                    output_schema=output_schema,
+                    n=n,
+                    scorer=scorer,
+                )
+
+    def best_of(
+        self,
+        prompt: Union[str, Any],
+        n: int = 3,
+        scorer: Callable = mean_logprob,
+        id: Union[str, UUID] = None,
+        params: Dict[str, Any] = None,
+        **kwargs,
+    ) -> Any:
+        """
+        The best of `n` answers sampled in one request: the prompt is sent and
+        billed once.  `scorer(content, choice)` ranks them, higher is better;
+        by default the mean token log probability (requested automatically).
+        The API returns no log probabilities for `output_schema` answers, so
+        there the default keeps the API's order: pass a scorer to rank them.
+        Only the chosen answer is saved to the session.
+        """
+        scorer = self._best_of_scorer(scorer, kwargs)
+        return self(prompt, id=id, params=self._best_of_params(id, params, scorer), n=n, scorer=scorer, **kwargs)[0]
+
+    @staticmethod
+    def _best_of_scorer(scorer, kwargs) -> Optional[Callable]:
+        # mean_logprob would score every structured answer -inf
+        return None if scorer is mean_logprob and kwargs.get("output_schema") else scorer
+
+    def _best_of_params(self, id, params, scorer) -> Optional[Dict[str, Any]]:
+        if scorer is not mean_logprob:
+            return params
+        return {**(params if params is not None else self.get_session(id).params), "logprobs": True}
 
     def stream(
         self,
@@ -184,6 +320,7 @@ class AIChat(BaseModel):
         params: Dict[str, Any] = None,
         functions: List[Any] = None,
         input_schema: Any = None,
+        output_schema: Any = None,
     ) -> str:
         sess = self.get_session(id)
         if functions:
@@ -199,7 +336,7 @@ class AIChat(BaseModel):
             #         if AITool.find_function_spec(function):
             #             function_specs.append(AITool.find_function_spec(function))
             
-            return sess.stream(
+            return self._locked_stream(sess, self._profile_stream(sess, sess.stream(
                 prompt,
                 client=self.client,
                 function_name=None,
@@ -208,11 +345,12 @@ class AIChat(BaseModel):
                 params=params,
                 functions=functions,
                 input_schema=input_schema,
-            )  
+                output_schema=output_schema,
+            )))
 
         else:
 
-            return sess.stream(
+            return self._locked_stream(sess, self._profile_stream(sess, sess.stream(
                 prompt,
                 client=self.client,
                 system=system,
@@ -220,42 +358,55 @@ class AIChat(BaseModel):
                 params=params,
                 functions=functions,
                 input_schema=input_schema,
-            )
+                output_schema=output_schema,
+            )))
 
     def build_system(
         self, character: str = None, character_command: str = None, system: str = None
     ) -> str:
         default = "You are a helpful assistant."
         if character:
-            character_prompt = """
-            You must follow ALL these rules in all responses:
-            - You are the following character and should ALWAYS act as them: {0}
-            - NEVER speak in a formal tone.
-            - Concisely introduce yourself first in character.
-            """
-            prompt = character_prompt.format(wikipedia_search_lookup(character)).strip()
-            if character_command:
-                character_system = """
-                - {0}
-                """
-                prompt = (
-                    prompt + "\n" + character_system.format(character_command).strip()
-                )
-            return prompt
+            cached = self.system_prompts.get((character, character_command))
+            if cached:
+                return cached
+            return self.character_system(character, character_command, character_lookup(character))
         elif system:
             return system
         else:
             return default
 
+    @classmethod
+    def character_system(cls, character: str, character_command: str, description: str) -> str:
+        character_prompt = """
+        You must follow ALL these rules in all responses:
+        - You are the following character and should ALWAYS act as them: {0}
+        - NEVER speak in a formal tone.
+        - Concisely introduce yourself first in character.
+        """
+        prompt = character_prompt.format(description).strip()
+        if character_command:
+            character_system = """
+            - {0}
+            """
+            prompt = (
+                prompt + "\n" + character_system.format(character_command).strip()
+            )
+        cls.system_prompts[(character, character_command)] = prompt
+        return prompt
+
     def interactive_console(self, character: str = None, prime: bool = True) -> None:
+        from rich.console import Console
+
         console = Console(highlight=False, force_jupyter=False)
         sess = self.default_session
         ai_text_color = "bright_magenta"
+        # the console is synchronous, also for AsyncAIChat
+        client = self.client if isinstance(self.client, Client) else shared_client()
 
         # prime with a unique starting response to the user
         if prime:
             console.print(f"[b]{character}[/b]: ", end="", style=ai_text_color)
-            for chunk in sess.stream("Hello!", self.client, functions=['default']):
+            for chunk in sess.stream("Hello!", client, functions=['default']):
                 console.print(chunk["delta"], end="", style=ai_text_color)
 
         while True:
@@ -266,7 +417,7 @@ class AIChat(BaseModel):
                     break
 
                 console.print(f"[b]{character}[/b]: ", end="", style=ai_text_color)
-                for chunk in sess.stream(user_input, self.client, functions=['default']):
+                for chunk in sess.stream(user_input, client, functions=['default']):
                     console.print(chunk["delta"], end="", style=ai_text_color)
             except KeyboardInterrupt:
                 break
@@ -330,6 +481,8 @@ class AIChat(BaseModel):
         ), "Only CSV and JSON imports are accepted."
 
         if input_path.endswith(".csv"):
+            from dateutil import tz
+
             with open(input_path, "r", encoding="utf-8") as f:
                 r = csv.DictReader(f)
                 messages = []
@@ -337,7 +490,7 @@ class AIChat(BaseModel):
                     # need to convert the datetime back to UTC
                     local_datetime = datetime.datetime.strptime(
                         row["received_at"], "%Y-%m-%d %H:%M:%S"
-                    ).replace(tzinfo=dateutil.tz.tzlocal())
+                    ).replace(tzinfo=tz.tzlocal())
                     row["received_at"] = local_datetime.astimezone(
                         datetime.timezone.utc
                     )
@@ -346,7 +499,7 @@ class AIChat(BaseModel):
                     messages.append(ChatMessage(**row))
 
             self.new_session(id=id, **kwargs)
-            self.sessions[id].messages = messages
+            self.sessions[id].messages = MessageHistory(messages)
 
         if input_path.endswith(".json"):
             with open(input_path, "rb") as f:
@@ -360,6 +513,8 @@ class AIChat(BaseModel):
         self,
         id: Union[str, UUID] = None,
     ):
+        from termcolor import colored
+
         role_to_color = {
             "system": "red",
             "user": "green",
@@ -391,31 +546,96 @@ class AIChat(BaseModel):
             elif message["role"] == "function":
                 print(colored(f"function ({message['name']}): {message['content']}\n", role_to_color[message["role"]]))
     
+    def save_snapshot(self, path: str, include_messages: bool = False) -> None:
+        """Write tools, toolpacks, system prompts and sessions to one file (see aiapi.snapshot)."""
+        from .snapshot import save_snapshot
+
+        save_snapshot(path, self, include_messages=include_messages)
+
+    def restore_snapshot(self, path: str, **kwargs) -> None:
+        """Restore a snapshot into this AIChat; `kwargs` (e.g. api_key) apply to every session."""
+        from .snapshot import load_snapshot
+
+        load_snapshot(path, self, **kwargs)
+
+    @classmethod
+    def from_snapshot(cls, path: str, **kwargs) -> "AIChat":
+        ai = cls(default_session=False, console=False)
+        ai.restore_snapshot(path, **kwargs)
+        return ai
+
     # Tabulators for returning total token counts
     def message_totals(self, attr: str, id: Union[str, UUID] = None) -> int:
         sess = self.get_session(id)
         return getattr(sess, attr)
 
+    # totals for the default session; use message_totals(attr, id) for others
     @property
-    def total_prompt_length(self, id: Union[str, UUID] = None) -> int:
-        return self.message_totals("total_prompt_length", id)
+    def total_prompt_length(self) -> int:
+        return self.message_totals("total_prompt_length")
 
     @property
-    def total_completion_length(self, id: Union[str, UUID] = None) -> int:
-        return self.message_totals("total_completion_length", id)
+    def total_completion_length(self) -> int:
+        return self.message_totals("total_completion_length")
 
     @property
-    def total_length(self, id: Union[str, UUID] = None) -> int:
-        return self.message_totals("total_length", id)
+    def total_length(self) -> int:
+        return self.message_totals("total_length")
 
     # alias total_tokens to total_length for common use
     @property
-    def total_tokens(self, id: Union[str, UUID] = None) -> int:
-        return self.total_length(id)
+    def total_tokens(self) -> int:
+        return self.total_length
 
     
 
 class AsyncAIChat(AIChat):
+    lock_type: ClassVar[Any] = AsyncRLock
+
+    @asynccontextmanager
+    async def _turn(self, sess: ChatSession, label: str):
+        with self._admit():
+            async with self._lock_for(sess):
+                with self._profile(sess, label):
+                    yield
+
+    async def _locked_stream(self, sess: ChatSession, stream):
+        with self._admit():
+            async with self._lock_for(sess):
+                async for chunk in stream:
+                    yield chunk
+
+    @classmethod
+    async def create(
+        cls,
+        character: str = None,
+        character_command: str = None,
+        **kwargs,
+    ) -> "AsyncAIChat":
+        """Construct without blocking the event loop on the character lookup."""
+        load_env()
+        # the loop's shared pool serves both the lookup and the session's requests
+        client = shared_async_client()
+        if character and (character, character_command) not in cls.system_prompts:
+            description = await character_lookup_async(character, client=client)
+            cls.character_system(character, character_command, description)
+        kwargs.setdefault("console", False)
+        ai = cls(character, character_command, **kwargs)
+        ai.client = client
+        return ai
+
+    @classmethod
+    def _default_client(cls) -> None:
+        # no sync client; the event loop's shared pool is picked up on the first request
+        return None
+
+    def _async_client(self) -> AsyncClient:
+        if not isinstance(self.client, AsyncClient) or self.client.is_closed:
+            if isinstance(self.client, Client):
+                self.client.close()
+            self.client = shared_async_client()
+        return self.client
+
     async def __call__(
         self,
         prompt: str,
@@ -427,48 +647,69 @@ class AsyncAIChat(AIChat):
         tools: List[Any] = None,
         input_schema: Any = None,
         output_schema: Any = None,
+        speculative: bool = False,
+        n: int = None,
+        scorer: Callable = None,
     ) -> str:
-        # TODO: move to a __post_init__ in Pydantic 2.0
-        if isinstance(self.client, Client):
-            self.client = AsyncClient(proxies=os.getenv("https_proxy"))
+        self._async_client()
         sess = self.get_session(id)
-        if tools:
-            for tool in tools:
-                assert tool.__doc__, f"Tool {tool} does not have a docstring."
-            assert len(tools) <= 9, "You can only have a maximum of 9 tools."
-            return await sess.gen_with_tools_async(
-                prompt,
-                tools,
-                client=self.client,
-                system=system,
-                save_messages=save_messages,
-                params=params,
-            )
-        elif functions:
-            vand_id = functions[0]
-            vand_tool = VandBasicAPITool.get_toolpack(vand_id)
-            functions = vand_tool.functions
-            return sess.gen(
-                prompt,
-                client=self.client,
-                function_name=None,
-                system=system,
-                save_messages=save_messages,
-                params=params,
-                functions=functions,
-                input_schema=input_schema,
-                output_schema=output_schema,
-            )    
-        else:
-            return await sess.gen_async(
-                prompt,
-                client=self.client,
-                system=system,
-                save_messages=save_messages,
-                params=params,
-                input_schema=input_schema,
-                output_schema=output_schema,
-            )
+        async with self._turn(sess, "call"):
+            if tools:
+                for tool in tools:
+                    assert tool.__doc__, f"Tool {tool} does not have a docstring."
+                assert len(tools) <= 9, "You can only have a maximum of 9 tools."
+                assert n is None, "n is not supported with tools."
+                return await sess.gen_with_tools_async(
+                    prompt,
+                    tools,
+                    client=self.client,
+                    system=system,
+                    save_messages=save_messages,
+                    params=params,
+                    speculative=speculative,
+                )
+            elif functions:
+                vand_id = functions[0]
+                vand_tool = VandBasicAPITool.get_toolpack(vand_id)
+                functions = vand_tool.functions
+                return sess.gen(
+                    prompt,
+                    client=self.client,
+                    function_name=None,
+                    system=system,
+                    save_messages=save_messages,
+                    params=params,
+                    functions=functions,
+                    input_schema=input_schema,
+                    output_schema=output_schema,
+                    n=n,
+                    scorer=scorer,
+                )    
+            else:
+                return await sess.gen_async(
+                    prompt,
+                    client=self.client,
+                    system=system,
+                    save_messages=save_messages,
+                    params=params,
+                    input_schema=input_schema,
+                    output_schema=output_schema,
+                    n=n,
+                    scorer=scorer,
+                )
+
+    async def best_of(
+        self,
+        prompt: Union[str, Any],
+        n: int = 3,
+        scorer: Callable = mean_logprob,
+        id: Union[str, UUID] = None,
+        params: Dict[str, Any] = None,
+        **kwargs,
+    ) -> Any:
+        scorer = self._best_of_scorer(scorer, kwargs)
+        params = self._best_of_params(id, params, scorer)
+        return (await self(prompt, id=id, params=params, n=n, scorer=scorer, **kwargs))[0]
 
     async def stream(
         self,
@@ -478,19 +719,19 @@ class AsyncAIChat(AIChat):
         save_messages: bool = None,
         params: Dict[str, Any] = None,
         input_schema: Any = None,
+        output_schema: Any = None,
     ) -> str:
-        # TODO: move to a __post_init__ in Pydantic 2.0
-        if isinstance(self.client, Client):
-            self.client = AsyncClient(proxies=os.getenv("https_proxy"))
+        self._async_client()
         sess = self.get_session(id)
-        return sess.stream_async(
+        return self._locked_stream(sess, self._profile_stream(sess, sess.stream_async(
             prompt,
             client=self.client,
             system=system,
             save_messages=save_messages,
             params=params,
             input_schema=input_schema,
-        )
+            output_schema=output_schema,
+        )))
 
     @asynccontextmanager
     async def session(self, **kwargs):
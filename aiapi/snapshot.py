@@ -0,0 +1,131 @@
+'''
+Warm-start snapshots: everything a worker would otherwise rebuild over the
+network, in one compact binary file.
+
+    ai.save_snapshot("aiapi.snap")                      # once, e.g. at build time
+    ai = AIChat.from_snapshot("aiapi.snap", api_key=...)  # in each worker, no network calls
+
+A snapshot holds the registered AITool specs (and where to find their
+functions), the VandBasicAPITool toolpacks, cached character system prompts,
+tool cache settings and session metadata (optionally with messages).  API
+keys are never written.  Functions are stored as "module:qualname"
+references and imported again on load, so only load snapshots you trust;
+tools whose function can't be referenced (lambdas, closures) are skipped.
+'''
+import importlib
+import zlib
+from typing import Any, Dict, Optional
+
+import orjson
+
+from .models import AITool
+from .vand_utils import VandBasicAPITool
+
+SNAPSHOT_MAGIC = b"AIAPISNAP"
+SNAPSHOT_VERSION = 1
+
+# secrets; live objects (hooks, key_pool, ...) are excluded by their field definitions
+SESSION_EXCLUDE = {"auth"}
+
+
+def _func_ref(func: Any) -> Optional[Dict[str, str]]:
+    owner = getattr(func, "__self__", None)
+    if isinstance(owner, VandBasicAPITool):
+        return {"toolpack": owner.content_hash}
+    module = getattr(func, "__module__", None)
+    qualname = getattr(func, "__qualname__", "")
+    if not module or "<" in qualname:
+        return None
+    return {"ref": f"{module}:{qualname}"}
+
+
+def _resolve(ref: Dict[str, str]) -> Any:
+    if "toolpack" in ref:
+        toolpack = VandBasicAPITool.instances.get(ref["toolpack"])
+        return toolpack.execute_tool_call if toolpack else None
+    module, _, qualname = ref["ref"].partition(":")
+    obj = importlib.import_module(module)
+    for attr in qualname.split("."):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def dump_snapshot(ai: Any = None, include_messages: bool = False) -> bytes:
+    """Serialize the tool registries, cached prompts and `ai`'s sessions."""
+    from .simpleaichat import AIChat
+
+    payload = {
+        "toolpacks": [
+            {
+                "description": t.description,
+                "servers": t.servers,
+                "endpoints": t.endpoints,
+                "functions": t.functions,
+            }
+            for t in VandBasicAPITool.instances.values()
+        ],
+        "toolpack_ids": VandBasicAPITool.toolpack_ids,
+        "tools": [
+            {"spec": tool.spec, "func": ref}
+            for tool in AITool.instances.values()
+            if (ref := _func_ref(tool.func)) is not None
+        ],
+        "caches": {name: {"ttl": c.ttl, "max_entries": c.max_entries} for name, c in AITool.caches.items()},
+        "system_prompts": [[character, command, prompt] for (character, command), prompt in AIChat.system_prompts.items()],
+        "sessions": [],
+        "default_session": None,
+    }
+    if ai is not None:
+        exclude = SESSION_EXCLUDE if include_messages else SESSION_EXCLUDE | {"messages"}
+        payload["sessions"] = [sess.model_dump(exclude=exclude, mode="json") for sess in ai.sessions.values()]
+        if ai.default_session:
+            payload["default_session"] = str(ai.default_session.id)
+    body = zlib.compress(orjson.dumps(payload))
+    return SNAPSHOT_MAGIC + bytes([SNAPSHOT_VERSION]) + body
+
+
+def restore_snapshot(data: bytes, ai: Any = None, **kwargs) -> Dict[str, Any]:
+    """Load a snapshot made by `dump_snapshot`; sessions are added to `ai` with `kwargs`."""
+    from .simpleaichat import AIChat
+
+    if not data.startswith(SNAPSHOT_MAGIC):
+        raise ValueError("Not an aiapi snapshot.")
+    version = data[len(SNAPSHOT_MAGIC)]
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {version}.")
+    payload = orjson.loads(zlib.decompress(data[len(SNAPSHOT_MAGIC) + 1 :]))
+
+    for toolpack in payload["toolpacks"]:
+        VandBasicAPITool.from_dict(toolpack)
+    VandBasicAPITool.toolpack_ids.update(
+        {k: v for k, v in payload["toolpack_ids"].items() if v in VandBasicAPITool.instances}
+    )
+    for name, cache in payload["caches"].items():
+        AITool.configure_cache({"name": name}, cache["ttl"], cache["max_entries"])
+    for tool in payload["tools"]:
+        try:
+            func = _resolve(tool["func"])
+        except (ImportError, AttributeError):
+            func = None
+        if func is not None:
+            AITool._register(tool["spec"], func)
+    for character, command, prompt in payload["system_prompts"]:
+        AIChat.system_prompts[(character, command)] = prompt
+
+    if ai is not None:
+        for meta in payload["sessions"]:
+            sess = ai.new_session(return_session=True, **{**meta, **kwargs})
+            ai.sessions[sess.id] = sess
+            if str(sess.id) == payload["default_session"]:
+                ai.default_session = sess
+    return payload
+
+
+def save_snapshot(path: str, ai: Any = None, include_messages: bool = False) -> None:
+    with open(path, "wb") as f:
+        f.write(dump_snapshot(ai, include_messages))
+
+
+def load_snapshot(path: str, ai: Any = None, **kwargs) -> Dict[str, Any]:
+    with open(path, "rb") as f:
+        return restore_snapshot(f.read(), ai, **kwargs)
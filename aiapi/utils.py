@@ -1,14 +1,53 @@
+import asyncio
 import os
+import weakref
 import httpx
-from typing import List, Union
+import orjson
+from typing import Any, List, Optional, Union
 from pydantic import Field
 
+from .cache import PersistentTTLCache
+from .partial_json import PartialJSONParser
+
 WIKIPEDIA_API_URL = "https://en.wikipedia.org/w/api.php"
 
+_env_loaded = False
 
-def wikipedia_search(query: str, n: int = 1) -> Union[str, List[str]]:
-    """Search Wikipedia."""
-    SEARCH_PARAMS = {
+
+def load_env() -> None:
+    """Load a .env file once, on first use rather than at import."""
+    global _env_loaded
+    if _env_loaded:
+        return
+    _env_loaded = True
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+
+_client: Optional[httpx.Client] = None
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def shared_client() -> httpx.Client:
+    """Pooled client for the helpers below, created on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.Client(proxies=os.getenv("https_proxy"))
+    return _client
+
+
+def shared_async_client() -> httpx.AsyncClient:
+    """Pooled async client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = _async_clients[loop] = httpx.AsyncClient(proxies=os.getenv("https_proxy"))
+    return client
+
+
+def _search_params(query: str, n: int) -> dict:
+    return {
         "action": "query",
         "list": "search",
         "format": "json",
@@ -18,71 +57,219 @@ def wikipedia_search(query: str, n: int = 1) -> Union[str, List[str]]:
         "srprop": "",
     }
 
-    r_search = httpx.get(WIKIPEDIA_API_URL, params=SEARCH_PARAMS)
-    results = [x["title"] for x in r_search.json()["query"]["search"]]
 
-    return results[0] if n == 1 else results
+def _lookup_params(query: str, sentences: int) -> dict:
+    return {
+        "action": "query",
+        "prop": "extracts",
+        "exsentences": sentences,
+        "exlimit": "1",
+        "explaintext": "1",
+        "formatversion": "2",
+        "format": "json",
+        "titles": query,
+    }
 
 
-def wikipedia_lookup(query: str, sentences: int = 1) -> str:
-    LOOKUP_PARAMS = {
+def _search_lookup_params(query: str, sentences: int) -> dict:
+    # search and extract in one request: the search results feed prop=extracts
+    return {
         "action": "query",
+        "generator": "search",
+        "gsrsearch": query,
+        "gsrlimit": 1,
+        "gsrwhat": "text",
         "prop": "extracts",
         "exsentences": sentences,
         "exlimit": "1",
         "explaintext": "1",
         "formatversion": "2",
         "format": "json",
-        "titles": query,
     }
 
-    r_lookup = httpx.get(WIKIPEDIA_API_URL, params=LOOKUP_PARAMS)
+
+def _search_results(r: dict, n: int) -> Union[str, List[str]]:
+    results = [x["title"] for x in r["query"]["search"]]
+    return results[0] if n == 1 else results
+
+
+def _top_extract(r: dict) -> str:
+    pages = sorted(r["query"]["pages"], key=lambda p: p.get("index", 0))
+    return pages[0]["extract"]
+
+
+def wikipedia_search(query: str, n: int = 1, client: httpx.Client = None) -> Union[str, List[str]]:
+    """Search Wikipedia."""
+    r_search = (client or shared_client()).get(WIKIPEDIA_API_URL, params=_search_params(query, n))
+    return _search_results(r_search.json(), n)
+
+
+def wikipedia_lookup(query: str, sentences: int = 1, client: httpx.Client = None) -> str:
+    r_lookup = (client or shared_client()).get(WIKIPEDIA_API_URL, params=_lookup_params(query, sentences))
     return r_lookup.json()["query"]["pages"][0]["extract"]
 
 
-def wikipedia_search_lookup(query: str, sentences: int = 1) -> str:
-    return wikipedia_lookup(wikipedia_search(query, 1), sentences)
+def wikipedia_search_lookup(query: str, sentences: int = 1, client: httpx.Client = None) -> str:
+    r = (client or shared_client()).get(WIKIPEDIA_API_URL, params=_search_lookup_params(query, sentences))
+    return _top_extract(r.json())
 
 
-async def wikipedia_search_async(query: str, n: int = 1) -> Union[str, List[str]]:
-    SEARCH_PARAMS = {
-        "action": "query",
-        "list": "search",
-        "format": "json",
-        "srlimit": n,
-        "srsearch": query,
-        "srwhat": "text",
-        "srprop": "",
-    }
+async def wikipedia_search_async(query: str, n: int = 1, client: httpx.AsyncClient = None) -> Union[str, List[str]]:
+    r_search = await (client or shared_async_client()).get(WIKIPEDIA_API_URL, params=_search_params(query, n))
+    return _search_results(r_search.json(), n)
 
-    async with httpx.AsyncClient(proxies=os.getenv("https_proxy")) as client:
-        r_search = await client.get(WIKIPEDIA_API_URL, params=SEARCH_PARAMS)
-    results = [x["title"] for x in r_search.json()["query"]["search"]]
 
-    return results[0] if n == 1 else results
+async def wikipedia_lookup_async(query: str, sentences: int = 1, client: httpx.AsyncClient = None) -> str:
+    r_lookup = await (client or shared_async_client()).get(WIKIPEDIA_API_URL, params=_lookup_params(query, sentences))
+    return r_lookup.json()["query"]["pages"][0]["extract"]
 
 
-async def wikipedia_lookup_async(query: str, sentences: int = 1) -> str:
-    LOOKUP_PARAMS = {
-        "action": "query",
-        "prop": "extracts",
-        "exsentences": sentences,
-        "exlimit": "1",
-        "explaintext": "1",
-        "formatversion": "2",
-        "format": "json",
-        "titles": query,
+async def wikipedia_search_lookup_async(query: str, sentences: int = 1, client: httpx.AsyncClient = None) -> str:
+    r = await (client or shared_async_client()).get(WIKIPEDIA_API_URL, params=_search_lookup_params(query, sentences))
+    return _top_extract(r.json())
+
+
+CHARACTER_CACHE_TTL = 7 * 24 * 3600
+_character_cache: Optional[PersistentTTLCache] = None
+
+
+def character_cache() -> PersistentTTLCache:
+    """
+    Cache of character descriptions, in memory and on disk.
+
+    Stored under $AIAPI_CACHE_DIR (default ~/.cache/aiapi); set it to an
+    empty string to keep the cache in memory only.
+    """
+    global _character_cache
+    if _character_cache is None:
+        base = os.getenv("AIAPI_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "aiapi"))
+        directory = os.path.join(base, "characters") if base else None
+        _character_cache = PersistentTTLCache(directory, ttl=CHARACTER_CACHE_TTL, max_entries=1024)
+    return _character_cache
+
+
+def character_lookup(character: str, sentences: int = 1, client: httpx.Client = None) -> str:
+    """Wikipedia description of a character, cached by name and sentence count."""
+    key = (character, sentences)
+    cache = character_cache()
+    description = cache.get(key)
+    if description is None:
+        description = wikipedia_search_lookup(character, sentences, client)
+        cache.set(key, description)
+    return description
+
+
+async def character_lookup_async(character: str, sentences: int = 1, client: httpx.AsyncClient = None) -> str:
+    key = (character, sentences)
+    cache = character_cache()
+    description = cache.get(key)
+    if description is None:
+        description = await wikipedia_search_lookup_async(character, sentences, client)
+        cache.set(key, description)
+    return description
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast local token estimate (~4 characters per token for English text)."""
+    return (len(text) + 3) // 4
+
+
+def estimate_usage(data: dict, completion: str) -> dict:
+    """Estimated usage for a chat request, for when the API does not report it."""
+    # each message costs a few tokens of framing on top of its content
+    prompt_tokens = sum(4 + estimate_tokens(str(m.get("content") or "")) for m in data.get("messages", []))
+    if data.get("functions"):
+        prompt_tokens += estimate_tokens(orjson.dumps(data["functions"]).decode())
+    completion_tokens = estimate_tokens(completion)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
     }
 
-    async with httpx.AsyncClient(proxies=os.getenv("https_proxy")) as client:
-        r_lookup = await client.get(WIKIPEDIA_API_URL, params=LOOKUP_PARAMS)
-    return r_lookup.json()["query"]["pages"][0]["extract"]
 
+def mean_logprob(content: Any, choice: dict) -> float:
+    """Scorer for best_of: the mean token log probability of a choice.
+
+    Needs `logprobs: true` in the request params; choices without them score lowest.
+    """
+    tokens = (choice.get("logprobs") or {}).get("content") or []
+    if not tokens:
+        return float("-inf")
+    return sum(t["logprob"] for t in tokens) / len(tokens)
+
+
+def _shrink(value: Any, shrink_dicts: bool) -> Any:
+    if isinstance(value, list):
+        value = value[: (len(value) + 1) // 2] if len(value) > 1 else value
+        return [_shrink(v, shrink_dicts) for v in value]
+    if isinstance(value, dict):
+        items = list(value.items())
+        if shrink_dicts and len(items) > 1:
+            items = items[: (len(items) + 1) // 2]
+        return {k: _shrink(v, shrink_dicts) for k, v in items}
+    if isinstance(value, str) and len(value) > 64:
+        return value[: len(value) // 2] + "..."
+    return value
+
+
+def _fallback_json(value: Any, max_chars: int) -> str:
+    if isinstance(value, str):
+        value = value[: max(0, max_chars - 2)]
+        while len(orjson.dumps(value)) > max_chars and value:
+            value = value[: len(value) // 2]
+        return orjson.dumps(value).decode()
+    return "[]" if isinstance(value, list) else "{}" if isinstance(value, dict) else "null"
+
+
+def shrink_json(value: Any, max_chars: int) -> str:
+    """
+    Serialize `value` within `max_chars`, halving lists and long strings (then
+    objects) until it fits, so the result is always valid JSON.  If nothing is
+    left to halve (e.g. deeply nested single items), a string is cut to fit and
+    anything else becomes an empty object or array (or null).
+    """
+    text = orjson.dumps(value).decode()
+    shrink_dicts = False
+    while len(text) > max_chars:
+        smaller = _shrink(value, shrink_dicts)
+        if smaller == value:
+            if shrink_dicts:
+                return _fallback_json(value, max_chars)
+            shrink_dicts = True
+            continue
+        value = smaller
+        text = orjson.dumps(value).decode()
+    return text
 
-async def wikipedia_search_lookup_async(query: str, sentences: int = 1) -> str:
-    return await wikipedia_lookup_async(
-        await wikipedia_search_async(query, 1), sentences
-    )
+
+def truncate_response(text: str, max_tokens: int = None, incomplete: bool = False) -> tuple:
+    """
+    Fit a tool response into `max_tokens` (estimated).
+
+    JSON responses stay valid JSON: a body cut short while reading
+    (`incomplete`) is closed at the last complete value, then shrunk to fit.
+    Returns the text and whether anything was dropped.
+    """
+    max_chars = max_tokens * 4 if max_tokens else None
+    stripped = text.lstrip()
+    if stripped[:1] in ("{", "["):
+        if incomplete:
+            value = PartialJSONParser().feed(stripped)
+        else:
+            try:
+                value = orjson.loads(stripped)
+            except orjson.JSONDecodeError:
+                value = None
+        if value is not None:
+            if not incomplete and (max_chars is None or len(stripped) <= max_chars):
+                return text, False
+            if max_chars:
+                return shrink_json(value, max_chars), True
+            return orjson.dumps(value).decode(), True
+    if max_chars is not None and len(text) > max_chars:
+        return text[:max_chars], True
+    return text, incomplete
 
 
 def fd(description: str, **kwargs):
@@ -97,3 +284,40 @@ def remove_a_key(d, remove_key):
                 del d[key]
             else:
                 remove_a_key(d[key], remove_key)
+
+
+class AsyncRLock:
+    """asyncio.Lock that the task holding it can acquire again."""
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._owner = None
+        self._depth = 0
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    async def acquire(self) -> bool:
+        task = asyncio.current_task()
+        if self._owner is task:
+            self._depth += 1
+            return True
+        await self._lock.acquire()
+        self._owner = task
+        self._depth = 1
+        return True
+
+    def release(self) -> None:
+        if not self._depth:
+            raise RuntimeError("Lock is not acquired.")
+        self._depth -= 1
+        if not self._depth:
+            self._owner = None
+            self._lock.release()
+
+    async def __aenter__(self) -> "AsyncRLock":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.release()
@@ -1,11 +1,22 @@
 '''
 Utility to make it easy to use use OpenAI function calls
 '''
+import os
+import hashlib
 import orjson
-import requests
-from typing import List, Optional, Tuple, Union, Self
+import tempfile
+from typing import ClassVar, Dict, List, Optional, Tuple, Union, Self
+from collections import OrderedDict
 from dataclasses import dataclass, field
 
+from .utils import truncate_response
+from .cache import FailedResult
+from .circuit import CircuitBreaker, CircuitOpenError
+
+# Vand's discovery functions return toolpacks that must be read in full
+VAND_META_FUNCTIONS = ("getToolPack", "getLucky", "findToolPacks")
+# names of spilled responses start with this, so pruning never touches other files
+SPILL_PREFIX = "aiapi-spill-"
 
 
 @dataclass
@@ -24,10 +35,131 @@ class VandBasicAPITool:
     endpoints: List[Tuple[str, str, str, dict]] 
     functions: List[dict] = field(default_factory=list)
 
-    instances = []
+    # toolpacks by content hash, least recently used first; identical toolpacks share one instance
+    instances: ClassVar["OrderedDict[str, VandBasicAPITool]"] = OrderedDict()
+    max_instances = 64
+    # content hash of each toolpack fetched by id
+    toolpack_ids: ClassVar[Dict[str, str]] = {}
+
+    # Vand API; overridable to point at a local stand-in (see aiapi.mock_server)
+    base_url = os.getenv("VAND_API_URL", "https://api.vand.io/api/v1")
+
+    # limits on tool responses passed back to the model; None disables a limit
+    max_response_bytes = 256 * 1024
+    max_response_tokens = 4000
+    # directory to save the full body of truncated responses to, if any; only the newest spill_max_files are kept
+    spill_dir = None
+    spill_max_files = 100
+    # seconds to wait on a tool server; each server also has a circuit breaker
+    request_timeout = 30.0
 
     def __post_init__(self):
-        self.instances.append(self)
+        self.content_hash = self.hash_content(self.description, self.servers, self.endpoints, self.functions)
+        self.register(self)
+
+    @staticmethod
+    def hash_content(description, servers, endpoints, functions) -> str:
+        payload = orjson.dumps([description, servers, endpoints, functions], option=orjson.OPT_SORT_KEYS)
+        return hashlib.sha256(payload).hexdigest()
+
+    @classmethod
+    def register(cls, instance: Self) -> Self:
+        """Keep `instance` unless an identical toolpack is already registered, and return the kept one."""
+        existing = cls.instances.get(instance.content_hash)
+        if existing is not None:
+            cls.instances.move_to_end(instance.content_hash)
+            return existing
+        cls.instances[instance.content_hash] = instance
+        while len(cls.instances) > cls.max_instances:
+            evicted_hash, evicted = cls.instances.popitem(last=False)
+            cls.toolpack_ids = {k: v for k, v in cls.toolpack_ids.items() if v != evicted_hash}
+            evicted._unregister_tools()
+        return instance
+
+    def _unregister_tools(self) -> None:
+        """Remove this toolpack's functions from AITool, which would otherwise keep it alive."""
+        from .models import AITool
+
+        for spec in self.functions:
+            tool = AITool.instances.get(spec['name'])
+            if tool is not None and getattr(tool.func, '__self__', None) is self:
+                AITool.instances.pop(spec['name'], None)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> Self:
+        """The registered toolpack for `data`, without building a new instance if it is known."""
+        fields = (data.get("description"), data.get("servers"), data.get("endpoints"), data.get("functions", []))
+        existing = cls.instances.get(cls.hash_content(*fields))
+        if existing is not None:
+            return existing
+        instance = cls(**data)  # registered by __post_init__
+        return cls.instances.get(instance.content_hash, instance)
+
+    @classmethod
+    def read_response(cls, api_response, functionName: str) -> str:
+        '''
+        Read a streamed tool response within max_response_bytes and max_response_tokens.
+
+        When the body is over the limits it is truncated (JSON stays valid) and,
+        if spill_dir is set, the full body is written there and referenced in
+        the returned message.
+        '''
+        meta = functionName in VAND_META_FUNCTIONS
+        max_bytes = None if meta else cls.max_response_bytes
+        spill = None
+        if cls.spill_dir and not meta:
+            spill = tempfile.NamedTemporaryFile(
+                dir=cls.spill_dir, prefix=f"{SPILL_PREFIX}{functionName}-", suffix=".txt", delete=False
+            )
+        body = bytearray()
+        incomplete = False
+        read = False
+        try:
+            for chunk in api_response.iter_content(chunk_size=64 * 1024):
+                if spill:
+                    spill.write(chunk)
+                if max_bytes is not None and len(body) + len(chunk) > max_bytes:
+                    body += chunk[: max_bytes - len(body)]
+                    incomplete = True
+                    if not spill:
+                        break
+                elif not incomplete:
+                    body += chunk
+            read = True
+        finally:
+            api_response.close()
+            if spill:
+                spill.close()
+                if not read:
+                    os.remove(spill.name)
+
+        text = body.decode(api_response.encoding or "utf-8", errors="ignore")
+        if meta:
+            return text
+        text, truncated = truncate_response(text, cls.max_response_tokens, incomplete)
+        if truncated:
+            if spill:
+                text += f"\n[Response truncated. The full response was saved to {spill.name}]"
+                cls._prune_spills()
+            else:
+                text += "\n[Response truncated.]"
+        elif spill:
+            os.remove(spill.name)
+        return text
+
+    @classmethod
+    def _prune_spills(cls) -> None:
+        """Delete all but the newest spill_max_files spilled responses."""
+        try:
+            entries = [e for e in os.scandir(cls.spill_dir) if e.name.startswith(SPILL_PREFIX)]
+        except OSError:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+        for entry in entries[cls.spill_max_files :]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
 
     def _find_endpoint(self, operation_id: str) -> Optional[Tuple[str, str, str, dict]]:
         for endpoint in self.endpoints:
@@ -51,20 +183,25 @@ class VandBasicAPITool:
 
     @classmethod
     def _find_function(cls, functionName: str) -> Self:
-        for instance in cls.instances:
+        for instance in cls.instances.values():
             for function in instance.functions:
                 if function['name'] == functionName:
                     return instance
         return None
 
     @classmethod
-    def get_toolpack(cls, toolpack_id: str) -> Self:
-        """Instantiate VandBasicAPITool from an ID."""
+    def get_toolpack(cls, toolpack_id: str, refresh: bool = False) -> Self:
+        """Instantiate VandBasicAPITool from an ID; fetched once unless `refresh` is set."""
+        if not refresh:
+            content_hash = cls.toolpack_ids.get(toolpack_id)
+            if content_hash in cls.instances:
+                return cls.instances[content_hash]
         #TODO: Catch when a bad ID is passed
-        base_url = "https://api.vand.io/api/v1"
-        url = f"{base_url}/getToolPack/{toolpack_id}"
+        import requests  # deferred; it is slow to import
+
+        url = f"{cls.base_url}/getToolPack/{toolpack_id}"
         try:
-            response = requests.get(url).json()
+            response = requests.get(url, timeout=cls.request_timeout).json()
         except (orjson.JSONDecodeError, requests.RequestException) as e:
             raise e  # Reraise the exception if there's an error
 
@@ -72,7 +209,34 @@ class VandBasicAPITool:
             print(f"No tool found for {toolpack_id}")
             return None
 
-        return cls(**response)
+        instance = cls.from_dict(response)
+        cls.toolpack_ids[toolpack_id] = instance.content_hash
+        return instance
+
+    @classmethod
+    def _request(cls, method: str, base_url: str, path: str, functionName: str, **kwargs):
+        """
+        requests.request through the server's circuit breaker (see aiapi.circuit).
+
+        The body is read inside the breaker, so slow bodies and read errors count
+        against the server.  Returns the response and its text (see read_response).
+        """
+        import requests
+
+        with CircuitBreaker.get(base_url).guard() as call:
+            api_response = requests.request(method, base_url + path, timeout=cls.request_timeout, stream=True, **kwargs)
+            response_text = cls.read_response(api_response, functionName)
+            call.status(api_response.status_code)
+        return api_response, response_text
+
+    @staticmethod
+    def unavailable(functionName: str, e: Exception) -> str:
+        # a circuit that is open, or a request that failed or timed out
+        retry = f" (retry in {e.retry_after:.0f}s)" if isinstance(e, CircuitOpenError) else ""
+        return FailedResult(
+            f"The {functionName} tool is temporarily unavailable{retry}. "
+            + "Answer without it or try again later."
+        )
 
     @classmethod
     def execute_function_call(cls, message):
@@ -101,7 +265,7 @@ class VandBasicAPITool:
             params = endpoint[3].get('parameters', [])
             props = endpoint[3].get('requestBody', {}).get('content', {}).get('application/json', {}).get('schema', {}).get('properties', {})
         else:
-            result_message = f"No endpoint found for the function {functionName}."
+            result_message = FailedResult(f"No endpoint found for the function {functionName}.")
             return result_message, functions
 
         # Replace path parameters in the path
@@ -116,35 +280,40 @@ class VandBasicAPITool:
         else:
             body_params = {param: args[param] for param in props if param in args}
         
+        import requests
+
         headers = {}
-        api_response = requests.request(method, base_url + path, headers=headers, params=query_params, json=body_params)
+        try:
+            api_response, response_text = cls._request(
+                method, base_url, path, functionName, headers=headers, params=query_params, json=body_params
+            )
+        except (CircuitOpenError, requests.RequestException) as e:
+            return cls.unavailable(functionName, e), functions
             
         if api_response.status_code != 200:
-            result_message = (
+            result_message = FailedResult(
                 f"{api_response.status_code}: {api_response.reason}"
                 + f"\nFor {functionName} "
                 + f"Called with params: {query_params}"
             )
         else:
-            try:
-                result_message = api_response.text
-            except Exception: 
-                result_message = api_response.text
+            result_message = response_text
 
         # if the function call was to vand.io it includes new functions; need to add them to our toolPack instances.
         if 'vand.io' in api_response.url.lower():    
             if functionName in ["getToolPack" , "getLucky"]: #looking for default tools
-                result_json = api_response.json()
+                result_json = orjson.loads(response_text)
                 result_message = result_json.pop('message', "Consider the tools/functions available and choose the best one to use.")
                 functions = result_json.get('functions', [])
                 if functions: 
-                    instance =  cls(**result_json)
+                    cls.from_dict(result_json)
             if functionName in ["findToolPacks"]:
-                result_message = f"Here is a list of tools you can select from.  You should choose the best tool from these options (not just the first one) and call the getToolPack function with the id. {response.json()}"
+                result_message = f"Here is a list of tools you can select from.  You should choose the best tool from these options (not just the first one) and call the getToolPack function with the id. {response_text}"
         if not functions:
             # if default tool has been loaded return it as available tool; otherwise tool was called directly and default tool not being used.
-            if cls._find_function("getLucky"):
-                functions = cls._find_function("getLucky").functions
+            lucky = cls._find_function("getLucky")
+            if lucky:
+                functions = lucky.functions
         return result_message, functions
 
     def execute_tool_call(self, functionName, **args):
@@ -161,7 +330,7 @@ class VandBasicAPITool:
             params = endpoint[3].get('parameters', [])
             props = endpoint[3].get('requestBody', {}).get('content', {}).get('application/json', {}).get('schema', {}).get('properties', {})
         else:
-            result_message = f"No endpoint found for the function {functionName}."
+            result_message = FailedResult(f"No endpoint found for the function {functionName}.")
             return result_message, functions
 
         # Replace path parameters in the path
@@ -176,34 +345,39 @@ class VandBasicAPITool:
         else:
             body_params = {param: args[param] for param in props if param in args}
         
+        import requests
+
         headers = {}
-        api_response = requests.request(method, base_url + path, headers=headers, params=query_params, json=body_params)
+        try:
+            api_response, response_text = self._request(
+                method, base_url, path, functionName, headers=headers, params=query_params, json=body_params
+            )
+        except (CircuitOpenError, requests.RequestException) as e:
+            return self.unavailable(functionName, e), functions
             
         if api_response.status_code != 200:
-            result_message = (
+            result_message = FailedResult(
                 f"{api_response.status_code}: {api_response.reason}"
                 + f"\nFor {functionName} "
                 + f"Called with params: {query_params}"
             )
         else:
-            try:
-                result_message = api_response.text
-            except Exception: 
-                result_message = api_response.text
+            result_message = response_text
 
         # if the function call was to vand.io it may include new tools; need to add them to our toolPack instances.
         if 'vand.io' in api_response.url.lower():    
             if functionName in ["getToolPack" , "getLucky"]: #looking for default tools
-                result_json = api_response.json()
+                result_json = orjson.loads(response_text)
                 result_message = result_json.pop('message', "Consider the tools/functions available and choose the best one to use.")
                 functions = result_json.get('functions', [])
                 if functions: 
-                    instance =  self.__class__(**result_json)
+                    self.__class__.from_dict(result_json)
             if functionName in ["findToolPacks"]:
-                result_message = f"Here is a list of tools you can select from.  You should choose the best tool from these options (not just the first one) and call the getToolPack function with the id. {response.json()}"
+                result_message = f"Here is a list of tools you can select from.  You should choose the best tool from these options (not just the first one) and call the getToolPack function with the id. {response_text}"
         if not functions:
             # if default tool has been loaded return it as available tool; otherwise tool was called directly and default tool not being used.
-            if self.__class__._find_function("getLucky"):
-                functions = self.__class__._find_function("getLucky").functions
+            lucky = self.__class__._find_function("getLucky")
+            if lucky:
+                functions = lucky.functions
         return result_message, functions
 
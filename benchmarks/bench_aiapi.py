@@ -0,0 +1,189 @@
+'''
+Benchmarks for aiapi's client-side overhead against the offline mock server.
+
+    python benchmarks/bench_aiapi.py
+    python benchmarks/bench_aiapi.py --requests 500 --json bench.json
+    python benchmarks/bench_aiapi.py --compare bench.json  # exit 1 on regressions
+
+The mock server runs in a subprocess so the CPU time reported per request
+is the client's alone.  With the default zero upstream latency, throughput
+and latency are dominated by aiapi itself (request building, pydantic
+validation, JSON and SSE parsing, tool dispatch).
+'''
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+import orjson
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiapi import AIChat, AsyncAIChat, AITool, VandBasicAPITool  # noqa: E402
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def summarize(name: str, latencies: List[float], wall: float, cpu: float) -> Dict[str, float]:
+    n = len(latencies)
+    return {
+        "name": name,
+        "requests": n,
+        "throughput": n / wall if wall else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "cpu_ms_per_request": cpu / n * 1000 if n else 0.0,
+    }
+
+
+def run_sync(name: str, n: int, func: Callable[[int], None]) -> Dict[str, float]:
+    func(-1)  # warm up connections and caches
+    latencies = []
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    for i in range(n):
+        start = time.perf_counter()
+        func(i)
+        latencies.append(time.perf_counter() - start)
+    return summarize(name, latencies, time.perf_counter() - wall_start, time.process_time() - cpu_start)
+
+
+def start_mock_server(extra_args: List[str]) -> Tuple[subprocess.Popen, str]:
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "aiapi.mock_server", "--port", "0", *extra_args],
+        stdout=subprocess.PIPE,
+        text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    line = proc.stdout.readline()
+    return proc, line.strip().rsplit(" ", 1)[-1]
+
+
+def bench_tool(city: str = None):
+    """Get the current weather for a city."""
+    return {"context": f"It is sunny in {city}."}
+
+
+bench_tool_spec = {
+    "name": "benchWeather",
+    "description": "Get the current weather for a city.",
+    "parameters": {
+        "type": "object",
+        "properties": {"city": {"type": "string", "description": "The city name."}},
+    },
+}
+
+
+def run_benchmarks(url: str, n: int, concurrency: int) -> List[Dict[str, float]]:
+    chat_url = f"{url}/v1/chat/completions"
+    VandBasicAPITool.base_url = f"{url}/api/v1"
+    AITool.define_function(spec=bench_tool_spec, func=lambda city=None: f"It is sunny in {city}.")
+
+    ai = AIChat(console=False, api_key="sk-mock", api_url=chat_url, save_messages=False)
+    results = []
+
+    results.append(run_sync("AIChat.__call__", n, lambda i: ai("Hello there!")))
+
+    def stream(i):
+        for _ in ai.stream("Hello there!"):
+            pass
+
+    results.append(run_sync("AIChat.stream", n, stream))
+    results.append(run_sync("function_call chain (local AITool)", n, lambda i: ai("Weather in Detroit?", functions=["benchWeather"])))
+    results.append(run_sync("function_call chain (Vand toolpack)", n, lambda i: ai("Weather in Detroit?", functions=["vand-mock"])))
+    results.append(run_sync("gen_with_tools", n, lambda i: ai("Weather in Detroit?", tools=[bench_tool])))
+    results.append(asyncio.run(bench_async(chat_url, n, concurrency)))
+    return results
+
+
+async def bench_async(chat_url: str, n: int, concurrency: int) -> Dict[str, float]:
+    ai = AsyncAIChat(console=False, api_key="sk-mock", api_url=chat_url, save_messages=False)
+    ids = []
+    for i in range(concurrency):
+        sess = ai.new_session(return_session=True, api_key="sk-mock", api_url=chat_url, save_messages=False)
+        ai.sessions[sess.id] = sess
+        ids.append(sess.id)
+    await ai("Hello there!", id=ids[0])
+
+    latencies = []
+
+    async def worker(session_id, count):
+        for _ in range(count):
+            start = time.perf_counter()
+            await ai("Hello there!", id=session_id)
+            latencies.append(time.perf_counter() - start)
+
+    per_worker = max(1, n // concurrency)
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    await asyncio.gather(*(worker(sid, per_worker) for sid in ids))
+    result = summarize(f"AsyncAIChat x{concurrency}", latencies, time.perf_counter() - wall_start, time.process_time() - cpu_start)
+    await ai.client.aclose()
+    return result
+
+
+def print_table(results: List[Dict[str, float]]) -> None:
+    header = f"{'benchmark':<38} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'cpu ms/req':>11}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['name']:<38} {r['throughput']:>9.1f} {r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['cpu_ms_per_request']:>11.3f}")
+
+
+def compare(results: List[Dict[str, float]], baseline_path: str, tolerance: float) -> List[str]:
+    with open(baseline_path, "rb") as f:
+        baseline = {r["name"]: r for r in orjson.loads(f.read())["results"]}
+    regressions = []
+    for r in results:
+        base = baseline.get(r["name"])
+        if base and r["cpu_ms_per_request"] > base["cpu_ms_per_request"] * (1 + tolerance):
+            regressions.append(
+                f"{r['name']}: {r['cpu_ms_per_request']:.3f} cpu ms/req vs {base['cpu_ms_per_request']:.3f} baseline"
+            )
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per benchmark.")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent sessions for AsyncAIChat.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Mock upstream latency in seconds.")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Mock upstream token rate.")
+    parser.add_argument("--url", help="Use an already running mock server instead of starting one.")
+    parser.add_argument("--json", help="Write the results to this file.")
+    parser.add_argument("--compare", help="Baseline results file; exit 1 if CPU per request regressed.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed regression for --compare.")
+    args = parser.parse_args(argv)
+
+    proc = None
+    url = args.url
+    if not url:
+        proc, url = start_mock_server(["--latency", str(args.latency), "--tokens-per-second", str(args.tokens_per_second)])
+    try:
+        results = run_benchmarks(url, args.requests, args.concurrency)
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "wb") as f:
+            f.write(orjson.dumps({"python": sys.version.split()[0], "results": results}, option=orjson.OPT_INDENT_2))
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
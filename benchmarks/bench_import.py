@@ -0,0 +1,116 @@
+'''
+Cold-start benchmark: import time of aiapi in fresh interpreters.
+
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --runs 20 --max-ms 300 --json import.json
+    python benchmarks/bench_import.py --compare import.json  # exit 1 on regressions
+
+Each scenario runs in a new subprocess so nothing is cached between runs.
+Besides timing, it checks that `import aiapi` loads no dependencies and
+that the optional ones (rich, termcolor, dateutil, requests, dotenv) are
+only imported when the features that use them are.
+'''
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+import orjson
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+OPTIONAL = ["rich", "termcolor", "dateutil", "requests", "dotenv"]
+
+# name, statement, modules that must not be loaded afterwards
+SCENARIOS = [
+    ("import aiapi", "import aiapi", OPTIONAL + ["httpx", "pydantic"]),
+    ("from aiapi import AIChat", "from aiapi import AIChat", OPTIONAL),
+    (
+        "AIChat(console=False)",
+        "from aiapi import AIChat; AIChat(console=False, api_key='sk-bench')",
+        ["rich", "termcolor", "dateutil", "requests"],
+    ),
+]
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+loaded = [m for m in {forbidden!r} if m in sys.modules]
+print(elapsed, ",".join(loaded))
+"""
+
+
+def run_once(statement: str, forbidden: List[str]) -> Tuple[float, List[str]]:
+    code = PROBE.format(statement=statement, forbidden=forbidden)
+    # no .env lookups or proxies from the caller's environment
+    env = {k: v for k, v in os.environ.items() if k.lower() not in ("https_proxy", "http_proxy")}
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    elapsed, _, loaded = out.stdout.strip().partition(" ")
+    return float(elapsed), [m for m in loaded.split(",") if m]
+
+
+def run_benchmarks(runs: int) -> List[Dict[str, float]]:
+    results = []
+    for name, statement, forbidden in SCENARIOS:
+        timings, loaded = [], set()
+        for _ in range(runs):
+            elapsed, modules = run_once(statement, forbidden)
+            timings.append(elapsed)
+            loaded.update(modules)
+        results.append({
+            "name": name,
+            "median_ms": statistics.median(timings) * 1000,
+            "min_ms": min(timings) * 1000,
+            "unexpected_modules": sorted(loaded),
+        })
+    return results
+
+
+def print_table(results: List[Dict[str, float]]) -> None:
+    header = f"{'scenario':<28} {'median ms':>10} {'min ms':>9}  unexpected imports"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['name']:<28} {r['median_ms']:>10.1f} {r['min_ms']:>9.1f}  {', '.join(r['unexpected_modules']) or '-'}")
+
+
+def check(results: List[Dict[str, float]], max_ms: float = None, baseline_path: str = None, tolerance: float = 0.25) -> List[str]:
+    failures = [f"{r['name']}: imported {', '.join(r['unexpected_modules'])}" for r in results if r["unexpected_modules"]]
+    if max_ms is not None:
+        failures += [f"{r['name']}: {r['median_ms']:.1f} ms > {max_ms:.1f} ms" for r in results if r["median_ms"] > max_ms]
+    if baseline_path:
+        with open(baseline_path, "rb") as f:
+            baseline = {r["name"]: r for r in orjson.loads(f.read())["results"]}
+        for r in results:
+            base = baseline.get(r["name"])
+            if base and r["median_ms"] > base["median_ms"] * (1 + tolerance):
+                failures.append(f"{r['name']}: {r['median_ms']:.1f} ms vs {base['median_ms']:.1f} ms baseline")
+    return failures
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="Fresh interpreters per scenario.")
+    parser.add_argument("--max-ms", type=float, help="Fail if any scenario's median exceeds this.")
+    parser.add_argument("--json", help="Write the results to this file.")
+    parser.add_argument("--compare", help="Baseline results file; exit 1 if import time regressed.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed regression for --compare.")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.runs)
+    print_table(results)
+    if args.json:
+        with open(args.json, "wb") as f:
+            f.write(orjson.dumps({"python": sys.version.split()[0], "results": results}, option=orjson.OPT_INDENT_2))
+    failures = check(results, args.max_ms, args.compare, args.tolerance)
+    for line in failures:
+        print(f"FAIL {line}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
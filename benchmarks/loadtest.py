@@ -0,0 +1,227 @@
+'''
+Load test AsyncAIChat with many concurrent sessions against the mock upstream.
+
+    python benchmarks/loadtest.py --levels 10,100,1000,10000 --report loadtest.json
+
+Each level creates that many sessions on one AsyncAIChat and runs `--turns`
+streamed turns per session concurrently.  For every level the report records
+requests/sec, time to first token, event-loop lag, memory growth per session
+and connection-pool saturation, and is written as JSON so runs can be
+compared across versions with --compare.
+'''
+import argparse
+import asyncio
+import gc
+import os
+import resource
+import sys
+import time
+from typing import Dict, List
+
+import httpx
+import orjson
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiapi import AsyncAIChat  # noqa: E402
+from bench_aiapi import percentile, start_mock_server  # noqa: E402
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # peak RSS; kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def pool_connections(client: httpx.AsyncClient) -> int:
+    # httpx does not expose pool state publicly; best effort for the default transport
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    return len(getattr(pool, "connections", ()))
+
+
+class LoopMonitor:
+    """Samples event-loop lag and pool usage every `interval` seconds."""
+
+    def __init__(self, client: httpx.AsyncClient, interval: float = 0.01):
+        self.client = client
+        self.interval = interval
+        self.lags: List[float] = []
+        self.pool_peak = 0
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - start - self.interval))
+            self.pool_peak = max(self.pool_peak, pool_connections(self.client))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+async def run_level(chat_url: str, sessions: int, turns: int, max_connections: int) -> Dict[str, float]:
+    gc.collect()
+    rss_start = rss_bytes()
+
+    ai = AsyncAIChat(console=False, default_session=False, api_key="sk-mock", api_url=chat_url)
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    ai.client = httpx.AsyncClient(limits=limits)
+    ids = []
+    for _ in range(sessions):
+        sess = ai.new_session(return_session=True, api_key="sk-mock", api_url=chat_url)
+        ai.sessions[sess.id] = sess
+        ids.append(sess.id)
+
+    ttfts: List[float] = []
+    latencies: List[float] = []
+    errors = 0
+    inflight = 0
+    inflight_peak = 0
+
+    async def session_worker(session_id):
+        nonlocal errors, inflight, inflight_peak
+        for _ in range(turns):
+            start = time.perf_counter()
+            inflight += 1
+            inflight_peak = max(inflight_peak, inflight)
+            try:
+                first = None
+                async for _ in await ai.stream("Hello there!", id=session_id):
+                    if first is None:
+                        first = time.perf_counter() - start
+                ttfts.append(first if first is not None else time.perf_counter() - start)
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                errors += 1
+            finally:
+                inflight -= 1
+
+    monitor = LoopMonitor(ai.client)
+    monitor.start()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    await asyncio.gather(*(session_worker(sid) for sid in ids))
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    await monitor.stop()
+
+    gc.collect()
+    rss_end = rss_bytes()
+    completed = len(latencies)
+    result = {
+        "sessions": sessions,
+        "requests": completed,
+        "errors": errors,
+        "requests_per_sec": completed / wall if wall else 0.0,
+        "ttft_p50_ms": percentile(ttfts, 50) * 1000,
+        "ttft_p99_ms": percentile(ttfts, 99) * 1000,
+        "latency_p50_ms": percentile(latencies, 50) * 1000,
+        "latency_p99_ms": percentile(latencies, 99) * 1000,
+        "loop_lag_p99_ms": percentile(monitor.lags, 99) * 1000,
+        "loop_lag_max_ms": max(monitor.lags, default=0.0) * 1000,
+        "cpu_ms_per_request": cpu / completed * 1000 if completed else 0.0,
+        "memory_bytes_per_session": (rss_end - rss_start) / sessions,
+        "inflight_peak": inflight_peak,
+        "pool_max_connections": max_connections,
+        "pool_connections_peak": monitor.pool_peak,
+        "pool_saturation": monitor.pool_peak / max_connections,
+    }
+    await ai.client.aclose()
+    return result
+
+
+def print_level(r: Dict[str, float]) -> None:
+    print(
+        f"{r['sessions']:>6} sessions  {r['requests_per_sec']:>8.1f} req/s  "
+        f"ttft p50 {r['ttft_p50_ms']:>7.1f} ms p99 {r['ttft_p99_ms']:>7.1f} ms  "
+        f"loop lag p99 {r['loop_lag_p99_ms']:>6.1f} ms  "
+        f"{r['memory_bytes_per_session'] / 1024:>7.1f} KiB/session  "
+        f"pool {r['pool_connections_peak']}/{r['pool_max_connections']}  errors {r['errors']}"
+    )
+
+
+def compare(levels: List[Dict[str, float]], baseline_path: str, tolerance: float) -> List[str]:
+    with open(baseline_path, "rb") as f:
+        baseline = {r["sessions"]: r for r in orjson.loads(f.read())["levels"]}
+    regressions = []
+    for r in levels:
+        base = baseline.get(r["sessions"])
+        if not base:
+            continue
+        if r["requests_per_sec"] < base["requests_per_sec"] * (1 - tolerance):
+            regressions.append(f"{r['sessions']} sessions: {r['requests_per_sec']:.1f} req/s vs {base['requests_per_sec']:.1f} baseline")
+        if r["ttft_p99_ms"] > base["ttft_p99_ms"] * (1 + tolerance):
+            regressions.append(f"{r['sessions']} sessions: ttft p99 {r['ttft_p99_ms']:.1f} ms vs {base['ttft_p99_ms']:.1f} baseline")
+    return regressions
+
+
+async def run(args: argparse.Namespace, url: str) -> List[Dict[str, float]]:
+    chat_url = f"{url}/v1/chat/completions"
+    levels = []
+    for sessions in args.levels:
+        result = await run_level(chat_url, sessions, args.turns, args.max_connections)
+        print_level(result)
+        levels.append(result)
+    return levels
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", type=lambda s: [int(x) for x in s.split(",")], default=[10, 100, 1000, 10000])
+    parser.add_argument("--turns", type=int, default=2, help="Streamed turns per session.")
+    parser.add_argument("--max-connections", type=int, default=100, help="Client connection pool size.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock upstream latency in seconds.")
+    parser.add_argument("--tokens-per-second", type=float, default=1000.0, help="Mock upstream token rate.")
+    parser.add_argument("--url", help="Use an already running mock server instead of starting one.")
+    parser.add_argument("--report", help="Write the JSON report to this file.")
+    parser.add_argument("--compare", help="Baseline report; exit 1 on throughput or TTFT regressions.")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    # each pooled connection and session needs file descriptors on both ends
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    # macOS rejects RLIM_INFINITY (and anything above its own cap) as a soft limit
+    target = 65536 if hard == resource.RLIM_INFINITY else min(hard, 65536)
+    if target > soft:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        except (ValueError, OSError):
+            pass
+
+    proc = None
+    url = args.url
+    if not url:
+        proc, url = start_mock_server(["--latency", str(args.latency), "--tokens-per-second", str(args.tokens_per_second)])
+    try:
+        levels = asyncio.run(run(args, url))
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+
+    if args.report:
+        report = {"python": sys.version.split()[0], "turns": args.turns, "levels": levels}
+        with open(args.report, "wb") as f:
+            f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+    if args.compare:
+        regressions = compare(levels, args.compare, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
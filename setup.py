@@ -14,16 +14,17 @@ setup(
     classifiers=[],
     license="MIT",
     entry_points={
-        "console_scripts": ["simpleaichat=simpleaichat.cli:interactive_chat"]
+        "console_scripts": ["aiapi=aiapi.cli:main"]
     },
     python_requires=">=3.10",
     install_requires=[
         "pydantic>=2.0",
-        "fire>=0.3.0",
         "httpx>=0.24.1",
         "python-dotenv>=1.0.0",
         "orjson>=3.9.0",
         "rich>=13.4.1",
         "python-dateutil>=2.8.2",
+        "requests>=2.28.0",
+        "termcolor>=2.0.0",
     ],
 )
\ No newline at end of file
@@ -0,0 +1,85 @@
+import asyncio
+
+import httpx
+import pytest
+
+from aiapi import utils
+from aiapi.cache import PersistentTTLCache, TTLCache
+
+
+def wikipedia(requests):
+    def handler(request):
+        requests.append(dict(request.url.params))
+        return httpx.Response(200, json={"query": {"pages": [
+            {"index": 2, "extract": "Second result."},
+            {"index": 1, "extract": "Captain Ahab is a sea captain."},
+        ]}})
+
+    return handler
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = PersistentTTLCache(str(tmp_path), ttl=60)
+    monkeypatch.setattr(utils, "_character_cache", cache)
+    return cache
+
+
+def test_lookup_is_one_request_and_cached(cache):
+    requests = []
+    client = httpx.Client(transport=httpx.MockTransport(wikipedia(requests)))
+    assert utils.character_lookup("Captain Ahab", client=client) == "Captain Ahab is a sea captain."
+    assert utils.character_lookup("Captain Ahab", client=client) == "Captain Ahab is a sea captain."
+    assert len(requests) == 1
+    assert requests[0]["generator"] == "search" and requests[0]["prop"] == "extracts"
+
+
+def test_async_lookup_shares_the_cache(cache):
+    requests = []
+    client = httpx.AsyncClient(transport=httpx.MockTransport(wikipedia(requests)))
+    first = asyncio.run(utils.character_lookup_async("Captain Ahab", client=client))
+    sync_client = httpx.Client(transport=httpx.MockTransport(wikipedia(requests)))
+    assert utils.character_lookup("Captain Ahab", client=sync_client) == first
+    assert len(requests) == 1
+
+
+def test_persistent_cache_survives_a_restart(tmp_path):
+    PersistentTTLCache(str(tmp_path), ttl=60).set(("Ahab", 1), "A captain.")
+    cache = PersistentTTLCache(str(tmp_path), ttl=60)
+    assert cache.get(("Ahab", 1)) == "A captain."
+    assert cache.hits == 1 and cache.misses == 0
+
+
+def test_persistent_cache_expires_on_disk(tmp_path):
+    PersistentTTLCache(str(tmp_path), ttl=-1).set("key", "value")
+    assert PersistentTTLCache(str(tmp_path), ttl=60).get("key") is None
+
+
+def test_memory_only_without_a_directory():
+    cache = PersistentTTLCache(None)
+    cache.set("key", "value")
+    assert cache.get("key") == "value"
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_shared_clients_are_recreated_once_closed():
+    client = utils.shared_client()
+    assert utils.shared_client() is client
+    client.close()
+    assert utils.shared_client() is not client
+
+    async def main():
+        client = utils.shared_async_client()
+        assert utils.shared_async_client() is client
+        await client.aclose()
+        return utils.shared_async_client() is not client
+
+    assert asyncio.run(main())
@@ -0,0 +1,155 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from aiapi.cache import FailedResult
+from aiapi.circuit import CircuitBreaker, CircuitOpenError, LoadShedder, OverloadedError
+from aiapi.vand_utils import VandBasicAPITool
+
+
+def trip(breaker):
+    for _ in range(breaker.min_calls):
+        breaker.allow()
+        breaker.record(False, 0.0)
+
+
+def test_opens_once_the_failure_rate_is_reached():
+    breaker = CircuitBreaker(min_calls=4, failure_rate=0.5)
+    for ok in (True, False, True):
+        breaker.allow()
+        breaker.record(ok, 0.0)
+    assert breaker.state == "closed"
+    breaker.allow()
+    breaker.record(False, 0.0)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError) as e:
+        breaker.allow()
+    assert 0 < e.value.retry_after <= breaker.open_seconds
+
+
+def test_slow_calls_count():
+    breaker = CircuitBreaker(min_calls=2, slow_call_seconds=1.0, slow_call_rate=0.5)
+    breaker.record(True, 0.1)
+    breaker.record(True, 2.0)
+    assert breaker.state == "open"
+
+
+def test_half_open_probe_success_closes():
+    breaker = CircuitBreaker(min_calls=2, open_seconds=0.05, half_open_calls=1)
+    trip(breaker)
+    time.sleep(0.06)
+    breaker.allow()
+    assert breaker.state == "half_open"
+    # only the probe goes through
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.record(True, 0.0)
+    assert breaker.state == "closed"
+    breaker.allow()
+
+
+def test_half_open_probe_failure_reopens():
+    breaker = CircuitBreaker(min_calls=2, open_seconds=0.05)
+    trip(breaker)
+    time.sleep(0.06)
+    breaker.allow()
+    breaker.record(False, 0.0)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_half_open_needs_every_probe():
+    breaker = CircuitBreaker(min_calls=2, open_seconds=0.05, half_open_calls=2)
+    trip(breaker)
+    time.sleep(0.06)
+    breaker.allow()
+    breaker.allow()
+    breaker.record(True, 0.0)
+    assert breaker.state == "half_open"
+    breaker.record(True, 0.0)
+    assert breaker.state == "closed"
+
+
+def test_cancelled_probe_frees_its_place():
+    breaker = CircuitBreaker(min_calls=2, open_seconds=0.05)
+    trip(breaker)
+    time.sleep(0.06)
+    breaker.allow()
+    breaker.cancel()
+    breaker.allow()
+    assert breaker.state == "half_open"
+
+
+def test_guard_records_exceptions_and_statuses():
+    breaker = CircuitBreaker(min_calls=2)
+    with pytest.raises(RuntimeError):
+        with breaker.guard():
+            raise RuntimeError("upstream broke")
+    with breaker.guard() as call:
+        call.status(503)
+    assert breaker.state == "open"
+
+
+def test_guard_ignores_client_errors():
+    breaker = CircuitBreaker(min_calls=2)
+    for _ in range(3):
+        with breaker.guard() as call:
+            call.status(404)
+    assert breaker.state == "closed"
+
+
+def test_get_shares_breakers_by_name():
+    assert CircuitBreaker.get("http://tools.test") is CircuitBreaker.get("http://tools.test")
+
+
+def test_load_shedder():
+    shedder = LoadShedder(max_pending=1)
+    with shedder.admit():
+        with pytest.raises(OverloadedError):
+            with shedder.admit():
+                pass
+    assert shedder.pending == 0
+    with shedder.admit():
+        pass
+
+
+class SlowBody(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "4")
+        self.end_headers()
+        self.wfile.flush()
+        time.sleep(0.3)
+        self.wfile.write(b"done")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def tool(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowBody)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    monkeypatch.setattr(CircuitBreaker, "instances", {})
+    tool = VandBasicAPITool("test", [{"url": url}], [("GET /x", "x", "", {"parameters": []})], [{"name": "x"}])
+    monkeypatch.setattr(tool, "_find_endpoint", lambda name: ("GET /x", "x", "", {"parameters": []}))
+    yield tool
+    server.shutdown()
+
+
+def test_slow_tool_bodies_count_against_the_server(tool, monkeypatch):
+    monkeypatch.setattr(CircuitBreaker, "defaults", {"min_calls": 2, "slow_call_seconds": 0.2})
+    assert tool.execute_tool_call("x")[0] == "done"
+    assert tool.execute_tool_call("x")[0] == "done"
+    result = tool.execute_tool_call("x")[0]
+    assert isinstance(result, FailedResult) and "retry in" in result
+
+
+def test_tool_timeouts_are_reported_as_unavailable(tool, monkeypatch):
+    monkeypatch.setattr(VandBasicAPITool, "request_timeout", 0.1)
+    result = tool.execute_tool_call("x")[0]
+    assert isinstance(result, FailedResult) and "temporarily unavailable" in result
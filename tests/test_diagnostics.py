@@ -0,0 +1,75 @@
+import tracemalloc
+
+import httpx
+import pytest
+
+from aiapi import AIChat
+from aiapi.diagnostics import AllocationProfiler, deep_sizeof, package_of
+
+
+def reply(request):
+    return httpx.Response(200, json={
+        "choices": [{"message": {"role": "assistant", "content": "answer"}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 3, "completion_tokens": 1, "total_tokens": 4},
+    })
+
+
+@pytest.fixture
+def profiler():
+    profiler = AllocationProfiler()
+    yield profiler
+    profiler.stop()
+
+
+def test_calls_are_attributed_to_their_session(profiler):
+    ai = AIChat(console=False, api_key="sk", profiler=profiler)
+    ai.client = httpx.Client(transport=httpx.MockTransport(reply))
+    ai("one")
+    ai("two")
+    sess = ai.get_session()
+    assert profiler.session_calls[sess.id] == 2
+    assert [r.session_id for r in profiler.records] == [sess.id, sess.id]
+
+    report = profiler.report()
+    assert report["sessions"][str(sess.id)]["calls"] == 2
+    assert report["sessions"][str(sess.id)]["messages"] == 4
+    assert set(report) >= {"traced_bytes", "growth_bytes", "by_package", "top_growth", "toolpacks"}
+
+
+def test_stop_ends_tracing_it_started(profiler):
+    assert not tracemalloc.is_tracing()
+    with profiler.track(label="work"):
+        data = [str(i) for i in range(1000)]
+    assert profiler.records[-1].label == "work"
+    assert profiler.records[-1].size_diff > 0
+    profiler.stop()
+    assert not profiler.running and not tracemalloc.is_tracing()
+    del data
+
+
+def test_report_needs_a_started_profiler(profiler):
+    with pytest.raises(AssertionError):
+        profiler.report()
+
+
+def test_history_is_bounded():
+    profiler = AllocationProfiler(history=3)
+    try:
+        for _ in range(5):
+            with profiler.track():
+                pass
+    finally:
+        profiler.stop()
+    assert len(profiler.records) == 3
+    assert profiler.session_calls[None] == 5
+
+
+def test_deep_sizeof_counts_shared_objects_once():
+    item = "x" * 1000
+    assert deep_sizeof([item, item]) < deep_sizeof([item, "y" * 1000])
+
+
+def test_package_of():
+    assert package_of("/usr/lib/python3.11/site-packages/httpx/_client.py") == "httpx"
+    assert package_of("/src/aiapi/chatgpt.py") == "aiapi"
+    assert package_of("/usr/lib/python3.11/json/decoder.py") == "stdlib"
@@ -0,0 +1,120 @@
+import asyncio
+
+import httpx
+import pytest
+
+from aiapi import AsyncAIChat
+from aiapi.circuit import CircuitBreaker
+from aiapi.gateway import Gateway
+from aiapi.httpserver import HTTPServer
+
+
+def upstream(mode=None):
+    return httpx.MockTransport(lambda request: reply(request, mode))
+
+
+def reply(request, mode):
+    if mode == "timeout":
+        raise httpx.ReadTimeout("timed out", request=request)
+    if mode == "refused":
+        raise httpx.ConnectError("connection refused", request=request)
+    if mode == "error":
+        return httpx.Response(500, json={"error": {"message": "upstream broke"}})
+    return httpx.Response(200, json={
+        "choices": [{"message": {"role": "assistant", "content": "answer"}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 3, "completion_tokens": 1, "total_tokens": 4},
+    })
+
+
+def serve(requests, mode=None, **gateway_kwargs):
+    """Send `requests` ((method, path, body bytes) tuples) through a gateway over HTTP."""
+    async def main():
+        ai = AsyncAIChat(console=False, default_session=False)
+        ai.client = httpx.AsyncClient(transport=upstream(mode))
+        defaults = {"api_key": "sk", **gateway_kwargs.pop("session_defaults", {})}
+        gateway = Gateway(ai, session_defaults=defaults, **gateway_kwargs)
+        server = await HTTPServer(gateway).start()
+        try:
+            async with httpx.AsyncClient(base_url=server.url) as client:
+                return [await client.request(method, path, content=body) for method, path, body in requests]
+        finally:
+            await server.close()
+
+    return asyncio.run(main())
+
+
+def send(mode=None, **gateway_kwargs):
+    created, sent = serve(
+        [("POST", "/sessions", b'{"id": "s"}'), ("POST", "/sessions/s/messages", b'{"prompt": "hi"}')],
+        mode,
+        **gateway_kwargs,
+    )
+    assert created.status_code == 201
+    return sent
+
+
+def test_message():
+    r = send()
+    assert r.status_code == 200
+    assert r.json() == {"id": "s", "response": "answer", "tokens": 4}
+
+
+@pytest.mark.parametrize("body", [b"{bad json", b"[1, 2]", b'"text"'])
+@pytest.mark.parametrize("path", ["/sessions", "/sessions/s/messages"])
+def test_bad_bodies_are_400(path, body):
+    r = serve([("POST", "/sessions", b'{"id": "s"}'), ("POST", path, body)])[1]
+    assert r.status_code == 400
+    assert r.json()["error"]["type"] == "invalid_request_error"
+
+
+def test_missing_prompt_is_400():
+    r = serve([("POST", "/sessions", b'{"id": "s"}'), ("POST", "/sessions/s/messages", b"{}")])[1]
+    assert r.status_code == 400
+
+
+def test_full_queue_is_429():
+    r = send(max_queue=0)
+    assert (r.status_code, r.reason_phrase) == (429, "Too Many Requests")
+    assert r.headers["retry-after"] == "1"
+
+
+@pytest.mark.parametrize("mode", ["refused", "error"])
+def test_upstream_failures_are_502(mode):
+    r = send(mode)
+    assert (r.status_code, r.reason_phrase) == (502, "Bad Gateway")
+    assert r.json()["error"]["type"] == "upstream_error"
+
+
+def test_upstream_timeout_is_504():
+    r = send("timeout")
+    assert (r.status_code, r.reason_phrase) == (504, "Gateway Timeout")
+    assert r.json()["error"]["type"] == "upstream_timeout"
+
+
+def test_open_circuit_is_503():
+    breaker = CircuitBreaker("gateway-test", min_calls=1, open_seconds=60)
+    breaker.record(False, 0.0)
+    r = send(session_defaults={"circuit_breaker": breaker})
+    assert (r.status_code, r.reason_phrase) == (503, "Service Unavailable")
+    assert int(r.headers["retry-after"]) > 0
+
+
+def test_closing_gateway_is_503():
+    async def main():
+        ai = AsyncAIChat(console=False, default_session=False)
+        ai.client = httpx.AsyncClient(transport=upstream())
+        gateway = Gateway(ai)
+        gateway.closing = True
+        server = await HTTPServer(gateway).start()
+        try:
+            async with httpx.AsyncClient(base_url=server.url) as client:
+                return await client.post("/sessions", content=b"{}")
+        finally:
+            await server.close()
+
+    assert asyncio.run(main()).status_code == 503
+
+
+def test_unknown_session_is_404():
+    r = serve([("POST", "/sessions/missing/messages", b'{"prompt": "hi"}')])[0]
+    assert r.status_code == 404
@@ -0,0 +1,90 @@
+import asyncio
+import gc
+
+import httpx
+import orjson
+import pytest
+
+from aiapi import AsyncAIChat
+
+
+async def search(query):
+    """Search the web."""
+    return "context"
+
+
+def make_chat(selection, fail_plain=False, plain_delay=0.01):
+    async def handler(request):
+        body = orjson.loads(request.content)
+        # the tool selection asks for a single token
+        selecting = body.get("max_tokens") == 1
+        if fail_plain and not selecting:
+            return httpx.Response(400, json={"error": {"message": "bad request"}})
+        await asyncio.sleep(0.05 if selecting else plain_delay)
+        usage = {"prompt_tokens": 3, "completion_tokens": 2, "total_tokens": 5} if selecting else {
+            "prompt_tokens": 3, "completion_tokens": 5, "total_tokens": 8}
+        content = selection if selecting else "answer"
+        return httpx.Response(200, json={
+            "choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+    ai = AsyncAIChat(console=False, api_key="sk")
+    ai.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return ai
+
+
+@pytest.mark.parametrize("speculative", [False, True])
+def test_kept_speculative_answer_is_saved_like_a_plain_one(speculative):
+    ai = make_chat("0")
+    result = asyncio.run(ai("hi", tools=[search], speculative=speculative))
+    sess = ai.get_session()
+    assert result == {"response": "answer", "tool": None}
+    assert [m.role for m in sess.messages] == ["user", "assistant"]
+    answer = sess.messages[-1]
+    assert (answer.finish_reason, answer.prompt_length, answer.completion_length, answer.total_length) == ("stop", 3, 5, 8)
+    # selection (5) + answer (8)
+    assert sess.total_length == 13
+
+
+def test_discarded_speculative_answer_is_not_counted():
+    ai = make_chat("1")
+    result = asyncio.run(ai("hi", tools=[search], speculative=True))
+    assert result["tool"] == "search"
+    # selection (5) + answer from the context (8); the speculative answer is dropped
+    assert ai.get_session().total_length == 13
+
+
+def test_discarded_speculative_request_is_finished_on_return():
+    async def main():
+        async def broken(query):
+            """Search the web."""
+            raise RuntimeError("tool failed")
+
+        # still running when the tool is selected, and nothing is awaited after it
+        ai = make_chat("1", plain_delay=0.5)
+        with pytest.raises(RuntimeError):
+            await ai("hi", tools=[broken], speculative=True)
+        return asyncio.all_tasks() - {asyncio.current_task()}
+
+    assert asyncio.run(main()) == set()
+
+
+def test_failed_speculative_request_is_not_reported():
+    errors = []
+
+    async def main():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        ai = make_chat("1", fail_plain=True)
+        # the answer from the context fails too; the traceback is dropped so the task can be collected
+        try:
+            await ai("hi", tools=[search], speculative=True)
+        except KeyError:
+            pass
+        else:
+            pytest.fail("expected the answer to fail")
+        # an unretrieved task exception is reported when the task is collected
+        gc.collect()
+
+    asyncio.run(main())
+    assert errors == []
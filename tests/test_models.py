@@ -0,0 +1,95 @@
+import pytest
+from pydantic import ValidationError
+
+from aiapi import AIChat
+from aiapi.models import ChatMessage, MessageHistory
+
+
+def message(i):
+    return ChatMessage(role="user", content=str(i))
+
+
+def contents(history):
+    return [m.content for m in history]
+
+
+def test_fork_shares_history_up_to_the_fork():
+    base = MessageHistory([message(0), message(1)])
+    fork = base.fork()
+    base.append(message(2))
+    fork.append(message(3))
+    assert contents(base) == ["0", "1", "2"]
+    assert contents(fork) == ["0", "1", "3"]
+    assert fork[1] is base[1]
+
+
+def test_indexing_and_slicing():
+    history = MessageHistory([message(0)])
+    for i in range(1, 6):
+        history = history.fork()
+        history.append(message(i))
+    assert len(history) == 6
+    assert history[-1].content == "5" and history[0].content == "0"
+    assert contents(history[1:4]) == ["1", "2", "3"]
+    assert contents(history[::2]) == ["0", "2", "4"]
+    with pytest.raises(IndexError):
+        history[6]
+
+
+def test_fork_without_own_messages_shares_the_base():
+    base = MessageHistory([message(0)])
+    child = base.fork()
+    grandchild = child.fork()
+    assert grandchild._base is base and grandchild._depth == child._depth
+
+
+def test_deep_fork_chains_are_flattened():
+    history = MessageHistory([message(0)])
+    depths = []
+    for i in range(1, 3 * MessageHistory.max_depth):
+        history = history.fork()
+        history.append(message(i))
+        depths.append(history._depth)
+    assert max(depths) == MessageHistory.max_depth
+    # flattening resets the depth, copying references but never messages
+    assert depths[MessageHistory.max_depth] == 1
+    assert contents(history) == [str(i) for i in range(3 * MessageHistory.max_depth)]
+
+
+def test_equality_with_lists():
+    first, second = message(0), message(1)
+    history = MessageHistory([first]).fork()
+    history.append(second)
+    assert history == [first, second]
+    assert history != [first]
+
+
+def test_serializes_as_a_list():
+    ai = AIChat(console=False, api_key="sk")
+    sess = ai.get_session()
+    sess.messages.append(message(0))
+    fork = ai.fork_session()
+    fork.messages.append(message(1))
+    dumped = fork.model_dump(exclude={"auth"})
+    assert [m["content"] for m in dumped["messages"]] == ["0", "1"]
+    assert type(fork).model_validate_json(fork.model_dump_json()).messages == fork.messages
+
+
+def test_session_fork_overrides_are_validated():
+    ai = AIChat(console=False, api_key="sk")
+    sess = ai.get_session()
+    sess.messages.append(message(0))
+    fork = ai.fork_session(model="gpt-4", params={"temperature": 0})
+    assert (fork.model, fork.params) == ("gpt-4", {"temperature": 0})
+    assert fork.id != sess.id and fork.messages._base is sess.messages
+    assert fork.auth["api_key"].get_secret_value() == "sk"
+    for bad in ({"model": None}, {"params": [1]}, {"total_length": "many"}):
+        with pytest.raises(ValidationError):
+            ai.fork_session(**bad)
+
+
+def test_fork_does_not_share_params():
+    ai = AIChat(console=False, api_key="sk", params={"temperature": 1})
+    fork = ai.fork_session()
+    fork.params["temperature"] = 0
+    assert ai.get_session().params == {"temperature": 1}
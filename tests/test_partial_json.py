@@ -0,0 +1,103 @@
+import orjson
+import pytest
+from pydantic import BaseModel
+
+from aiapi.partial_json import PartialJSONParser, validate_partial
+
+
+def feed_all(text, size):
+    parser = PartialJSONParser()
+    results = [parser.feed(text[i : i + size]) for i in range(0, len(text), size)]
+    return parser, results
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 64])
+@pytest.mark.parametrize(
+    "text",
+    [
+        '{"a": "h\\u00e9\\"llo\\\\n", "b": [1, -2.5e3, true, null, {"c": []}], "d": {"e": "x"}}',
+        '[1, "two", [3, [4, {"five": 5}]], {}, [], "\\u0041\\ud83d\\ude00"]',
+        '{\n  "n": 0.000001,\n  "t": false,\n  "s": "tab\\tend"\n}',
+    ],
+)
+def test_any_split_ends_with_the_full_value(text, size):
+    parser, _ = feed_all(text, size)
+    assert parser.current() == orjson.loads(text)
+
+
+def test_open_string_values_are_included():
+    parser = PartialJSONParser()
+    assert parser.feed('{"name": "Ada') == {"name": "Ada"}
+    assert parser.feed(" Lovelace") == {"name": "Ada Lovelace"}
+
+
+def test_unfinished_keys_are_held_back():
+    parser = PartialJSONParser()
+    assert parser.feed('{"name": "Ada", "ag') == {"name": "Ada"}
+    assert parser.feed('e"') == {"name": "Ada"}
+    assert parser.feed(": ") == {"name": "Ada"}
+
+
+def test_numbers_split_across_deltas():
+    parser = PartialJSONParser()
+    assert parser.feed('{"age": 3') == {}
+    assert parser.feed("6") == {}
+    assert parser.feed(".5") == {}
+    assert parser.feed("e1,") == {"age": 365.0}
+
+
+def test_literals_split_across_deltas():
+    parser = PartialJSONParser()
+    assert parser.feed('[tr') == []
+    assert parser.feed("ue, nu") == [True]
+    assert parser.feed("ll]") == [True, None]
+
+
+@pytest.mark.parametrize("cut", range(1, len('"a\\"b\\\\c\\u00e9d"')))
+def test_escapes_are_never_split(cut):
+    text = '{"s": "a\\"b\\\\c\\u00e9d"}'
+    prefix = text[: 6 + cut]
+    value = PartialJSONParser().feed(prefix)["s"]
+    assert "a\"b\\céd".startswith(value)
+
+
+def test_unicode_escape_split_across_deltas():
+    parser = PartialJSONParser()
+    assert parser.feed('["x\\u00') == ["x"]
+    assert parser.feed("e9") == ["xé"]
+
+
+def test_surrogate_pair_waits_for_the_low_half():
+    parser = PartialJSONParser()
+    assert parser.feed('["\\ud83d') == [""]
+    assert parser.feed("\\ude") == [""]
+    assert parser.feed("00") == ["\U0001F600"]
+
+
+def test_nested_containers_appear_while_open():
+    parser = PartialJSONParser()
+    assert parser.feed('{"a": {"b": [') == {"a": {"b": []}}
+    assert parser.feed('{"c": "d') == {"a": {"b": [{"c": "d"}]}}
+
+
+def test_results_are_independent():
+    parser = PartialJSONParser()
+    first = parser.feed('{"a": [1,')
+    parser.feed(" 2,")
+    assert first == {"a": [1]}
+
+
+def test_invalid_json_gives_none():
+    assert PartialJSONParser().feed('{"a": tru,') is None
+    assert PartialJSONParser().feed('{"a": "x\ny"}') is None
+    assert PartialJSONParser().feed("{}}") is None
+
+
+def test_validate_partial_keeps_only_received_fields():
+    class Person(BaseModel):
+        name: str
+        age: int
+
+    parser = PartialJSONParser()
+    assert validate_partial(Person, parser.feed('{"name": "Ad')) == {"name": "Ad"}
+    assert validate_partial(Person, parser.feed('a", "age": 36}')) == {"name": "Ada", "age": 36}
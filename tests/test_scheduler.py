@@ -0,0 +1,119 @@
+import asyncio
+import threading
+
+import pytest
+
+from aiapi.scheduler import Scheduler, scheduling
+
+
+def grant_order(scheduler, requests):
+    """Fill every slot, queue `requests` ((name, priority, tenant)), then release one at a time."""
+    order = []
+
+    async def request(name, priority, tenant):
+        async with scheduler.slot_async(priority, tenant):
+            order.append(name)
+
+    async def main():
+        for _ in range(scheduler.max_concurrency):
+            await scheduler.acquire_async()
+        tasks = []
+        for name, priority, tenant in requests:
+            tasks.append(asyncio.create_task(request(name, priority, tenant)))
+            await asyncio.sleep(0)
+        assert scheduler.queued == len(requests)
+        for _ in range(scheduler.max_concurrency):
+            scheduler.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    return order
+
+
+def test_higher_priority_goes_first():
+    order = grant_order(Scheduler(max_concurrency=1), [
+        ("batch", "batch", "a"),
+        ("default", "default", "a"),
+        ("interactive", "interactive", "a"),
+    ])
+    assert order == ["interactive", "default", "batch"]
+
+
+def test_tenants_share_slots_fairly():
+    requests = [(f"a{i}", "batch", "a") for i in range(4)] + [(f"b{i}", "batch", "b") for i in range(2)]
+    order = grant_order(Scheduler(max_concurrency=1), requests)
+    # b's requests aren't stuck behind a's backlog
+    assert order == ["a0", "b0", "a1", "b1", "a2", "a3"]
+
+
+def test_weights():
+    requests = [(f"a{i}", "batch", "a") for i in range(4)] + [(f"b{i}", "batch", "b") for i in range(4)]
+    order = grant_order(Scheduler(max_concurrency=1, weights={"a": 3}), requests)
+    # a gets three slots for each of b's
+    assert order == ["a0", "b0", "a1", "a2", "a3", "b1", "b2", "b3"]
+
+
+def test_concurrency_limit():
+    scheduler = Scheduler(max_concurrency=2)
+    peak = 0
+
+    async def request():
+        nonlocal peak
+        async with scheduler.slot_async():
+            peak = max(peak, scheduler.active)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*[request() for _ in range(10)])
+
+    asyncio.run(main())
+    assert peak == 2 and scheduler.active == 0 and scheduler.queued == 0
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    scheduler = Scheduler(max_concurrency=1)
+
+    async def main():
+        await scheduler.acquire_async()
+        waiter = asyncio.create_task(scheduler.acquire_async())
+        await asyncio.sleep(0)
+        assert scheduler.queued == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.queued == 0
+        scheduler.release()
+
+    asyncio.run(main())
+    assert scheduler.active == 0
+
+
+def test_threads_block_until_released():
+    scheduler = Scheduler(max_concurrency=1)
+    scheduler.acquire()
+    done = threading.Event()
+
+    def worker():
+        with scheduler.slot():
+            done.set()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    assert not done.wait(0.05)
+    scheduler.release()
+    assert done.wait(1)
+    thread.join()
+
+
+def test_resolve():
+    scheduler = Scheduler()
+    assert scheduler.resolve() == ("interactive", "default")
+    # 0 is the highest rank, not a missing value
+    assert scheduler.resolve(0, "t") == (0, "t")
+    with scheduling(priority="batch", tenant="job"):
+        assert scheduler.resolve("interactive", "t") == ("batch", "job")
+
+
+def test_unknown_priority():
+    with pytest.raises(ValueError):
+        Scheduler(default_priority="urgent")